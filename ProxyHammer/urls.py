@@ -22,14 +22,14 @@ from hammer import views, forms
 urlpatterns = [
     path(
         "",
-        views.SimplePage.as_view(
+        views.StaticPage.as_view(
             template_name="hammer/index.html", extra_context={"title": "Home"}
         ),
         name="home",
     ),
     path(
         "about/",
-        views.SimplePage.as_view(
+        views.StaticPage.as_view(
             template_name="hammer/about.html", extra_context={"title": "About"}
         ),
         name="about",
@@ -49,6 +49,7 @@ urlpatterns = [
     path("logout/", LogoutView.as_view(next_page="/"), name="logout"),
     path("tools/", views.ToolsPage.as_view(), name="tools"),
     path("execute/<str:tool>", views.execute, name="execute"),
+    path("jobs/status", views.job_status, name="jobstatus"),
     path("list/", views.pager, name="list"),
     path("list/<str:filter_by>", views.pager, name="listf"),
     path("list/asn/<int:asn>", views.list_asn, name="listasn"),
@@ -56,5 +57,12 @@ urlpatterns = [
     path("asn/<int:asn>", views.ASNDetail.as_view(), name="asndetail"),
     path("banip/<int:ip_id>", views.banip, name="banip"),
     path("banasn/<int:asn>", views.banasn, name="banasn"),
+    path("banasns", views.banasns, name="banasns"),
+    path("top/", views.top_asns, name="top"),
+    path("top/<str:state>", views.top_asns, name="topf"),
+    path("export/<str:fmt>", views.export_ranges, name="export"),
+    path("lookup/<path:ip>", views.lookup, name="lookup"),
+    path("api/lookup", views.api_lookup_batch, name="apilookupbatch"),
+    path("api/lookup/<str:ip>", views.api_lookup, name="apilookup"),
     path("admin/", admin.site.urls),
 ]
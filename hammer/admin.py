@@ -2,7 +2,9 @@
 
 from django.contrib import admin
 
-from .models import IPRange, ASN
+from .models import IPRange, ASN, BanAudit, JobRecord
 
 admin.site.register(IPRange)
 admin.site.register(ASN)
+admin.site.register(JobRecord)
+admin.site.register(BanAudit)
@@ -4,3 +4,13 @@ from django.apps import AppConfig
 class HammerConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "hammer"
+
+    def ready(self):
+        # pylint: disable=import-outside-toplevel,unused-import
+        from hammer.utils import (
+            asn_cache,
+            counters,
+            db_profile,
+            lookup_index,
+            range_index,
+        )
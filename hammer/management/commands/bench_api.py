@@ -0,0 +1,94 @@
+import json
+import random
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test import Client
+from django.test.utils import override_settings
+from hammer.utils import ingest
+from hammer.utils.asn_cache import asn_resolver
+from hammer.utils.lookup_index import lookup_index
+from hammer.utils.range_index import range_index
+from .bench_latency import percentile
+from .bench_load import synthetic_asndb, synthetic_rows
+
+BENCH_TOKEN = "bench_api"
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the latency of the lookup API, from the index alone and "
+        "through single and batch requests."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rows",
+            type=int,
+            default=100000,
+            help="Synthetic ranges to add first (changes are rolled back)",
+        )
+        parser.add_argument("--requests", type=int, default=5000)
+        parser.add_argument("--batch-size", type=int, default=100)
+
+    def handle(self, *args, **options):
+        rows = synthetic_rows(options["rows"])
+        rand = random.Random(1)
+        # Every other address falls inside a stored range
+        ips = [
+            rand.choice(rows)[0].replace(".0/24", f".{rand.randrange(256)}")
+            if n % 2
+            else f"{rand.randrange(1, 224)}.{rand.randrange(256)}.0.1"
+            for n in range(options["requests"])
+        ]
+        client = Client(
+            HTTP_HOST="localhost", HTTP_AUTHORIZATION=f"Bearer {BENCH_TOKEN}"
+        )
+        # Refreshes would run on another connection, which cannot see the
+        # rows loaded in this transaction
+        lookup_index.background = False
+        with transaction.atomic(), override_settings(HAMMER_API_TOKENS=[BENCH_TOKEN]):
+            ingest.load_rows(rows, synthetic_asndb(), consolidate=False)
+            start = time.perf_counter()
+            lookup_index.rebuild()
+            self.stdout.write(
+                f"index of {len(lookup_index)} ranges built in "
+                f"{time.perf_counter() - start:.2f}s"
+            )
+            self.report("index", [self.timed(lookup_index.lookup, ip) for ip in ips])
+            self.report(
+                "GET /api/lookup",
+                [self.timed(client.get, f"/api/lookup/{ip}") for ip in ips],
+            )
+            size = options["batch_size"]
+            batches = [
+                json.dumps({"ips": ips[pos : pos + size]})
+                for pos in range(0, len(ips), size)
+            ]
+            samples = [
+                self.timed(
+                    client.post, "/api/lookup", body, content_type="application/json"
+                )
+                for body in batches
+            ]
+            self.report(f"POST /api/lookup x{size}", samples, size)
+            transaction.set_rollback(True)
+        asn_resolver.invalidate()
+        range_index.invalidate()
+        lookup_index.invalidate()
+        lookup_index.background = True
+
+    @staticmethod
+    def timed(func, *args, **kwargs):
+        start = time.perf_counter()
+        func(*args, **kwargs)
+        return time.perf_counter() - start
+
+    def report(self, name, samples, per_request=1):
+        lookups = len(samples) * per_request
+        self.stdout.write(
+            f"{name:>22}: {len(samples)} requests, "
+            f"p50 {percentile(samples, 0.5) * 1e6:.0f}us, "
+            f"p99 {percentile(samples, 0.99) * 1e6:.0f}us, "
+            f"{lookups / sum(samples):.0f} lookups/s"
+        )
@@ -0,0 +1,64 @@
+import csv
+import random
+import time
+from django.core.management.base import BaseCommand
+from pyasn import pyasn
+from hammer.utils.asn_lookup import DOWNLOADS_DIR, ASNLookupService, asn_service
+from hammer.utils.ingest import parse_rows
+from hammer.management.commands.bench_consolidate import synthetic_networks
+
+
+def synthetic_service(seed=0):
+    """Build an ASN database with nested announcements of varying length."""
+    rand = random.Random(seed)
+    lines = [f"{first}.0.0.0/8\t{64500 + first}" for first in range(1, 224)]
+    for _ in range(200000):
+        prefixlen = rand.choice([16, 18, 20, 22, 24])
+        start = rand.randrange(1 << 32) >> (32 - prefixlen) << (32 - prefixlen)
+        network = ".".join(str(start >> shift & 255) for shift in (24, 16, 8, 0))
+        lines.append(f"{network}/{prefixlen}\t{rand.randrange(1, 400000)}")
+    return ASNLookupService(database=pyasn(None, ipasn_string="\n".join(lines)))
+
+
+class Command(BaseCommand):
+    help = "Benchmark resolving every ASN announced inside each listed range."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--csv",
+            default=str(DOWNLOADS_DIR / "global_list.csv"),
+            help="Range list to resolve (default: the downloaded global list, "
+            "or synthetic ranges if it is missing)",
+        )
+        parser.add_argument("--ranges", type=int, default=100000)
+
+    def handle(self, *args, **options):
+        try:
+            with open(options["csv"], newline="", encoding="utf-8") as in_file:
+                reader = csv.reader(in_file)
+                next(reader)
+                networks = [net for net, _ in parse_rows(reader)]
+        except FileNotFoundError:
+            networks = synthetic_networks(options["ranges"])
+        service = asn_service if asn_service.available else synthetic_service()
+        service.prefix_table()  # Exclude the one-off table build from timings
+
+        start = time.perf_counter()
+        service.lookup_many(net.network_address for net in networks)
+        single_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        covered = service.covered_asns_many(networks)
+        full_time = time.perf_counter() - start
+
+        spanning = sum(1 for numbers in covered if len(numbers) > 1)
+        count = len(networks)
+        self.stdout.write(
+            f"first address only: {count} ranges in {single_time:.2f}s "
+            f"({count / single_time:,.0f}/sec)"
+        )
+        self.stdout.write(
+            f"full range: {count} ranges in {full_time:.2f}s "
+            f"({count / full_time:,.0f}/sec)"
+        )
+        self.stdout.write(f"{spanning} ranges are announced by several ASNs")
@@ -0,0 +1,64 @@
+import ipaddress
+import random
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from hammer.utils.consolidate import collapse_entries, consolidate_ranges
+from hammer.utils.range_index import range_index
+
+
+def synthetic_networks(count, seed=0):
+    """Generate count networks with the adjacency and nesting of real lists.
+
+    Networks are drawn from a limited pool of /16 blocks, so many /24s end up
+    adjacent to or nested in one another.
+    """
+    rand = random.Random(seed)
+    blocks = [
+        (rand.choice([23, 45, 64, 104, 142, 185, 193, 212]), rand.randrange(256))
+        for _ in range(max(count // 200, 1))
+    ]
+    networks = []
+    for _ in range(count):
+        first, second = rand.choice(blocks)
+        prefixlen = rand.choice([22, 23, 24, 24, 24, 25, 26, 32])
+        host = rand.randrange(1 << 16)
+        networks.append(
+            ipaddress.ip_network(
+                (first << 24 | second << 16 | host, prefixlen), strict=False
+            )
+        )
+    return networks
+
+
+class Command(BaseCommand):
+    help = "Measure how much consolidation shrinks a range list and how long it takes."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--ranges", type=int, default=500000)
+        parser.add_argument(
+            "--database",
+            action="store_true",
+            help="Also run the consolidation job against the stored ranges "
+            "(changes are rolled back)",
+        )
+
+    def handle(self, *args, **options):
+        networks = synthetic_networks(options["ranges"])
+        distinct = len(set(networks))
+        start = time.perf_counter()
+        collapsed = collapse_entries((net, None) for net in networks)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(
+            f"synthetic: {distinct} distinct ranges -> {len(collapsed)} "
+            f"({100 - 100 * len(collapsed) / distinct:.1f}% fewer) in {elapsed:.2f}s"
+        )
+        if options["database"]:
+            with transaction.atomic():
+                stats = consolidate_ranges()
+                transaction.set_rollback(True)
+            range_index.invalidate()
+            self.stdout.write(
+                f"database: {stats['before']} rows -> {stats['after']} "
+                f"in {stats['seconds']:.2f}s"
+            )
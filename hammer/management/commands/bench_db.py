@@ -0,0 +1,106 @@
+import statistics
+import tempfile
+import threading
+import time
+from pathlib import Path
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection
+from django.test.utils import override_settings
+from hammer.models import IPRange
+from hammer.utils import ingest
+from hammer.utils.asn_cache import asn_resolver
+from hammer.utils.range_index import range_index
+from .bench_load import synthetic_asndb, synthetic_rows
+
+# SQLite's own defaults, for comparison with the tuned profile
+SQLITE_DEFAULTS = {
+    "journal_mode": "DELETE",
+    "synchronous": "FULL",
+    "mmap_size": 0,
+    "busy_timeout": None,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure loading a list into a scratch copy of the configured "
+        "database while a reader pages through the ranges."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=50000)
+        parser.add_argument("--chunk-size", type=int, default=ingest.CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        rows = synthetic_rows(options["rows"])
+        asndb = synthetic_asndb()
+        if connection.vendor == "sqlite":
+            profiles = (
+                ("sqlite defaults", {"HAMMER_SQLITE_PRAGMAS": SQLITE_DEFAULTS}),
+                ("sqlite tuned", {}),
+            )
+        elif connection.vendor == "postgresql":
+            profiles = (
+                ("postgresql insert", {"HAMMER_COPY_LOADS": False}),
+                ("postgresql copy", {"HAMMER_COPY_LOADS": True}),
+            )
+        else:
+            profiles = ((connection.vendor, {}),)
+        with tempfile.TemporaryDirectory() as scratch:
+            # A file, not the in-memory database tests use, so commits hit disk
+            connection.settings_dict["TEST"]["NAME"] = str(Path(scratch) / "bench")
+            old_name = connection.creation.create_test_db(
+                verbosity=0, autoclobber=True, serialize=False
+            )
+            try:
+                for name, overrides in profiles:
+                    with override_settings(**overrides):
+                        connection.close()
+                        self.report(name, *self.measure(rows, asndb, options))
+                    call_command("flush", interactive=False, verbosity=0)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    @staticmethod
+    def measure(rows, asndb, options):
+        """Load rows while another thread reads the newest page of ranges."""
+        asn_resolver.invalidate()
+        range_index.invalidate()
+        done = threading.Event()
+        latencies = []
+        errors = []
+
+        def read():
+            try:
+                while not done.is_set():
+                    start = time.perf_counter()
+                    try:
+                        list(
+                            IPRange.objects.order_by("-id").values("id", "address")[:50]
+                        )
+                    except OperationalError as err:
+                        errors.append(err)
+                    latencies.append(time.perf_counter() - start)
+            finally:
+                connection.close()
+
+        reader = threading.Thread(target=read)
+        reader.start()
+        start = time.perf_counter()
+        try:
+            ingest.load_rows(rows, asndb, options["chunk_size"])
+        finally:
+            elapsed = time.perf_counter() - start
+            done.set()
+            reader.join()
+        return elapsed, latencies, errors
+
+    def report(self, name, elapsed, latencies, errors):
+        quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else []
+        p50, p99 = (quantiles[49], quantiles[98]) if quantiles else (0, 0)
+        self.stdout.write(
+            f"{name:>18}: load {elapsed:.2f}s ({IPRange.objects.count()} ranges), "
+            f"reads p50 {p50 * 1000:.1f}ms p99 {p99 * 1000:.1f}ms, "
+            f"{len(latencies)} reads, {len(errors)} failed"
+        )
@@ -0,0 +1,114 @@
+import tempfile
+import time
+from pathlib import Path
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client
+from django.test.utils import override_settings
+from hammer.utils import ingest
+from hammer.utils.asn_cache import asn_resolver
+from hammer.utils.jobs import JobManager
+from hammer.utils.jobs.jobs import shutdown_pool
+from hammer.utils.range_index import range_index
+from hammer.management.commands.bench_load import synthetic_asndb, synthetic_rows
+
+BENCH_USER = "bench_latency"
+BENCH_JOB = "bench_latency"
+
+
+def load_synthetic(count):
+    """Load count synthetic rows, as a stand-in for a global list load."""
+    ingest.load_rows(synthetic_rows(count), synthetic_asndb())
+
+
+def percentile(samples, fraction):
+    """Return the sample below which the given fraction of samples fall."""
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure page latency in a scratch copy of the configured database "
+        "while a list load runs on each job executor."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=100000)
+        parser.add_argument(
+            "--stored",
+            type=int,
+            default=20000,
+            help="Ranges stored before the pages are first requested",
+        )
+        parser.add_argument("--path", default="/list/", help="Page to request")
+        parser.add_argument(
+            "--cached",
+            action="store_true",
+            help="Serve pages from the page cache (default: build every one)",
+        )
+        parser.add_argument(
+            "--executor",
+            choices=sorted(JobManager.executors),
+            action="append",
+            help="Executor to measure (default: all)",
+        )
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as scratch:
+            if connection.vendor == "sqlite":
+                # A file, so job threads and worker processes share it
+                connection.settings_dict["TEST"]["NAME"] = str(Path(scratch) / "bench")
+            old_name = connection.creation.create_test_db(
+                verbosity=0, autoclobber=True, serialize=False
+            )
+            try:
+                with override_settings(HAMMER_PAGE_CACHE=options["cached"]):
+                    self.measure(options)
+            finally:
+                shutdown_pool()
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    def measure(self, options):
+        """Time page requests while idle, then during a load on each executor."""
+        client = self.prepare(options["stored"])
+        idle = [self.timed_get(client, options["path"]) for _ in range(200)]
+        self.report("idle", idle)
+        for executor in options["executor"] or sorted(JobManager.executors):
+            manager = JobManager(executor=executor)
+            job = manager.make_and_register(
+                BENCH_JOB, load_synthetic, args=(options["rows"],)
+            )
+            samples = []
+            start = time.perf_counter()
+            while job.is_alive():
+                samples.append(self.timed_get(client, options["path"]))
+            elapsed = time.perf_counter() - start
+            self.report(f"{executor} ({elapsed:.1f}s load)", samples)
+            call_command("flush", interactive=False, verbosity=0)
+            client = self.prepare(options["stored"])
+
+    @staticmethod
+    def prepare(stored):
+        """Store the first ranges and return a client logged in to see them."""
+        asn_resolver.invalidate()
+        range_index.invalidate()
+        ingest.load_rows(synthetic_rows(stored, seed=1), synthetic_asndb())
+        client = Client(HTTP_HOST="localhost")
+        client.force_login(User.objects.create_user(BENCH_USER))
+        return client
+
+    @staticmethod
+    def timed_get(client, path):
+        start = time.perf_counter()
+        client.get(path)
+        return time.perf_counter() - start
+
+    def report(self, name, samples):
+        self.stdout.write(
+            f"{name:>22}: {len(samples)} requests, "
+            f"p50 {percentile(samples, 0.5) * 1000:.1f}ms, "
+            f"p95 {percentile(samples, 0.95) * 1000:.1f}ms"
+        )
@@ -0,0 +1,78 @@
+import csv
+import random
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from pyasn import pyasn
+from hammer.utils import ingest
+from hammer.utils.asn_cache import asn_resolver
+from hammer.utils.asn_lookup import ASNLookupService, asn_service
+from hammer.utils.range_index import range_index
+from hammer.utils.load_data import add_range
+
+
+def synthetic_rows(count, seed=0):
+    """Generate count CSV rows of random public /24 ranges."""
+    rand = random.Random(seed)
+    rows = []
+    for _ in range(count):
+        first = rand.choice([23, 45, 64, 104, 142, 185, 193, 212])
+        rows.append(
+            [
+                f"{first}.{rand.randrange(256)}.{rand.randrange(256)}.0/24",
+                "Synthetic benchmark range",
+            ]
+        )
+    return rows
+
+
+def synthetic_asndb():
+    """Build a small ASN database so the benchmark can run without asn.dat."""
+    lines = [f"{first}.0.0.0/8\t{64500 + first}" for first in range(1, 224)]
+    return ASNLookupService(database=pyasn(None, ipasn_string="\n".join(lines)))
+
+
+class Command(BaseCommand):
+    help = "Compare rows/sec of the per-row and batched CSV loaders."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--csv", help="CSV file to load (default: synthetic)")
+        parser.add_argument("--rows", type=int, default=20000)
+        parser.add_argument("--chunk-size", type=int, default=ingest.CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        if options["csv"]:
+            with open(options["csv"], newline="", encoding="utf-8") as in_file:
+                reader = csv.reader(in_file)
+                next(reader)
+                rows = list(reader)
+        else:
+            rows = synthetic_rows(options["rows"])
+        asndb = asn_service if asn_service.available else synthetic_asndb()
+
+        def per_row():
+            for row in rows:
+                if len(row) == 2:
+                    add_range(row[0], row[1], asndb)
+
+        def batched():
+            ingest.load_rows(rows, asndb, options["chunk_size"])
+
+        for name, loader in (("per-row", per_row), ("batched", batched)):
+            elapsed = self.timed_rollback(loader)
+            self.stdout.write(
+                f"{name:>8}: {len(rows)} rows in {elapsed:.2f}s "
+                f"({len(rows) / elapsed:,.0f} rows/sec)"
+            )
+
+    @staticmethod
+    def timed_rollback(loader):
+        """Run loader inside a transaction that is always rolled back."""
+        with transaction.atomic():
+            start = time.perf_counter()
+            loader()
+            elapsed = time.perf_counter() - start
+            transaction.set_rollback(True)
+        asn_resolver.invalidate()
+        range_index.invalidate()
+        return elapsed
@@ -0,0 +1,69 @@
+import ipaddress
+import time
+from functools import partial
+from django.core.management.base import BaseCommand
+from django.core.paginator import Paginator
+from django.db import transaction
+from hammer.models import IPRange, range_fields
+from hammer.utils.pagination import KeysetPaginator
+from hammer.utils.range_index import range_index
+
+PER_PAGE = 50
+
+
+def offset_page(queryset, number):
+    return list(Paginator(queryset.order_by("id"), PER_PAGE).page(number))
+
+
+def keyset_page(queryset, cursor):
+    return list(KeysetPaginator(queryset, PER_PAGE).get_page(cursor))
+
+
+class Command(BaseCommand):
+    help = "Compare OFFSET and keyset pagination of the range list at increasing depth."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rows",
+            type=int,
+            default=500000,
+            help="Synthetic ranges to add first (changes are rolled back)",
+        )
+        parser.add_argument("--repeat", type=int, default=20)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            IPRange.objects.bulk_create(
+                (
+                    IPRange(
+                        address=f"10.{n >> 16 & 255}.{n >> 8 & 255}.{n & 255}/32",
+                        **range_fields(ipaddress.ip_network(0x0A000000 + n)),
+                        check_reason="Synthetic benchmark range",
+                    )
+                    for n in range(options["rows"])
+                ),
+                batch_size=5000,
+            )
+            queryset = IPRange.objects.filter(blocked=False, scheduled=False)
+            pages = -(-queryset.count() // PER_PAGE)
+            ids = list(queryset.order_by("id").values_list("id", flat=True))
+            numbers = {1, 100, pages // 2, pages}
+            for number in sorted(n for n in numbers if 1 <= n <= pages):
+                cursor = ids[(number - 1) * PER_PAGE - 1] if number > 1 else None
+                offset = partial(offset_page, queryset, number)
+                keyset = partial(keyset_page, queryset, cursor)
+
+                assert offset() == keyset()
+                self.stdout.write(
+                    f"page {number:>6}: offset {self.timed(offset, options):6.2f}ms, "
+                    f"keyset {self.timed(keyset, options):6.2f}ms"
+                )
+            transaction.set_rollback(True)
+        range_index.invalidate()
+
+    @staticmethod
+    def timed(func, options):
+        start = time.perf_counter()
+        for _ in range(options["repeat"]):
+            func()
+        return (time.perf_counter() - start) * 1000 / options["repeat"]
@@ -0,0 +1,57 @@
+import csv
+import os
+import time
+from tempfile import NamedTemporaryFile
+from django.core.management.base import BaseCommand
+from hammer.utils.ingest import parse_rows
+from hammer.utils.parallel_parse import parse_csv
+from hammer.utils.snapshot import ListDelta
+from hammer.management.commands.bench_consolidate import synthetic_networks
+
+
+class Command(BaseCommand):
+    help = "Measure how CSV parsing scales with the number of worker processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--csv", help="CSV file to parse (default: synthetic)")
+        parser.add_argument("--rows", type=int, default=500000)
+        parser.add_argument(
+            "--workers",
+            type=int,
+            action="append",
+            help="Worker counts to measure (default: 1, 2, 4, ... up to the CPUs)",
+        )
+
+    def handle(self, *args, **options):
+        counts = options["workers"] or [
+            1 << power for power in range(os.cpu_count().bit_length())
+        ]
+        if options["csv"]:
+            self.compare(options["csv"], counts)
+            return
+        with NamedTemporaryFile("w", suffix=".csv", newline="") as out:
+            writer = csv.writer(out)
+            writer.writerow(["address", "reason"])
+            for net in synthetic_networks(options["rows"]):
+                writer.writerow([net.compressed, "Synthetic benchmark range"])
+            out.flush()
+            self.compare(out.name, counts)
+
+    def compare(self, path, counts):
+        start = time.perf_counter()
+        with open(path, newline="", encoding="utf-8") as in_file:
+            reader = csv.reader(in_file)
+            next(reader)
+            rows = sum(1 for _ in parse_rows(ListDelta().filter(reader)))
+        serial = time.perf_counter() - start
+        self.stdout.write(
+            f"  serial: {rows} ranges in {serial:.2f}s ({rows / serial:,.0f}/sec)"
+        )
+        for workers in counts:
+            start = time.perf_counter()
+            rows = sum(1 for _ in parse_csv(path, ListDelta(), workers=workers))
+            elapsed = time.perf_counter() - start
+            self.stdout.write(
+                f"{workers:>2} proc: {rows} ranges in {elapsed:.2f}s "
+                f"({rows / elapsed:,.0f}/sec, {serial / elapsed:.2f}x serial)"
+            )
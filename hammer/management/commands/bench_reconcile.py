@@ -0,0 +1,73 @@
+import io
+import ipaddress
+import random
+import time
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from hammer.models import IPRange, range_fields
+from hammer.utils.asn_cache import asn_resolver
+from hammer.utils.range_index import range_index
+from hammer.utils.reconcile import reconcile_blocks
+
+
+def synthetic_block_list(count, seed=0):
+    """Generate a block list of count random public IPv4 and IPv6 networks."""
+    rand = random.Random(seed)
+    lines = ["address,reason"]
+    for _ in range(count):
+        if rand.random() < 0.9:
+            prefixlen = rand.choice([16, 20, 22, 24, 24, 28, 32])
+            start = rand.randrange(1 << 32) >> (32 - prefixlen) << (32 - prefixlen)
+            network = ".".join(str(start >> shift & 255) for shift in (24, 16, 8, 0))
+        else:
+            prefixlen = rand.choice([32, 48, 64])
+            network = f"2a0{rand.randrange(10)}:{rand.randrange(1 << 16):x}::"
+        lines.append(f"{network}/{prefixlen},open proxy")
+    return "\n".join(lines)
+
+
+class Command(BaseCommand):
+    help = "Measure reconciling stored ranges against a large block list."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--blocks", type=int, default=1000000)
+        parser.add_argument(
+            "--ranges",
+            type=int,
+            default=200000,
+            help="Synthetic ranges to add first (changes are rolled back)",
+        )
+
+    def handle(self, *args, **options):
+        dump = synthetic_block_list(options["blocks"])
+        rand = random.Random(1)
+        with transaction.atomic():
+            IPRange.objects.bulk_create(
+                (
+                    IPRange(
+                        address=f"{a}.{b}.{c}.0/24",
+                        **range_fields(ipaddress.ip_network(f"{a}.{b}.{c}.0/24")),
+                        check_reason="Synthetic benchmark range",
+                    )
+                    for a, b, c in {
+                        (
+                            rand.randrange(1, 224),
+                            rand.randrange(256),
+                            rand.randrange(256),
+                        )
+                        for _ in range(options["ranges"])
+                    }
+                ),
+                batch_size=5000,
+                ignore_conflicts=True,
+            )
+            start = time.perf_counter()
+            stats = reconcile_blocks(io.StringIO(dump))
+            elapsed = time.perf_counter() - start
+            transaction.set_rollback(True)
+        asn_resolver.invalidate()
+        range_index.invalidate()
+        self.stdout.write(
+            f"{options['blocks']} block list entries -> {stats['intervals']} "
+            f"intervals, {stats['blocked']} ranges blocked in {elapsed:.2f}s"
+        )
@@ -0,0 +1,175 @@
+import gzip
+import random
+import shutil
+import struct
+import tempfile
+import threading
+import time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test.utils import override_settings
+from hammer.models import IPRange
+from hammer.utils import load_data
+from hammer.utils.asn_cache import asn_resolver
+from hammer.utils.asn_lookup import DOWNLOADS_DIR, asn_service
+from hammer.utils.range_index import range_index
+
+
+def synthetic_rib(path, count, seed=0):
+    """Write a gzipped TABLE_DUMP_V2 MRT file announcing count random /24s.
+
+    Returns the announced prefixes as (first three octets, origin AS).
+    """
+    rand = random.Random(seed)
+    prefixes = {
+        (rand.randrange(1, 224), rand.randrange(256), rand.randrange(256))
+        for _ in range(count)
+    }
+    announced = []
+
+    def record(sub_type, data):
+        return struct.pack(">IHHI", 0, 13, sub_type, len(data)) + data
+
+    with gzip.open(path, "wb", compresslevel=6) as out:
+        # Peer index table: collector id, empty view name, no peers
+        out.write(record(1, struct.pack(">IHH", 0, 0, 0)))
+        for seq, octets in enumerate(sorted(prefixes)):
+            origin = 64512 + rand.randrange(1000)
+            as_path = struct.pack(">BBIII", 2, 3, 3356, 1299, origin)
+            attrs = struct.pack(">BBB", 0x40, 2, len(as_path)) + as_path
+            entry = struct.pack(">HIH", 0, 0, len(attrs)) + attrs
+            out.write(record(2, struct.pack(">IB3BH", seq, 24, *octets, 1) + entry))
+            announced.append((octets, origin))
+    return announced
+
+
+def synthetic_list(path, announced, count, seed):
+    """Write a list of count ranges inside the announced prefixes."""
+    rand = random.Random(seed)
+    with open(path, "w", encoding="utf-8") as out:
+        out.write("address,reason\n")
+        for (a, b, c), _ in rand.sample(announced, count):
+            out.write(f"{a}.{b}.{c}.{rand.randrange(0, 256, 64)}/26,open proxy\n")
+
+
+class ThrottledHandler(SimpleHTTPRequestHandler):
+    """Serves files after a fixed delay and at a limited rate."""
+
+    latency = 0.0
+    rate = None
+
+    def send_head(self):
+        time.sleep(self.latency)
+        return super().send_head()
+
+    def copyfile(self, source, outputfile):
+        chunk_size = 1 << 16
+        while True:
+            chunk = source.read(chunk_size)
+            if not chunk:
+                break
+            outputfile.write(chunk)
+            if self.rate:
+                time.sleep(len(chunk) / self.rate)
+
+    def log_message(self, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare refreshing the ASN database and both lists one tool at a "
+        "time with the concurrent refresh_all pipeline, served locally."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--prefixes", type=int, default=100000)
+        parser.add_argument("--rows", type=int, default=20000)
+        parser.add_argument(
+            "--rate",
+            type=float,
+            default=1.0,
+            help="Bandwidth of each download in MB/s (0 for unlimited)",
+        )
+        parser.add_argument(
+            "--latency", type=float, default=0.5, help="Seconds before each response"
+        )
+
+    def handle(self, *args, **options):
+        served = Path(tempfile.mkdtemp(prefix="hammer-bench-"))
+        saved = Path(tempfile.mkdtemp(prefix="hammer-downloads-")) / "downloads"
+        handler = type(
+            "Handler",
+            (ThrottledHandler,),
+            {
+                "latency": options["latency"],
+                "rate": options["rate"] * (1 << 20) or None,
+            },
+        )
+        server = ThreadingHTTPServer(
+            ("127.0.0.1", 0), partial(handler, directory=str(served))
+        )
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base = f"http://127.0.0.1:{server.server_port}"
+        try:
+            announced = synthetic_rib(served / "rib.gz", options["prefixes"])
+            for seed, name in enumerate(load_data.LIST_SOURCES, 1):
+                synthetic_list(served / f"{name}.csv", announced, options["rows"], seed)
+            sizes = {path.name: path.stat().st_size for path in served.iterdir()}
+            self.stdout.write(
+                ", ".join(
+                    f"{name}: {size / (1 << 20):.1f}MB" for name, size in sizes.items()
+                )
+            )
+            # Work on an empty downloads directory, restoring the real one after
+            if DOWNLOADS_DIR.exists():
+                shutil.move(DOWNLOADS_DIR, saved)
+            with override_settings(
+                HAMMER_MRT_SOURCE=f"{base}/rib.gz",
+                HAMMER_ENWIKI_LIST_URL=f"{base}/enwiki.csv",
+                HAMMER_GLOBAL_LIST_URL=f"{base}/global.csv",
+            ):
+                for name, refresh in (
+                    ("serial", self.serial),
+                    ("concurrent", load_data.refresh_all),
+                ):
+                    elapsed, ranges = self.timed_rollback(refresh)
+                    self.stdout.write(f"{name:>10}: {elapsed:.2f}s, {ranges} ranges")
+        finally:
+            server.shutdown()
+            shutil.rmtree(served)
+            shutil.rmtree(DOWNLOADS_DIR, ignore_errors=True)
+            if saved.exists():
+                shutil.move(saved, DOWNLOADS_DIR)
+            shutil.rmtree(saved.parent)
+            asn_service.reload()
+
+    @staticmethod
+    def serial():
+        """The tools in the order they are run by hand."""
+        load_data.update_asn_db()
+        load_data.download_enwiki()
+        load_data.download_global()
+        load_data.load_enwiki()
+        load_data.load_global()
+
+    @staticmethod
+    def timed_rollback(refresh):
+        """Run refresh from an empty downloads directory, rolling back its writes.
+
+        Returns the time taken and the number of ranges stored at the end.
+        """
+        shutil.rmtree(DOWNLOADS_DIR, ignore_errors=True)
+        DOWNLOADS_DIR.mkdir()
+        with transaction.atomic():
+            start = time.perf_counter()
+            refresh()
+            elapsed = time.perf_counter() - start
+            ranges = IPRange.objects.count()
+            transaction.set_rollback(True)
+        asn_resolver.invalidate()
+        range_index.invalidate()
+        return elapsed, ranges
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from hammer.utils import page_cache
+
+
+class Command(BaseCommand):
+    help = "Print the page cache hit rate."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--reset", action="store_true", help="Reset the counts after printing"
+        )
+
+    def handle(self, *args, **options):
+        if page_cache.process_local():
+            self.stderr.write(
+                "The cache is local to each process; set HAMMER_CACHE_URL to "
+                "see the counts of the web server."
+            )
+        stats = page_cache.metrics()
+        rate = "n/a" if stats["hit_rate"] is None else f"{stats['hit_rate']:.1%}"
+        self.stdout.write(
+            f"hits: {stats['hit']}, misses: {stats['miss']}, hit rate: {rate}"
+        )
+        if options["reset"]:
+            page_cache.reset_metrics()
@@ -0,0 +1,42 @@
+import ipaddress
+from django.core.management.base import BaseCommand
+from hammer.models import (
+    ADDRESS_CLASSES,
+    ASN,
+    KEY_FIELDS,
+    IPRange,
+    join_key,
+    range_fields,
+)
+
+
+class Command(BaseCommand):
+    help = "Print the query plans of the lookups used by the list and ban views."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--asn", type=int, default=13335)
+
+    def handle(self, *args, **options):
+        sample = IPRange.objects.values(*KEY_FIELDS).first() or range_fields(
+            ipaddress.ip_network("198.51.100.0/24")
+        )
+        address = ADDRESS_CLASSES[sample["ip_version"]](
+            join_key(sample["start_hi"], sample["start_lo"])
+        )
+        queries = {
+            "ASN by number (banasn, list_asn, ASNDetail)": ASN.objects.filter(
+                asn=options["asn"]
+            ),
+            "range by bounds": IPRange.objects.filter(**sample),
+            "ranges containing an address (lookup)": IPRange.objects.containing(
+                address
+            ),
+            "new ranges": IPRange.objects.filter(blocked=False, scheduled=False),
+            "pending ranges": IPRange.objects.filter(scheduled=True),
+            "blocked ranges": IPRange.objects.filter(blocked=True),
+            "ranges by ASN": IPRange.objects.filter(asn__asn=options["asn"]),
+        }
+        for name, queryset in queries.items():
+            self.stdout.write(self.style.MIGRATE_HEADING(name))
+            self.stdout.write(queryset.explain())
+            self.stdout.write("")
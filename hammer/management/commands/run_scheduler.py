@@ -0,0 +1,37 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from hammer.utils.tools import scheduler
+
+
+class Command(BaseCommand):
+    help = (
+        "Run tools periodically, with their dependencies, as set by "
+        "HAMMER_SCHEDULE or --every."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--every",
+            action="append",
+            default=[],
+            metavar="TOOL=SECONDS",
+            help="Run TOOL every SECONDS seconds; may be repeated",
+        )
+
+    def handle(self, *args, **options):
+        schedule = dict(getattr(settings, "HAMMER_SCHEDULE", {}))
+        for entry in options["every"]:
+            tool, _, seconds = entry.partition("=")
+            try:
+                schedule[tool] = float(seconds)
+            except ValueError as err:
+                raise CommandError(f"Expected TOOL=SECONDS, got {entry}") from err
+        if not schedule:
+            raise CommandError("Nothing to schedule")
+        try:
+            scheduler.set_schedule(schedule)
+        except ValueError as err:
+            raise CommandError(err) from err
+        for tool, seconds in sorted(schedule.items()):
+            self.stdout.write(f"{tool}: every {seconds:g}s")
+        scheduler.start().join()
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from hammer.utils.load_data import update_asn_db
+
+
+class Command(BaseCommand):
+    help = "Rebuild the ASN database and update ranges whose ASN changed."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "source",
+            nargs="?",
+            help="Local MRT file, or directory of dumps, to use instead of downloading",
+        )
+
+    def handle(self, *args, **options):
+        update_asn_db(options["source"])
@@ -0,0 +1,65 @@
+# Generated by Django 4.1.3 on 2026-10-18 10:51
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def merge_duplicate_asns(apps, schema_editor):
+    """Point ranges at the oldest row for each AS number and drop the rest."""
+    ASN = apps.get_model('hammer', 'ASN')
+    IPRange = apps.get_model('hammer', 'IPRange')
+    duplicates = (
+        ASN.objects.values('asn')
+        .annotate(keep=Min('id'), rows=Count('id'))
+        .filter(rows__gt=1)
+    )
+    for dup in duplicates:
+        extra = ASN.objects.filter(asn=dup['asn']).exclude(id=dup['keep'])
+        IPRange.objects.filter(asn__in=extra).update(asn_id=dup['keep'])
+        extra.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("hammer", "0003_alter_asn_description"),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_asns, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="asn",
+            name="asn",
+            field=models.PositiveBigIntegerField(unique=True),
+        ),
+        migrations.AddIndex(
+            model_name="iprange",
+            index=models.Index(
+                fields=["range_start", "range_end"], name="iprange_bounds_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="iprange",
+            index=models.Index(
+                condition=models.Q(("blocked", False), ("scheduled", False)),
+                fields=["id"],
+                name="iprange_new_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="iprange",
+            index=models.Index(
+                condition=models.Q(("scheduled", True)),
+                fields=["id"],
+                name="iprange_pending_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="iprange",
+            index=models.Index(
+                condition=models.Q(("blocked", True)),
+                fields=["id"],
+                name="iprange_blocked_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.1.3 on 2026-10-18 10:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hammer', '0004_asn_unique_iprange_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='iprange',
+            name='extra_asns',
+            field=models.ManyToManyField(blank=True, related_name='extra_ranges', to='hammer.asn'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.1.3 on 2026-10-18 11:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hammer', '0005_iprange_extra_asns'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='iprange',
+            name='delisted',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='iprange',
+            index=models.Index(condition=models.Q(('delisted__isnull', False)), fields=['id'], name='iprange_delisted_idx'),
+        ),
+    ]
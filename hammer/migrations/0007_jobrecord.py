@@ -0,0 +1,28 @@
+# Generated by Django 4.1.3 on 2026-10-18 11:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hammer', '0006_iprange_delisted'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='JobRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('job_type', models.CharField(db_index=True, max_length=64)),
+                ('status', models.SmallIntegerField(choices=[(0, 'Queued'), (1, 'Running'), (2, 'Done'), (3, 'Failed')], default=0)),
+                ('queued', models.DateTimeField(auto_now_add=True)),
+                ('started', models.DateTimeField(blank=True, null=True)),
+                ('finished', models.DateTimeField(blank=True, null=True)),
+                ('rows_processed', models.PositiveBigIntegerField(default=0)),
+                ('progress', models.JSONField(blank=True, default=dict)),
+                ('peak_memory', models.PositiveBigIntegerField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+            ],
+        ),
+    ]
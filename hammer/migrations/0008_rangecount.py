@@ -0,0 +1,47 @@
+# Generated by Django 4.1.3 on 2026-10-18 11:11
+
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+
+
+def count_ranges(apps, schema_editor):
+    """Fill the counters from the ranges already stored."""
+    IPRange = apps.get_model('hammer', 'IPRange')
+    RangeCount = apps.get_model('hammer', 'RangeCount')
+    counts = {}
+    rows = IPRange.objects.values('asn_id', 'scheduled', 'blocked').annotate(
+        total=Count('id')
+    )
+    for row in rows:
+        state = 2 if row['blocked'] else 1 if row['scheduled'] else 0
+        key = (row['asn_id'], state)
+        counts[key] = counts.get(key, 0) + row['total']
+    RangeCount.objects.bulk_create(
+        RangeCount(asn_id=asn_id, state=state, count=count)
+        for (asn_id, state), count in counts.items()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hammer', '0007_jobrecord'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RangeCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('state', models.SmallIntegerField(choices=[(0, 'New'), (1, 'Pending'), (2, 'Blocked')])),
+                ('count', models.BigIntegerField(default=0)),
+                ('asn', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='hammer.asn')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='rangecount',
+            constraint=models.UniqueConstraint(fields=('asn', 'state'), name='rangecount_asn_state_uniq'),
+        ),
+        migrations.RunPython(count_ranges, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.1.3 on 2026-10-18 11:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hammer', '0009_banaudit'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='iprange',
+            name='ip_version',
+            field=models.PositiveSmallIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='iprange',
+            name='start_hi',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='iprange',
+            name='start_lo',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='iprange',
+            name='end_hi',
+            field=models.BigIntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='iprange',
+            name='end_lo',
+            field=models.BigIntegerField(null=True),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 4.1.3 on 2026-10-18 11:52
+
+from django.db import migrations, transaction
+
+BATCH_SIZE = 5000
+KEY_BIAS = 1 << 63
+
+
+def split_key(value):
+    return (value >> 64) - KEY_BIAS, (value & (1 << 64) - 1) - KEY_BIAS
+
+
+def convert_bounds(apps, schema_editor):
+    """Fill the key columns from the packed bounds, one committed batch at a time.
+
+    Only rows without keys are read, so an interrupted run picks up where
+    it stopped.
+    """
+    IPRange = apps.get_model('hammer', 'IPRange')
+    connection = schema_editor.connection
+    update = (
+        f'UPDATE {IPRange._meta.db_table} SET ip_version = %s, start_hi = %s, '
+        'start_lo = %s, end_hi = %s, end_lo = %s WHERE id = %s'
+    )
+    last_id = 0
+    while True:
+        with transaction.atomic(using=connection.alias):
+            rows = list(
+                IPRange.objects.using(connection.alias)
+                .filter(id__gt=last_id, ip_version__isnull=True)
+                .order_by('id')
+                .values_list('id', 'range_start', 'range_end')[:BATCH_SIZE]
+            )
+            if not rows:
+                return
+            params = []
+            for range_id, start, end in rows:
+                start, end = bytes(start), bytes(end)
+                params.append(
+                    (
+                        4 if len(start) == 4 else 6,
+                        *split_key(int.from_bytes(start, 'big')),
+                        *split_key(int.from_bytes(end, 'big')),
+                        range_id,
+                    )
+                )
+            with connection.cursor() as cursor:
+                cursor.executemany(update, params)
+        last_id = rows[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    # Each batch commits on its own instead of in one long transaction
+    atomic = False
+
+    dependencies = [
+        ('hammer', '0010_iprange_keys'),
+    ]
+
+    operations = [
+        migrations.RunPython(convert_bounds, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 4.1.3 on 2026-10-18 11:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hammer', '0011_iprange_keys_data'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='iprange',
+            name='iprange_bounds_idx',
+        ),
+        migrations.RemoveField(
+            model_name='iprange',
+            name='range_end',
+        ),
+        migrations.RemoveField(
+            model_name='iprange',
+            name='range_start',
+        ),
+        migrations.AlterField(
+            model_name='iprange',
+            name='end_hi',
+            field=models.BigIntegerField(),
+        ),
+        migrations.AlterField(
+            model_name='iprange',
+            name='end_lo',
+            field=models.BigIntegerField(),
+        ),
+        migrations.AlterField(
+            model_name='iprange',
+            name='ip_version',
+            field=models.PositiveSmallIntegerField(),
+        ),
+        migrations.AlterField(
+            model_name='iprange',
+            name='start_hi',
+            field=models.BigIntegerField(),
+        ),
+        migrations.AlterField(
+            model_name='iprange',
+            name='start_lo',
+            field=models.BigIntegerField(),
+        ),
+        migrations.AddIndex(
+            model_name='iprange',
+            index=models.Index(fields=['ip_version', 'start_hi', 'start_lo', '-end_hi', '-end_lo'], name='iprange_start_idx'),
+        ),
+    ]
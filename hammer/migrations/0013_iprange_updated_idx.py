@@ -0,0 +1,17 @@
+# Generated by Django 4.1.3 on 2026-10-18 12:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hammer', '0012_iprange_keys_required'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='iprange',
+            index=models.Index(fields=['last_updated'], name='iprange_updated_idx'),
+        ),
+    ]
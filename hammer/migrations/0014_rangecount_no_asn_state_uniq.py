@@ -0,0 +1,35 @@
+# Generated by Django 4.1.3 on 2026-10-18 12:55
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_counters(apps, schema_editor):
+    """Fold the counters of ranges without an ASN into one per state."""
+    RangeCount = apps.get_model('hammer', 'RangeCount')
+    duplicates = (
+        RangeCount.objects.filter(asn__isnull=True)
+        .values('state')
+        .annotate(keep=Min('id'), total=Sum('count'), rows=Count('id'))
+        .filter(rows__gt=1)
+    )
+    for dup in duplicates:
+        RangeCount.objects.filter(id=dup['keep']).update(count=dup['total'])
+        RangeCount.objects.filter(asn__isnull=True, state=dup['state']).exclude(
+            id=dup['keep']
+        ).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('hammer', '0013_iprange_updated_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_counters, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='rangecount',
+            constraint=models.UniqueConstraint(condition=models.Q(('asn__isnull', True)), fields=('state',), name='rangecount_no_asn_state_uniq'),
+        ),
+    ]
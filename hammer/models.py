@@ -1,6 +1,10 @@
 import ipaddress
+import operator
+from functools import reduce
+from django.conf import settings
 from django.core.exceptions import ValidationError
 from django.db import models
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 
@@ -22,6 +26,102 @@ def validate_ip_range(value):
         ) from err
 
 
+# Range bounds are stored as 128-bit addresses, IPv4 in the low 32 bits,
+# split into two signed 64-bit columns. Each half is biased by 2**63 so that
+# comparing (hi, lo) as signed integers orders addresses correctly.
+KEY_BIAS = 1 << 63
+KEY_FIELDS = ("ip_version", "start_hi", "start_lo", "end_hi", "end_lo")
+ADDRESS_CLASSES = {4: ipaddress.IPv4Address, 6: ipaddress.IPv6Address}
+# Fields the range counters count a range under
+COUNTED_FIELDS = frozenset(("asn_id", "scheduled", "blocked"))
+
+
+def split_key(value):
+    """Split a 128-bit address into its biased (hi, lo) column values."""
+    return (value >> 64) - KEY_BIAS, (value & (1 << 64) - 1) - KEY_BIAS
+
+
+def join_key(hi, lo):
+    """Return the 128-bit address stored as biased (hi, lo) column values."""
+    return (hi + KEY_BIAS) << 64 | (lo + KEY_BIAS)
+
+
+def range_fields(network):
+    """Return the key field values of an ipaddress network, as a dict."""
+    start_hi, start_lo = split_key(int(network.network_address))
+    end_hi, end_lo = split_key(int(network.broadcast_address))
+    return {
+        "ip_version": network.version,
+        "start_hi": start_hi,
+        "start_lo": start_lo,
+        "end_hi": end_hi,
+        "end_lo": end_lo,
+    }
+
+
+def _key_lookup(pairs):
+    """Q matching rows whose start is one of the (hi, lo) pairs.
+
+    The pairs are grouped so a run of prefixes that only differ in one
+    column becomes a single IN lookup.
+    """
+    by_hi = {}
+    for hi, lo in pairs:
+        by_hi.setdefault(hi, set()).add(lo)
+    by_lo = {}
+    conditions = []
+    for hi, los in by_hi.items():
+        if len(los) == 1:
+            by_lo.setdefault(los.pop(), []).append(hi)
+        else:
+            conditions.append(models.Q(start_hi=hi, start_lo__in=sorted(los)))
+    for lo, his in by_lo.items():
+        conditions.append(models.Q(start_hi__in=sorted(his), start_lo=lo))
+    return reduce(operator.or_, conditions)
+
+
+class IPRangeQuerySet(models.QuerySet):
+    """Containment lookups answered from the start key index."""
+
+    def containing(self, address):
+        """Ranges containing address, an ipaddress address or string."""
+        if isinstance(address, str):
+            address = ipaddress.ip_address(address)
+        return self._supernets(address.version, int(address), int(address))
+
+    def overlapping(self, network):
+        """Ranges overlapping network, an ipaddress network or string.
+
+        Stored ranges are CIDR networks, so each one either contains
+        network or lies inside it.
+        """
+        if isinstance(network, str):
+            network = ipaddress.ip_network(network, strict=False)
+        start, end = int(network.network_address), int(network.broadcast_address)
+        (start_hi, start_lo), (end_hi, end_lo) = split_key(start), split_key(end)
+        inside = (
+            models.Q(start_hi__gt=start_hi)
+            | models.Q(start_hi=start_hi, start_lo__gte=start_lo)
+        ) & (
+            models.Q(start_hi__lt=end_hi)
+            | models.Q(start_hi=end_hi, start_lo__lte=end_lo)
+        )
+        return self._supernets(network.version, start, end) | self.filter(
+            inside, ip_version=network.version
+        )
+
+    def _supernets(self, version, start, end):
+        """Ranges holding all of start..end, found by their possible starts."""
+        bits = 32 if version == 4 else 128
+        starts = {start >> host_bits << host_bits for host_bits in range(bits + 1)}
+        end_hi, end_lo = split_key(end)
+        return self.filter(
+            _key_lookup(split_key(value) for value in starts),
+            models.Q(end_hi__gt=end_hi) | models.Q(end_hi=end_hi, end_lo__gte=end_lo),
+            ip_version=version,
+        )
+
+
 class ASN(models.Model):
     """Stores an ASN for evaluation."""
 
@@ -32,7 +132,7 @@ class ASN(models.Model):
 
     # All ASNs are 4 bytes, but are unsigned integers
     # necessitating 8 bytes for storage with signed integers
-    asn = models.PositiveBigIntegerField()
+    asn = models.PositiveBigIntegerField(unique=True)
     asn_status = models.SmallIntegerField(
         choices=Status.choices, default=Status.UNCHECKED
     )
@@ -46,10 +146,7 @@ class ASN(models.Model):
     @property
     def status_str(self) -> str:
         """Returns the string representation of the status integer."""
-        for choice in self.Status.choices:
-            if self.asn_status == choice[0]:
-                return choice[1]
-        return None
+        return self.Status(self.asn_status).label
 
 
 class IPRange(models.Model):
@@ -58,25 +155,208 @@ class IPRange(models.Model):
     address = models.CharField(
         max_length=255, unique=True, validators=[validate_ip_range]
     )
-    range_start = models.BinaryField(max_length=35)
-    range_end = models.BinaryField(max_length=35)
+    ip_version = models.PositiveSmallIntegerField()
+    # First and last address of the range, see split_key
+    start_hi = models.BigIntegerField()
+    start_lo = models.BigIntegerField()
+    end_hi = models.BigIntegerField()
+    end_lo = models.BigIntegerField()
     asn = models.ForeignKey(ASN, on_delete=models.CASCADE, blank=True, null=True)
+    # Other ASNs announcing part of the range, when it spans several prefixes
+    extra_asns = models.ManyToManyField(ASN, blank=True, related_name="extra_ranges")
     scheduled = models.BooleanField(default=False)
     blocked = models.BooleanField(default=False)
     date_added = models.DateTimeField(auto_now_add=True)
+    # Set when the range disappears from the list it was loaded from
+    delisted = models.DateTimeField(blank=True, null=True)
     last_updated = models.DateTimeField(auto_now=True)
     check_reason = models.TextField()
 
+    objects = IPRangeQuerySet.as_manager()
+
+    class Meta:  # pylint: disable=too-few-public-methods
+        indexes = [
+            # Containment lookups and address order scans; within a start,
+            # wider ranges come first
+            models.Index(
+                fields=["ip_version", "start_hi", "start_lo", "-end_hi", "-end_lo"],
+                name="iprange_start_idx",
+            ),
+            # Partial indexes backing the new/pending/blocked list filters
+            models.Index(
+                fields=["id"],
+                condition=models.Q(blocked=False, scheduled=False),
+                name="iprange_new_idx",
+            ),
+            models.Index(
+                fields=["id"],
+                condition=models.Q(scheduled=True),
+                name="iprange_pending_idx",
+            ),
+            models.Index(
+                fields=["id"],
+                condition=models.Q(blocked=True),
+                name="iprange_blocked_idx",
+            ),
+            models.Index(
+                fields=["id"],
+                condition=models.Q(delisted__isnull=False),
+                name="iprange_delisted_idx",
+            ),
+            # Rows changed since the lookup API last refreshed
+            models.Index(fields=["last_updated"], name="iprange_updated_idx"),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Loads a row, remembering the review state it was stored with.
+
+        The range counters adjust the counts from that state when the range
+        is saved, instead of reading it back first.
+        """
+        instance = super().from_db(db, field_names, values)
+        if COUNTED_FIELDS.issubset(field_names):
+            # pylint: disable-next=protected-access
+            instance._counted = (instance.asn_id, instance.scheduled, instance.blocked)
+        return instance
+
+    def refresh_from_db(self, using=None, fields=None):
+        """Reloads fields from the database, along with the stored review state."""
+        super().refresh_from_db(using, fields)
+        if fields is None or not COUNTED_FIELDS.isdisjoint(fields):
+            self.__dict__.pop("_counted", None)
+
     def __str__(self) -> str:
         """Represents the IP address as a string with some context information."""
         return "IP Address " + self.address
 
+    @property
+    def range_start(self) -> int:
+        """Returns the first address of the range as an integer."""
+        return join_key(self.start_hi, self.start_lo)
+
+    @property
+    def range_end(self) -> int:
+        """Returns the last address of the range as an integer."""
+        return join_key(self.end_hi, self.end_lo)
+
     @property
     def range_start_str(self) -> str:
-        """Represents the range_start field as a string."""
-        return str(ipaddress.ip_address(self.range_start))
+        """Represents the first address of the range as a string."""
+        return str(ADDRESS_CLASSES[self.ip_version](self.range_start))
 
     @property
     def range_end_str(self) -> str:
-        """Represents the range_end field as a string."""
-        return str(ipaddress.ip_address(self.range_end))
+        """Represents the last address of the range as a string."""
+        return str(ADDRESS_CLASSES[self.ip_version](self.range_end))
+
+
+class RangeCount(models.Model):
+    """Number of stored ranges of one ASN in one review state.
+
+    Kept up to date by every write to IPRange, so overview pages never
+    have to count IPRange itself.
+    """
+
+    class State(models.IntegerChoices):
+        NEW = 0
+        PENDING = 1
+        BLOCKED = 2
+
+    asn = models.ForeignKey(ASN, on_delete=models.CASCADE, blank=True, null=True)
+    state = models.SmallIntegerField(choices=State.choices)
+    count = models.BigIntegerField(default=0)
+
+    class Meta:  # pylint: disable=too-few-public-methods
+        constraints = [
+            models.UniqueConstraint(
+                fields=["asn", "state"], name="rangecount_asn_state_uniq"
+            ),
+            # NULLs are distinct in the constraint above, so ranges without
+            # an ASN need one of their own
+            models.UniqueConstraint(
+                fields=["state"],
+                condition=models.Q(asn__isnull=True),
+                name="rangecount_no_asn_state_uniq",
+            ),
+        ]
+
+    def __str__(self) -> str:
+        """Represents the counter as a string with some context information."""
+        return f"{self.get_state_display()} ranges of ASN id {self.asn_id}"
+
+
+class JobRecord(models.Model):
+    """Records the progress and outcome of a tool run."""
+
+    class Status(models.IntegerChoices):
+        QUEUED = 0
+        RUNNING = 1
+        DONE = 2
+        FAILED = 3
+
+    job_type = models.CharField(max_length=64, db_index=True)
+    status = models.SmallIntegerField(choices=Status.choices, default=Status.QUEUED)
+    queued = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(blank=True, null=True)
+    finished = models.DateTimeField(blank=True, null=True)
+    rows_processed = models.PositiveBigIntegerField(default=0)
+    # Free-form progress values reported by the job, e.g. bytes downloaded
+    progress = models.JSONField(default=dict, blank=True)
+    # Highest resident set size of the process seen while the job ran, in bytes
+    peak_memory = models.PositiveBigIntegerField(blank=True, null=True)
+    error = models.TextField(blank=True)
+
+    def __str__(self) -> str:
+        """Represents the job run as a string with some context information."""
+        return f"{self.job_type} job {self.id}"
+
+    @property
+    def status_str(self) -> str:
+        """Returns the string representation of the status integer."""
+        return self.Status(self.status).label
+
+    @property
+    def duration(self):
+        """Returns the run time in seconds so far, or None if not started."""
+        if self.started is None:
+            return None
+        end = self.finished or timezone.now()
+        return (end - self.started).total_seconds()
+
+    @property
+    def throughput(self):
+        """Returns the rows processed per second, or None if not started."""
+        duration = self.duration
+        if not duration:
+            return None
+        return self.rows_processed / duration
+
+
+class BanAudit(models.Model):
+    """Records who scheduled a range or ASN to be blocked, and how many ranges."""
+
+    class Action(models.IntegerChoices):
+        BAN_RANGE = 0, "Ban range"
+        BAN_ASN = 1, "Ban ASN"
+
+    action = models.SmallIntegerField(choices=Action.choices)
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, blank=True, null=True
+    )
+    asn = models.ForeignKey(ASN, on_delete=models.SET_NULL, blank=True, null=True)
+    iprange = models.ForeignKey(
+        IPRange, on_delete=models.SET_NULL, blank=True, null=True
+    )
+    job = models.ForeignKey(JobRecord, on_delete=models.SET_NULL, blank=True, null=True)
+    created = models.DateTimeField(auto_now_add=True)
+    finished = models.DateTimeField(blank=True, null=True)
+    # Ranges that were moved from new to pending by this action
+    ranges_scheduled = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self) -> str:
+        """Represents the action as a string with some context information."""
+        target = (
+            f"ASN id {self.asn_id}" if self.asn_id else f"range id {self.iprange_id}"
+        )
+        return f"{self.get_action_display()} of {target}"
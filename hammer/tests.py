@@ -1,3 +1,1912 @@
-from django.test import TestCase
+import csv
+import ipaddress
+import json
+import os
+import pickle
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from unittest import mock, skipUnless
+import requests
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from pyasn import pyasn
+from hammer.models import (
+    ASN,
+    BanAudit,
+    IPRange,
+    KEY_FIELDS,
+    JobRecord,
+    RangeCount,
+    join_key,
+    range_fields,
+    split_key,
+)
+from hammer.utils import (
+    bans,
+    counters,
+    db_profile,
+    ingest,
+    load_data,
+    page_cache,
+    parallel_parse,
+    reconcile,
+    snapshot,
+    staging,
+)
+from hammer.utils.asn_cache import ASNResolver, asn_resolver
+from hammer.utils.asn_lookup import ASNLookupService, asn_service
+from hammer.utils.consolidate import consolidate_ranges
+from hammer.utils.jobs import JobManager, report_progress
+from hammer.utils.jobs.jobs import process_pool, shutdown_pool
+from hammer.utils.jobs.registry import JobRecorder
+from hammer.utils.jobs.scheduler import Run, Scheduler, Tool
+from hammer.utils.load_data import add_range
+from hammer.utils.lookup_index import lookup_index
+from hammer.utils.pagination import KeysetPaginator
+from hammer.utils.range_index import (
+    RangeIndex,
+    counted_ranges,
+    merge_sorted,
+    network_bounds,
+    range_index,
+)
 
-# Create your tests here.
+
+class QueryBudgetTestCase(TestCase):
+    """Fails a view whose number of queries exceeds a fixed budget.
+
+    Budgets include the two queries every authenticated request makes to
+    load its session and user.
+    """
+
+    def setUp(self):
+        cache.clear()
+        asn_resolver.invalidate()
+        range_index.invalidate()
+        self.client.force_login(User.objects.create_user("budget"))
+
+    def tearDown(self):
+        asn_resolver.invalidate()
+        range_index.invalidate()
+
+    def assertQueryBudget(self, url, budget):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        self.assertLessEqual(
+            len(queries),
+            budget,
+            f"{url} ran {len(queries)} queries:\n"
+            + "\n".join(query["sql"] for query in queries.captured_queries),
+        )
+
+
+class RangeTestCase(QueryBudgetTestCase):
+    """Every range has its own ASN, so per-row queries in a list would show."""
+
+    @classmethod
+    def setUpTestData(cls):
+        asns = ASN.objects.bulk_create(
+            ASN(asn=64500 + n, description=f"AS{n}") for n in range(60)
+        )
+        IPRange.objects.bulk_create(
+            IPRange(
+                address=f"198.51.{n}.0/24",
+                **range_fields(ipaddress.ip_network(f"198.51.{n}.0/24")),
+                asn=asns[n],
+                scheduled=n % 3 == 1,
+                blocked=n % 3 == 2,
+                check_reason="test",
+            )
+            for n in range(60)
+        )
+        cls.first_asn = asns[0]
+        IPRange.objects.first().extra_asns.add(*asns[1:3])
+
+
+class ListQueryBudgetTests(RangeTestCase):
+    """List and detail views stay within their query budgets on a cache miss."""
+
+    def test_pager(self):
+        for filter_by in ("", "new", "pending", "blocked", "delisted"):
+            self.assertQueryBudget(f"/list/{filter_by}", 4)
+            self.assertQueryBudget(f"/list/{filter_by}?last", 4)
+
+    def test_pager_cursor(self):
+        last_id = IPRange.objects.order_by("id").values_list("id", flat=True)[49]
+        self.assertQueryBudget(f"/list/?after={last_id}", 4)
+        self.assertQueryBudget(f"/list/?before={last_id}", 4)
+
+    def test_list_asn(self):
+        self.assertQueryBudget(f"/list/asn/{self.first_asn.asn}", 5)
+        self.assertQueryBudget("/list/asn/1", 6)
+
+    def test_address_detail(self):
+        self.assertQueryBudget(f"/address/{IPRange.objects.first().pk}", 4)
+
+    def test_asn_detail(self):
+        self.assertQueryBudget(f"/asn/{self.first_asn.asn}", 4)
+
+    def test_lookup(self):
+        # The first lookup loads range_index, with one read of the counters
+        self.assertQueryBudget("/lookup/198.51.7.1", 5)
+        self.assertQueryBudget("/lookup/198.51.0.0/16", 4)
+
+    def test_top_asns(self):
+        self.assertQueryBudget("/top/", 3)
+        self.assertQueryBudget("/top/blocked", 3)
+
+    def test_tools(self):
+        self.assertQueryBudget("/tools/", 4)
+        self.assertQueryBudget("/jobs/status", 3)
+
+
+class ExplainQueriesTests(RangeTestCase):
+    """The lookups of the list and ban views are answered from indexes."""
+
+    @skipUnless(connection.vendor == "sqlite", "Reads SQLite query plans")
+    def test_plans_use_indexes(self):
+        out = StringIO()
+        call_command("explain_queries", asn=self.first_asn.asn, stdout=out)
+        plans = dict(
+            block.split("\n", 1) for block in out.getvalue().strip().split("\n\n")
+        )
+        self.assertEqual(len(plans), 7)
+        for name, plan in plans.items():
+            with self.subTest(name):
+                for line in plan.splitlines():
+                    self.assertIn("USING", line)
+
+
+class LookupViewTests(RangeTestCase):
+    """The lookup view finds ranges through the in-process range index."""
+
+    def lookup(self, query):
+        response = self.client.get(f"/lookup/{query}")
+        self.assertEqual(response.status_code, 200)
+        return [row["address"] for row in response.json()["ranges"]]
+
+    def test_containing(self):
+        IPRange.objects.create(
+            address="198.51.0.0/16",
+            **range_fields(ipaddress.ip_network("198.51.0.0/16")),
+            check_reason="test",
+        )
+        with mock.patch.object(
+            range_index, "containing", wraps=range_index.containing
+        ) as containing:
+            self.assertEqual(
+                self.lookup("198.51.7.1"), ["198.51.7.0/24", "198.51.0.0/16"]
+            )
+        containing.assert_called_once()
+
+    def test_overlapping(self):
+        with mock.patch.object(
+            range_index, "overlapping", wraps=range_index.overlapping
+        ) as overlapping:
+            self.assertEqual(
+                self.lookup("198.51.6.0/23"), ["198.51.6.0/24", "198.51.7.0/24"]
+            )
+        overlapping.assert_called_once()
+        self.assertEqual(self.lookup("203.0.113.0/24"), [])
+        self.assertEqual(self.client.get("/lookup/nope").status_code, 400)
+
+
+class PaginationTests(RangeTestCase):
+    """Keyset pages cover every row once, walking either way."""
+
+    def setUp(self):
+        super().setUp()
+        self.ids = list(IPRange.objects.order_by("id").values_list("id", flat=True))
+        self.paginator = KeysetPaginator(IPRange.objects.all(), 25)
+
+    def test_forward(self):
+        page = self.paginator.get_page()
+        pages = [page]
+        while page.has_next:
+            page = self.paginator.get_page(after=page.next_cursor)
+            pages.append(page)
+        self.assertEqual([len(page) for page in pages], [25, 25, 10])
+        self.assertEqual([page.has_previous for page in pages], [False, True, True])
+        self.assertEqual([row.id for page in pages for row in page], self.ids)
+
+    def test_backward(self):
+        page = self.paginator.get_page(last=True)
+        pages = [page]
+        while page.has_previous:
+            page = self.paginator.get_page(before=page.previous_cursor)
+            pages.append(page)
+        self.assertEqual([len(page) for page in pages], [25, 25, 10])
+        self.assertEqual([page.has_next for page in pages], [False, True, True])
+        self.assertEqual([row.id for page in pages[::-1] for row in page], self.ids)
+
+    def test_invalid_cursor(self):
+        page = self.paginator.get_page(after="x", before="")
+        self.assertEqual([row.id for row in page], self.ids[:25])
+        self.assertFalse(page.has_previous)
+
+    def test_cached_count(self):
+        paginator = KeysetPaginator(
+            IPRange.objects.filter(blocked=True), 25, count_key="test"
+        )
+        self.assertEqual(paginator.get_page().count, 20)
+        IPRange.objects.filter(blocked=False).update(blocked=True)
+        with self.assertNumQueries(1):
+            self.assertEqual(paginator.get_page().count, 20)
+        cache.clear()
+        self.assertEqual(paginator.get_page().count, 60)
+
+    def test_view(self):
+        response = self.client.get(f"/list/pending?before={self.ids[-1]}")
+        page = response.context["page_obj"]
+        self.assertEqual([row.id for row in page], self.ids[1::3])
+        self.assertFalse(page.has_previous)
+        self.assertTrue(page.has_next)
+
+
+@override_settings(HAMMER_PAGE_CACHE=True, HAMMER_PAGE_METRICS_RATE=1)
+class PageCacheTests(RangeTestCase):
+    """Cached pages skip their queries until a write bumps their stamps."""
+
+    def test_cached_pages(self):
+        range_id = IPRange.objects.first().pk
+        for url, budget in (
+            ("/list/pending", 3),
+            (f"/list/asn/{self.first_asn.asn}", 3),
+            (f"/address/{range_id}", 3),
+            ("/top/", 3),
+        ):
+            self.client.get(url)
+            self.assertQueryBudget(url, budget)
+        self.assertEqual(page_cache.metrics()["hit"], 4)
+
+    def test_invalidation(self):
+        address = (
+            IPRange.objects.filter(scheduled=False, blocked=False)
+            .exclude(asn=self.first_asn)
+            .first()
+        )
+        pending = self.client.get("/list/pending").content
+        detail = self.client.get(f"/address/{address.pk}").content
+        other = self.client.get(f"/list/asn/{self.first_asn.asn}").content
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(f"/banip/{address.pk}")
+        self.assertNotEqual(pending, self.client.get("/list/pending").content)
+        self.assertNotEqual(detail, self.client.get(f"/address/{address.pk}").content)
+        misses = page_cache.metrics()["miss"]
+        self.assertEqual(
+            other, self.client.get(f"/list/asn/{self.first_asn.asn}").content
+        )
+        self.assertEqual(page_cache.metrics()["miss"], misses)
+
+    def test_enabled(self):
+        with self.settings(HAMMER_PAGE_CACHE=None):
+            # Worker processes could not invalidate a process-local cache
+            self.assertTrue(page_cache.process_local())
+            with self.settings(HAMMER_JOB_EXECUTOR="process"):
+                self.assertFalse(page_cache.enabled())
+                self.client.get("/list/pending")
+                self.assertQueryBudget("/list/pending", 4)
+            with self.settings(HAMMER_JOB_EXECUTOR="thread"):
+                self.assertTrue(page_cache.enabled())
+
+    def test_sampled_metrics(self):
+        with self.settings(HAMMER_PAGE_METRICS_RATE=0.5):
+            with mock.patch("random.random", side_effect=[0.2, 0.7, 0.1, 0.9]):
+                for _ in range(4):
+                    self.client.get("/list/pending")
+            self.assertEqual(
+                page_cache.metrics(), {"hit": 2, "miss": 2, "hit_rate": 0.5}
+            )
+
+
+class CounterTests(QueryBudgetTestCase):
+    """Counters kept up to date on write must match a full recount."""
+
+    asndb = ASNLookupService(
+        database=pyasn(None, ipasn_string="198.51.0.0/16\t64500\n203.0.0.0/8\t64501")
+    )
+
+    def assertCountersExact(self):
+        kept = set(
+            RangeCount.objects.exclude(count=0).values_list("asn", "state", "count")
+        )
+        counters.rebuild()
+        self.assertEqual(
+            kept, set(RangeCount.objects.values_list("asn", "state", "count"))
+        )
+
+    def test_writes(self):
+        ingest.load_rows(
+            [[f"198.51.{n}.0/24", "test"] for n in range(10)]
+            + [["203.0.110.0/25", "test"], ["203.0.110.128/25", "test"]],
+            self.asndb,
+            consolidate=False,
+        )
+        add_range("203.0.114.0/24", "test", self.asndb)
+        self.assertCountersExact()
+        self.client.post(f"/banip/{IPRange.objects.get(address='198.51.0.0/24').id}")
+        bans.ban_asns([ASN.objects.get(asn=64501).id])
+        self.assertCountersExact()
+        consolidate_ranges()
+        IPRange.objects.filter(address="198.51.1.0/24").delete()
+        self.assertCountersExact()
+        self.assertEqual(counters.totals(), {"new": 3, "pending": 3, "blocked": 0})
+        self.assertEqual(counters.top_offenders()[0]["asn"], 64500)
+
+    def test_ranges_without_asn(self):
+        for n in range(3):
+            IPRange.objects.create(
+                address=f"45.0.{n}.0/24",
+                **range_fields(ipaddress.ip_network(f"45.0.{n}.0/24")),
+                check_reason="test",
+            )
+        self.assertEqual(RangeCount.objects.filter(asn__isnull=True).count(), 1)
+        self.assertCountersExact()
+
+    def test_concurrent_counter_creation(self):
+        RangeCount.objects.create(asn=None, state=counters.State.NEW, count=2)
+        update = QuerySet.update
+        missed = []
+
+        def miss_once(queryset, **kwargs):
+            # The first update misses the counter another writer just created
+            if not missed:
+                missed.append(queryset)
+                return 0
+            return update(queryset, **kwargs)
+
+        with mock.patch.object(QuerySet, "update", miss_once):
+            counters.adjust({(None, counters.State.NEW): 3})
+        self.assertEqual(
+            list(RangeCount.objects.filter(asn__isnull=True).values_list("count")),
+            [(5,)],
+        )
+
+    def test_save_reads_no_state(self):
+        iprange = IPRange.objects.create(
+            address="45.0.0.0/24",
+            **range_fields(ipaddress.ip_network("45.0.0.0/24")),
+            check_reason="test",
+        )
+        for loaded in (False, True):
+            if loaded:
+                iprange = IPRange.objects.get(id=iprange.id)
+            iprange.scheduled = not iprange.scheduled
+            with CaptureQueriesContext(connection) as queries:
+                iprange.save()
+            self.assertFalse(
+                [
+                    query
+                    for query in queries.captured_queries
+                    if query["sql"].startswith("SELECT")
+                ]
+            )
+            self.assertCountersExact()
+        # A range reloaded by refresh_from_db is read back once
+        IPRange.objects.filter(id=iprange.id).update(blocked=True)
+        counters.adjust(
+            {(None, counters.State.NEW): -1, (None, counters.State.BLOCKED): 1}
+        )
+        iprange.refresh_from_db()
+        iprange.blocked = False
+        iprange.save()
+        self.assertCountersExact()
+
+    def test_add_range_links_extra_asns(self):
+        asndb = ASNLookupService(
+            database=pyasn(
+                None, ipasn_string="198.51.0.0/16\t64500\n198.51.10.128/25\t64502"
+            )
+        )
+        self.assertEqual(add_range("198.51.10.0/24", "test", asndb), 1)
+        self.assertEqual(add_range("198.51.10.0/24", "test", asndb), 0)
+        iprange = IPRange.objects.get(address="198.51.10.0/24")
+        self.assertEqual(iprange.asn.asn, 64500)
+        self.assertEqual(
+            list(iprange.extra_asns.values_list("asn", flat=True)), [64502]
+        )
+        self.assertCountersExact()
+
+
+class ASNLookupServiceTests(TestCase):
+    """asn.dat is reloaded when it changes, without stalling lookups."""
+
+    def setUp(self):
+        scratch = tempfile.TemporaryDirectory()
+        self.addCleanup(scratch.cleanup)
+        self.asn_file = Path(scratch.name) / "asn.dat"
+        self.service = ASNLookupService(self.asn_file)
+        self.writes = 0
+
+    def write(self, asn):
+        self.asn_file.write_text(f"198.51.0.0/16\t{asn}\n")
+        self.writes += 1
+        stamp = time.time_ns() + self.writes * 10**9
+        os.utime(self.asn_file, ns=(stamp, stamp))
+
+    def test_reload(self):
+        self.assertFalse(self.service.available)
+        with self.assertRaises(FileNotFoundError):
+            self.service.lookup("198.51.100.1")
+        self.write(64500)
+        self.assertEqual(self.service.lookup("198.51.100.1"), 64500)
+        database = self.service.database()
+        self.assertIs(self.service.database(), database)
+        self.assertEqual(
+            self.service.covered_asns_many([ipaddress.ip_network("198.51.0.0/16")]),
+            [{64500}],
+        )
+        self.write(64501)
+        self.assertEqual(self.service.lookup_many(["198.51.100.1"]), [64501])
+        self.assertEqual(
+            self.service.covered_asns_many([ipaddress.ip_network("198.51.0.0/16")]),
+            [{64501}],
+        )
+        database = self.service.database()
+        self.service.reload()
+        self.assertIsNot(self.service.database(), database)
+
+    def test_swap_during_lookups(self):
+        self.write(64500)
+        self.service.database()
+        self.write(64501)
+        loading, release = threading.Event(), threading.Event()
+
+        def slow_pyasn(path):
+            loading.set()
+            release.wait(5)
+            return pyasn(path)
+
+        with mock.patch("hammer.utils.asn_lookup.pyasn", slow_pyasn):
+            with ThreadPoolExecutor(max_workers=1) as pool:
+                reloaded = pool.submit(self.service.lookup, "198.51.100.1")
+                self.assertTrue(loading.wait(5))
+                # The previous database answers while the new one is parsed
+                self.assertEqual(self.service.lookup("198.51.100.1"), 64500)
+                release.set()
+                self.assertEqual(reloaded.result(timeout=5), 64501)
+        self.assertEqual(self.service.lookup("198.51.100.1"), 64501)
+
+
+class ASNResolverTests(TestCase):
+    """AS numbers resolve to ids from the cache once seen."""
+
+    def setUp(self):
+        ASN.objects.bulk_create(ASN(asn=number) for number in (64500, 64501, 64502))
+        self.ids = dict(ASN.objects.values_list("asn", "id"))
+        asn_resolver.invalidate()
+        self.addCleanup(asn_resolver.invalidate)
+
+    def test_resolve_many(self):
+        resolver = ASNResolver()
+        with self.assertNumQueries(0):
+            self.assertEqual(resolver.resolve_many([]), {})
+        with self.assertNumQueries(1):
+            self.assertEqual(
+                resolver.resolve_many(["64500", 64501, 64503], create=False),
+                {64500: self.ids[64500], 64501: self.ids[64501]},
+            )
+        self.assertFalse(ASN.objects.filter(asn=64503).exists())
+        with self.assertNumQueries(3):
+            created = resolver.resolve_many([64500, 64503])[64503]
+        self.assertEqual(created, ASN.objects.get(asn=64503).id)
+        with self.assertNumQueries(0):
+            self.assertEqual(resolver.resolve(64503), created)
+
+    def test_least_recently_used_dropped(self):
+        resolver = ASNResolver(max_size=2)
+        resolver.preload([64500, 64501, 64502])
+        self.assertEqual(len(resolver), 2)
+        resolver.resolve_many([64500, 64501])
+        resolver.resolve(64500)
+        resolver.resolve(64502)
+        with self.assertNumQueries(0):
+            resolver.resolve_many([64500, 64502])
+        with self.assertNumQueries(1):
+            self.assertEqual(resolver.resolve(64501), self.ids[64501])
+
+    def test_preload_batch(self):
+        resolver = ASNResolver()
+        with self.assertNumQueries(1):
+            resolver.preload([64500, 64501, 64503])
+        self.assertEqual(len(resolver), 2)
+        with self.assertNumQueries(0):
+            resolver.preload([64501])
+        resolver.invalidate(asn_id=self.ids[64501])
+        self.assertEqual(len(resolver), 1)
+        self.assertEqual(resolver._numbers, {self.ids[64500]: 64500})
+
+    def test_saves_invalidate(self):
+        self.assertEqual(asn_resolver.resolve(64500), self.ids[64500])
+        asn = ASN.objects.get(asn=64500)
+        asn.asn = 64510
+        asn.save()
+        self.assertIsNone(asn_resolver.resolve(64500, create=False))
+        self.assertEqual(asn_resolver.resolve(64510), asn.id)
+        asn.delete()
+        self.assertIsNone(asn_resolver.resolve(64510, create=False))
+
+
+class IngestTests(TestCase):
+    """Lists are written a chunk at a time, in a few queries per chunk."""
+
+    asndb = ASNLookupService(
+        database=pyasn(None, ipasn_string="198.51.0.0/16\t64500\n203.0.0.0/8\t64501")
+    )
+
+    def setUp(self):
+        asn_resolver.invalidate()
+        range_index.invalidate()
+        self.addCleanup(asn_resolver.invalidate)
+        self.addCleanup(range_index.invalidate)
+
+    def test_chunks(self):
+        rows = [[f"198.51.{n}.0/24", "test"] for n in range(6)] + [
+            ["198.51.0.0/24", "duplicate"],
+            ["10.0.0.0/8", "private"],
+            ["not an address", "invalid"],
+            ["203.0.113.9"],
+        ]
+        with mock.patch.object(
+            ingest, "report_progress"
+        ) as progress, CaptureQueriesContext(connection) as queries:
+            added = ingest.load_rows(rows, self.asndb, chunk_size=3, consolidate=False)
+        self.assertEqual(added, 6)
+        self.assertEqual(
+            progress.call_args_list,
+            [
+                mock.call(rows=3, added=3),
+                mock.call(rows=6, added=6),
+                mock.call(rows=7, added=6),
+            ],
+        )
+        inserts = [
+            query
+            for query in queries.captured_queries
+            if 'INTO "hammer_iprange" ' in query["sql"]
+        ]
+        self.assertEqual(len(inserts), 2)
+        self.assertEqual(
+            set(IPRange.objects.values_list("asn__asn", "check_reason")),
+            {(64500, "test")},
+        )
+        self.assertEqual(counters.totals()["new"], 6)
+
+    def test_failed_chunk_rolls_back(self):
+        rows = [[f"198.51.{n}.0/24", "test"] for n in range(4)]
+        with mock.patch.object(
+            counters, "adjust", side_effect=[None, RuntimeError("disk full")]
+        ), mock.patch.object(
+            asn_resolver, "invalidate", wraps=asn_resolver.invalidate
+        ) as invalidate:
+            with self.assertRaises(RuntimeError):
+                ingest.load_rows(rows, self.asndb, chunk_size=2, consolidate=False)
+        self.assertEqual(
+            set(IPRange.objects.values_list("address", flat=True)),
+            {"198.51.0.0/24", "198.51.1.0/24"},
+        )
+        invalidate.assert_called_once()
+
+    def test_consolidates_against_stored(self):
+        ingest.load_rows([["198.51.4.0/23", "first"]], self.asndb)
+        added = ingest.load_rows(
+            [
+                ["198.51.4.0/24", "covered"],
+                ["198.51.6.0/24", "low"],
+                ["198.51.7.0/24", "high"],
+            ],
+            self.asndb,
+        )
+        self.assertEqual(added, 1)
+        self.assertEqual(
+            set(IPRange.objects.values_list("address", flat=True)),
+            {"198.51.4.0/23", "198.51.6.0/23"},
+        )
+
+
+class BanTests(RangeTestCase):
+    """Bans are applied in batches and audited."""
+
+    def test_ban_asns(self):
+        user = User.objects.get(username="budget")
+        asns = list(ASN.objects.order_by("asn")[:6])
+        IPRange.objects.filter(asn__in=asns[1:]).update(asn=asns[0])
+        scheduled = bans.ban_asns([asn.id for asn in asns[:2]], user.id, batch_size=1)
+        self.assertEqual(scheduled, 2)  # ranges 0 and 3 were new
+        self.assertFalse(
+            IPRange.objects.filter(asn=asns[0], scheduled=False, blocked=False).exists()
+        )
+        self.assertEqual(ASN.objects.get(id=asns[0].id).asn_status, ASN.Status.BANNED)
+        self.assertEqual(
+            list(
+                BanAudit.objects.order_by("id").values_list("asn", "ranges_scheduled")
+            ),
+            [(asns[0].id, 2), (asns[1].id, 0)],
+        )
+        self.assertEqual(
+            BanAudit.objects.filter(user=user, finished__isnull=False).count(), 2
+        )
+
+    def test_ban_range(self):
+        iprange = IPRange.objects.filter(scheduled=False, blocked=False).first()
+        self.assertTrue(bans.ban_range(iprange.id))
+        self.assertFalse(bans.ban_range(iprange.id))
+        self.assertEqual(BanAudit.objects.get().iprange_id, iprange.id)
+        self.assertEqual(self.client.post("/banip/0").status_code, 404)
+
+    def test_ban_views(self):
+        asns = list(ASN.objects.order_by("asn")[:2])
+        with mock.patch("hammer.utils.tools.scheduler.submit") as submit:
+            self.assertEqual(self.client.get("/banasns").status_code, 405)
+            self.assertEqual(self.client.get("/execute/banasn").status_code, 404)
+            submit.assert_not_called()
+            response = self.client.post("/banasns", {"asn": [a.asn for a in asns]})
+        self.assertRedirects(response, "/tools/", fetch_redirect_response=False)
+        submit.assert_called_once_with(
+            "banasn",
+            args=([asn.id for asn in asns], User.objects.get(username="budget").id),
+        )
+
+
+class ExportTests(RangeTestCase):
+    """Exports stream the selected ranges in each format."""
+
+    def get_lines(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, url)
+        return b"".join(response.streaming_content).decode().splitlines()
+
+    def test_formats(self):
+        lines = self.get_lines("/export/csv?status=pending")
+        self.assertEqual(lines[0], "address,asn,status,date_added,check_reason")
+        self.assertEqual(len(lines), 21)
+        self.assertTrue(lines[1].startswith("198.51.1.0/24,64501,pending,"))
+        rows = [json.loads(line) for line in self.get_lines("/export/jsonl?asn=64501")]
+        self.assertEqual(
+            [row["address"] for row in rows], ["198.51.0.0/24", "198.51.1.0/24"]
+        )
+        self.assertEqual(len(self.get_lines("/export/cidr")), 60)
+        self.assertEqual(self.get_lines("/export/cidr?asn=1"), [])
+
+    def test_collapsed(self):
+        IPRange.objects.create(
+            address="2001:db8::/48",
+            **range_fields(ipaddress.ip_network("2001:db8::/48")),
+            check_reason="test",
+        )
+        self.assertEqual(
+            self.get_lines("/export/cidr?collapse=1"),
+            [
+                "198.51.0.0/19",
+                "198.51.32.0/20",
+                "198.51.48.0/21",
+                "198.51.56.0/22",
+                "2001:db8::/48",
+            ],
+        )
+        self.assertEqual(self.client.get("/export/csv?collapse=1").status_code, 400)
+
+
+class ReconcileTests(RangeTestCase):
+    """Ranges inside the block list are marked blocked, others are left alone."""
+
+    def test_reconcile(self):
+        counters.rebuild()
+        dump = [
+            "address,reason",
+            "198.51.0.0/23",  # covers ranges 0 and 1
+            "198.51.3.0/24",
+            "198.51.4.0/25",  # only part of range 4
+            "198.51.5.0/24",
+            "198.51.6.0/24",  # together with the line above covers 5 to 6
+            "198.51.6.128/25",
+            "not an address",
+        ]
+        stats = reconcile.reconcile_blocks(dump)
+        self.assertEqual(stats["intervals"], 3)  # 3.0/24 and 4.0/25 are adjacent
+        blocked = set(
+            IPRange.objects.filter(blocked=True).values_list("address", flat=True)
+        )
+        for n in (0, 1, 3, 5, 6):
+            self.assertIn(f"198.51.{n}.0/24", blocked)
+        self.assertNotIn("198.51.4.0/24", blocked)
+        self.assertEqual(stats["blocked"], 4)  # range 5 was already blocked
+        self.assertFalse(IPRange.objects.filter(blocked=True, scheduled=True).exists())
+        self.assertEqual(counters.totals(), {"new": 17, "pending": 19, "blocked": 24})
+
+
+@override_settings(HAMMER_API_TOKENS=["secret"])
+class LookupApiTests(RangeTestCase):
+    """The token API answers from memory and follows writes to ranges and ASNs."""
+
+    def setUp(self):
+        super().setUp()
+        lookup_index.invalidate()
+        # A background thread could not see the test's transaction
+        lookup_index.background = False
+
+    def tearDown(self):
+        super().tearDown()
+        lookup_index.invalidate()
+        lookup_index.background = True
+
+    def api(self, ip, token="secret"):
+        return self.client.get(
+            f"/api/lookup/{ip}", HTTP_AUTHORIZATION=f"Bearer {token}"
+        )
+
+    def batch(self, body):
+        return self.client.post(
+            "/api/lookup",
+            body,
+            content_type="application/json",
+            HTTP_AUTHORIZATION="Bearer secret",
+        )
+
+    def test_token(self):
+        self.assertEqual(self.api("198.51.7.1", token="wrong").status_code, 401)
+        self.assertEqual(self.client.get("/api/lookup/198.51.7.1").status_code, 401)
+        self.assertEqual(self.api("not an address").status_code, 400)
+
+    def test_lookup(self):
+        self.api("192.0.2.1")
+        with self.assertNumQueries(0):
+            response = self.api("198.51.7.1").json()
+        self.assertEqual(response["ranges"][0]["address"], "198.51.7.0/24")
+        self.assertEqual(response["ranges"][0]["asn"], 64507)
+        self.assertEqual(response["ranges"][0]["asn_status"], "unchecked")
+        self.assertTrue(response["listed"])
+        self.assertFalse(response["blocked"] or response["asn_banned"])
+        self.assertFalse(self.api("192.0.2.1").json()["listed"])
+
+    def test_writes(self):
+        self.api("203.0.114.1")
+        IPRange.objects.create(
+            address="203.0.114.0/25",
+            **range_fields(ipaddress.ip_network("203.0.114.0/25")),
+            asn=ASN.objects.get(asn=64501),
+            check_reason="test",
+        )
+        added = self.api("203.0.114.1").json()["ranges"]
+        self.assertEqual(
+            [(row["address"], row["asn"]) for row in added], [("203.0.114.0/25", 64501)]
+        )
+        # Bulk updates are read back on the next refresh
+        bans.ban_asns([ASN.objects.get(asn=64507).id])
+        lookup_index.refresh(force=True)
+        response = self.api("198.51.7.1").json()
+        self.assertTrue(response["asn_banned"])
+        self.assertTrue(response["ranges"][0]["scheduled"])
+        IPRange.objects.get(address="198.51.7.0/24").delete()
+        self.assertFalse(self.api("198.51.7.1").json()["listed"])
+
+    def test_refresh_skips_unchanged_bounds(self):
+        self.api("198.51.7.1")
+        bans.ban_asns(list(ASN.objects.values_list("id", flat=True)))
+        with mock.patch(
+            "hammer.utils.range_index.merge_sorted", wraps=merge_sorted
+        ) as merge, mock.patch.object(range_index, "_insert") as insert:
+            lookup_index.refresh(force=True)
+        merge.assert_not_called()
+        insert.assert_not_called()
+        self.assertTrue(self.api("198.51.7.1").json()["ranges"][0]["scheduled"])
+
+    def test_deleted_elsewhere(self):
+        counters.rebuild()
+        self.api("198.51.7.1")
+        # A delete in another process: no signals, only the counters change
+        gone = IPRange.objects.filter(address__in=["198.51.7.0/24", "198.51.9.0/24"])
+        deltas = Counter(
+            (asn_id, counters.range_state(scheduled, blocked))
+            for asn_id, scheduled, blocked in gone.values_list(
+                "asn_id", "scheduled", "blocked"
+            )
+        )
+        gone._raw_delete(gone.db)
+        counters.adjust({key: -count for key, count in deltas.items()})
+        self.assertTrue(self.api("198.51.7.1").json()["listed"])
+        lookup_index.refresh(force=True)
+        self.assertFalse(self.api("198.51.7.1").json()["listed"])
+        self.assertFalse(self.api("198.51.9.1").json()["listed"])
+        self.assertTrue(self.api("198.51.8.1").json()["listed"])
+
+    def test_refresh_in_progress(self):
+        self.api("198.51.7.1")
+        lookup_index._built -= lookup_index.rebuild_interval
+        with lookup_index._refresh_lock:
+            # Another thread is reloading, so this one answers at once
+            with self.assertNumQueries(0):
+                self.assertTrue(self.api("198.51.7.1").json()["listed"])
+        built = lookup_index._built
+        lookup_index.refresh()
+        self.assertGreater(lookup_index._built, built)
+
+    def test_batch(self):
+        response = self.batch({"ips": ["198.51.8.1", "bad", "2001:db8::1"]})
+        results = response.json()["results"]
+        self.assertEqual(
+            [result["ip"] for result in results], ["198.51.8.1", "bad", "2001:db8::1"]
+        )
+        self.assertTrue(results[0]["blocked"])
+        self.assertIn("error", results[1])
+        self.assertFalse(results[2]["listed"])
+        self.assertEqual(self.batch({"ip": "198.51.8.1"}).status_code, 400)
+        self.assertEqual(self.batch({"ips": ["198.51.8.1"] * 1001}).status_code, 400)
+
+
+class LookupRefreshTests(TransactionTestCase):
+    """Lookups leave loading and refreshing the index to a background thread."""
+
+    def setUp(self):
+        lookup_index.invalidate()
+        self.addCleanup(lookup_index.invalidate)
+        self.ranges = [
+            IPRange.objects.create(
+                address=address,
+                **range_fields(ipaddress.ip_network(address)),
+                check_reason="test",
+            )
+            for address in ("185.10.0.0/24", "185.10.1.0/24")
+        ]
+
+    def lookup(self, address):
+        with self.assertNumQueries(0):
+            return lookup_index.lookup(address)
+
+    def refresh_due(self):
+        lookup_index._checked -= lookup_index.refresh_interval
+
+    def test_background_refresh(self):
+        self.assertTrue(self.lookup("185.10.0.1")["listed"])
+        # Changes made elsewhere, without signals
+        IPRange.objects.filter(id=self.ranges[0].id).update(
+            blocked=True, last_updated=timezone.now()
+        )
+        self.refresh_due()
+        release = threading.Event()
+
+        def held():
+            release.wait(5)
+            return counted_ranges()
+
+        with mock.patch("hammer.utils.lookup_index.counted_ranges", side_effect=held):
+            # The refresh waits, but lookups answer from the current data
+            self.assertFalse(self.lookup("185.10.0.1")["blocked"])
+            release.set()
+            lookup_index._worker.join()
+        self.assertTrue(self.lookup("185.10.0.1")["blocked"])
+
+        gone = IPRange.objects.filter(id=self.ranges[1].id)
+        gone._raw_delete(gone.db)
+        counters.adjust({(None, counters.State.NEW): -1})
+        self.refresh_due()
+        with mock.patch.object(
+            lookup_index, "_rebuild", wraps=lookup_index._rebuild
+        ) as rebuild:
+            self.assertTrue(self.lookup("185.10.1.1")["listed"])
+            lookup_index._worker.join()
+        rebuild.assert_called_once()
+        self.assertFalse(self.lookup("185.10.1.1")["listed"])
+        self.assertTrue(self.lookup("185.10.0.1")["listed"])
+
+
+class RangeKeyTests(TestCase):
+    """Bounds keep address order in the signed key columns of both versions."""
+
+    @classmethod
+    def setUpTestData(cls):
+        for address in (
+            "198.51.0.0/16",
+            "198.51.100.0/24",
+            "198.51.100.128/25",
+            "203.0.113.0/24",
+            "2001:db8::/32",
+            "2001:db8:8000::/33",
+            "ffff::/16",
+        ):
+            IPRange.objects.create(
+                address=address,
+                **range_fields(ipaddress.ip_network(address)),
+                check_reason="test",
+            )
+
+    def addresses(self, queryset):
+        return sorted(queryset.values_list("address", flat=True))
+
+    def test_keys(self):
+        values = [0, 1, (1 << 63) - 1, 1 << 63, (1 << 64) + 5, (1 << 128) - 1]
+        keys = [split_key(value) for value in values]
+        self.assertEqual(keys, sorted(keys))
+        self.assertEqual([join_key(*key) for key in keys], values)
+        self.assertTrue(
+            all(-(1 << 63) <= half < 1 << 63 for key in keys for half in key)
+        )
+
+    def test_containing(self):
+        self.assertEqual(
+            self.addresses(IPRange.objects.containing("198.51.100.200")),
+            ["198.51.0.0/16", "198.51.100.0/24", "198.51.100.128/25"],
+        )
+        self.assertEqual(
+            self.addresses(IPRange.objects.containing("2001:db8:ffff::1")),
+            ["2001:db8:8000::/33", "2001:db8::/32"],
+        )
+        self.assertEqual(
+            self.addresses(IPRange.objects.containing("ffff:ffff::")), ["ffff::/16"]
+        )
+        self.assertFalse(IPRange.objects.containing("192.0.2.1").exists())
+
+    def test_overlapping(self):
+        self.assertEqual(
+            self.addresses(IPRange.objects.overlapping("198.51.100.0/23")),
+            ["198.51.0.0/16", "198.51.100.0/24", "198.51.100.128/25"],
+        )
+        self.assertEqual(
+            self.addresses(IPRange.objects.overlapping("2001:db8::/31")),
+            ["2001:db8:8000::/33", "2001:db8::/32"],
+        )
+        self.assertEqual(
+            self.addresses(IPRange.objects.overlapping("0.0.0.0/0")),
+            ["198.51.0.0/16", "198.51.100.0/24", "198.51.100.128/25", "203.0.113.0/24"],
+        )
+
+
+class ASNRefreshTests(TestCase):
+    """Rebuilding asn.dat updates only the ranges under changed prefixes."""
+
+    def setUp(self):
+        scratch = tempfile.TemporaryDirectory()
+        self.addCleanup(scratch.cleanup)
+        self.downloads = Path(scratch.name)
+        self.mrt_file = self.downloads / "rib.mrt"
+        self.mrt_file.write_bytes(b"")
+        for patch in (
+            mock.patch.object(load_data, "DOWNLOADS_DIR", self.downloads),
+            mock.patch.object(asn_service, "asn_file", self.downloads / "asn.dat"),
+            mock.patch.object(asn_service, "_db", None),
+            mock.patch.object(asn_service, "_table", None),
+            mock.patch.object(asn_service, "_stamp", None),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+        asn_resolver.invalidate()
+        range_index.invalidate()
+        self.addCleanup(asn_resolver.invalidate)
+        self.addCleanup(range_index.invalidate)
+
+    def update(self, prefixes):
+        """Run update_asn_db on a dump announcing prefixes."""
+        with mock.patch(
+            "pyasn.mrtx.parse_mrt_file", return_value=prefixes
+        ), mock.patch.object(
+            load_data, "refresh_range_asns", wraps=load_data.refresh_range_asns
+        ) as refresh:
+            load_data.update_asn_db(self.mrt_file)
+        return refresh
+
+    def asns(self):
+        return {
+            row.address: (
+                row.asn and row.asn.asn,
+                set(row.extra_asns.values_list("asn", flat=True)),
+            )
+            for row in IPRange.objects.select_related("asn")
+        }
+
+    def test_changed_prefixes(self):
+        self.assertEqual(
+            load_data.changed_prefixes(
+                {"185.10.0.0/16": 64500, "185.20.0.0/16": 64501, "185.40.0.0/16": 1},
+                {"185.10.0.0/16": 64500, "185.20.0.0/16": 64502, "185.30.0.0/16": 2},
+            ),
+            {"185.20.0.0/16", "185.30.0.0/16", "185.40.0.0/16"},
+        )
+
+    def test_update(self):
+        refresh = self.update({"185.10.0.0/16": 64500, "185.20.0.0/16": {64501, 64509}})
+        refresh.assert_not_called()
+        ingest.load_rows(
+            [
+                ["185.10.1.0/24", "same"],
+                ["185.20.1.0/24", "moved"],
+                ["185.30.1.0/24", "announced"],
+            ]
+        )
+        self.assertEqual(
+            self.asns(),
+            {
+                "185.10.1.0/24": (64500, set()),
+                "185.20.1.0/24": (64501, set()),
+                "185.30.1.0/24": (None, set()),
+            },
+        )
+        unchanged = IPRange.objects.get(address="185.10.1.0/24").last_updated
+        refresh = self.update(
+            {
+                "185.10.0.0/16": 64500,
+                "185.20.0.0/16": 64502,
+                "185.20.1.128/25": 64504,
+                "185.30.0.0/16": 64503,
+            }
+        )
+        self.assertEqual(
+            refresh.call_args.args[0],
+            {"185.20.0.0/16", "185.20.1.128/25", "185.30.0.0/16"},
+        )
+        self.assertEqual(
+            self.asns(),
+            {
+                "185.10.1.0/24": (64500, set()),
+                "185.20.1.0/24": (64502, {64504}),
+                "185.30.1.0/24": (64503, set()),
+            },
+        )
+        self.assertEqual(
+            IPRange.objects.get(address="185.10.1.0/24").last_updated, unchanged
+        )
+        self.assertTrue(self.mrt_file.is_file())
+        kept = set(
+            RangeCount.objects.exclude(count=0).values_list("asn", "state", "count")
+        )
+        counters.rebuild()
+        self.assertEqual(
+            kept, set(RangeCount.objects.values_list("asn", "state", "count"))
+        )
+
+
+class DownloadTests(TestCase):
+    """Lists are only transferred again when the server says they changed."""
+
+    url = "https://lists.example/global.csv"
+
+    def setUp(self):
+        scratch = tempfile.TemporaryDirectory()
+        self.addCleanup(scratch.cleanup)
+        self.downloads = Path(scratch.name)
+        patch = mock.patch.object(load_data, "DOWNLOADS_DIR", self.downloads)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.session = mock.Mock()
+
+    def respond(self, status, chunks=(), headers=None):
+        """Make the next request answer with status and the given body chunks."""
+        response = mock.MagicMock(status_code=status, headers=headers or {})
+        response.__enter__.return_value = response
+        response.iter_content.return_value = chunks
+        if status >= 400:
+            response.raise_for_status.side_effect = requests.HTTPError(status)
+        self.session.get.return_value = response
+
+    def download(self, force=True):
+        return load_data.download_csv(
+            self.url, "global_list.csv", force, session=self.session
+        )
+
+    def sent_headers(self):
+        return self.session.get.call_args.kwargs["headers"]
+
+    def test_conditional(self):
+        stamp = "Sun, 18 Oct 2026 10:00:00 GMT"
+        self.respond(
+            200, [b"a,b\n", b"1,2\n"], {"ETag": '"v1"', "Last-Modified": stamp}
+        )
+        self.assertTrue(self.download())
+        self.assertEqual(self.sent_headers(), {})
+        path = self.downloads / "global_list.csv"
+        self.assertEqual(path.read_bytes(), b"a,b\n1,2\n")
+        self.session.get.reset_mock()
+        self.assertFalse(self.download(force=False))
+        self.session.get.assert_not_called()
+        self.respond(304)
+        self.assertFalse(self.download())
+        self.assertEqual(
+            self.sent_headers(),
+            {"If-None-Match": '"v1"', "If-Modified-Since": stamp},
+        )
+        self.assertEqual(path.read_bytes(), b"a,b\n1,2\n")
+        self.respond(200, [b"a,b\n3,4\n"], {"ETag": '"v2"'})
+        self.assertTrue(self.download())
+        self.assertEqual(path.read_bytes(), b"a,b\n3,4\n")
+        self.respond(304)
+        self.download()
+        self.assertEqual(self.sent_headers(), {"If-None-Match": '"v2"'})
+
+    def test_failure_keeps_previous_file(self):
+        path = self.downloads / "global_list.csv"
+        path.write_bytes(b"old")
+
+        def interrupted():
+            yield b"partial"
+            raise requests.ConnectionError("reset")
+
+        self.respond(200, interrupted())
+        with self.assertRaises(requests.ConnectionError):
+            self.download()
+        self.respond(500)
+        with self.assertRaises(requests.HTTPError):
+            self.download()
+        self.assertEqual(path.read_bytes(), b"old")
+        self.assertEqual(list(self.downloads.iterdir()), [path])
+
+
+class RefreshAllTests(TestCase):
+    """refresh_all parses the RIB while the lists download, then loads them."""
+
+    def setUp(self):
+        scratch = tempfile.TemporaryDirectory()
+        self.addCleanup(scratch.cleanup)
+        self.downloads = Path(scratch.name)
+        self.rib = self.downloads / load_data.RIB_FILE
+        self.events = []
+        self.mocks = {}
+        for name in (
+            "fetch_rib",
+            "rebuild_asn_db",
+            "download_enwiki",
+            "download_global",
+            "load_csv",
+        ):
+            patch = mock.patch.object(load_data, name)
+            self.mocks[name] = patch.start()
+            self.addCleanup(patch.stop)
+        patch = mock.patch.object(load_data, "DOWNLOADS_DIR", self.downloads)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.mocks["load_csv"].side_effect = lambda name: self.events.append(name)
+
+    def test_parses_while_downloading(self):
+        self.rib.write_bytes(b"")
+        self.mocks["fetch_rib"].return_value = self.rib
+        parsing = threading.Barrier(3, timeout=5)
+
+        def rebuild(mrt_file):
+            parsing.wait()
+            self.events.append("asn")
+
+        def download():
+            parsing.wait()
+            return True
+
+        self.mocks["rebuild_asn_db"].side_effect = rebuild
+        self.mocks["download_enwiki"].side_effect = download
+        self.mocks["download_global"].side_effect = download
+        load_data.refresh_all()
+        self.mocks["rebuild_asn_db"].assert_called_once_with(self.rib)
+        self.assertEqual(self.events, ["asn", "enwiki", "global"])
+        self.assertFalse(self.rib.exists())
+
+    def test_unchanged(self):
+        self.mocks["fetch_rib"].return_value = None
+        self.mocks["download_enwiki"].return_value = False
+        self.mocks["download_global"].return_value = False
+        (self.downloads / "enwiki_list.fp").write_bytes(b"")
+        load_data.refresh_all("https://ribs.example/latest.mrt")
+        self.mocks["fetch_rib"].assert_called_once_with(
+            "https://ribs.example/latest.mrt"
+        )
+        self.mocks["rebuild_asn_db"].assert_not_called()
+        self.assertEqual(self.events, ["global"])
+
+    def test_failed_rib_stops_loads(self):
+        self.rib.write_bytes(b"")
+        self.mocks["fetch_rib"].return_value = self.rib
+        self.mocks["rebuild_asn_db"].side_effect = ValueError("truncated dump")
+        with self.assertRaises(ValueError):
+            load_data.refresh_all()
+        self.mocks["download_enwiki"].assert_called_once()
+        self.mocks["load_csv"].assert_not_called()
+        self.assertFalse(self.rib.exists())
+
+
+class ListTestCase(TestCase):
+    """Loads lists from a scratch downloads directory with a fixed ASN database."""
+
+    asndb = pyasn(None, ipasn_string="198.51.0.0/16\t64500\n203.0.0.0/8\t64501")
+
+    def setUp(self):
+        scratch = tempfile.TemporaryDirectory()
+        self.addCleanup(scratch.cleanup)
+        self.downloads = Path(scratch.name)
+        for patch in (
+            mock.patch.object(load_data, "DOWNLOADS_DIR", self.downloads),
+            mock.patch.object(asn_service, "database", return_value=self.asndb),
+        ):
+            patch.start()
+            self.addCleanup(patch.stop)
+        asn_resolver.invalidate()
+        range_index.invalidate()
+        self.addCleanup(asn_resolver.invalidate)
+        self.addCleanup(range_index.invalidate)
+
+    def write_list(self, source, addresses):
+        with open(self.downloads / f"{source}_list.csv", "w") as out:
+            out.write("address,reason\n")
+            out.writelines(f"{address},open proxy\n" for address in addresses)
+
+    def load(self, source, addresses, **kwargs):
+        self.write_list(source, addresses)
+        load_data.load_csv(source, workers=1, **kwargs)
+
+    def delisted(self):
+        return set(
+            IPRange.objects.filter(delisted__isnull=False).values_list(
+                "address", flat=True
+            )
+        )
+
+
+class DelistTests(ListTestCase):
+    """Ranges are delisted and relisted whatever form the list writes them in."""
+
+    def test_bare_address(self):
+        self.load("enwiki", ["198.51.7.4", "198.51.9.0/24", "203.0.113.0/24"])
+        self.assertTrue(IPRange.objects.filter(address="198.51.7.4/32").exists())
+        self.load("enwiki", ["198.51.9.0/24", "203.0.113.0/24"])
+        self.assertEqual(self.delisted(), {"198.51.7.4/32"})
+        self.load("enwiki", [" 198.51.7.4 ", "198.51.9.0/24", "203.0.113.0/24"])
+        self.assertEqual(self.delisted(), set())
+
+    def test_consolidated(self):
+        self.load("enwiki", ["198.51.8.0/25", "198.51.8.128/25", "198.51.9.0/24"])
+        self.assertEqual(
+            set(IPRange.objects.values_list("address", flat=True)), {"198.51.8.0/23"}
+        )
+        self.load("enwiki", ["198.51.8.0/25"])
+        self.assertEqual(self.delisted(), set())
+        self.load("enwiki", ["198.51.7.0/24"])
+        self.assertEqual(self.delisted(), {"198.51.8.0/23"})
+        self.load("enwiki", ["198.51.7.0/24", "198.51.9.0/24"])
+        self.assertEqual(self.delisted(), set())
+
+    def test_widely_consolidated(self):
+        rows = [f"203.1.{n}.0/24" for n in range(256)]
+        self.load("enwiki", rows)
+        self.assertEqual(
+            list(IPRange.objects.values_list("address", flat=True)), ["203.1.0.0/16"]
+        )
+        self.load("enwiki", rows[:5] + rows[6:])
+        self.assertEqual(self.delisted(), set())
+        self.load("enwiki", ["198.51.7.0/24"])
+        self.assertEqual(self.delisted(), {"203.1.0.0/16"})
+        self.load("enwiki", ["198.51.7.0/24", rows[200]])
+        self.assertEqual(self.delisted(), set())
+
+    def test_full_load(self):
+        self.load("enwiki", ["198.51.7.0/24", "198.51.9.0/24"])
+        self.load("enwiki", ["198.51.9.0/24"], full=True)
+        self.assertEqual(self.delisted(), {"198.51.7.0/24"})
+        self.load("enwiki", ["198.51.7.0/24", "198.51.9.0/24"], full=True)
+        self.assertEqual(self.delisted(), set())
+
+    def test_kept_by_other_list(self):
+        self.load("enwiki", ["198.51.7.0/24", "198.51.9.0/24"])
+        self.load("global", ["198.51.7.0/24"])
+        self.load("enwiki", ["198.51.9.0/24"])
+        self.assertEqual(self.delisted(), set())
+        self.load("global", ["198.51.9.0/24"])
+        self.assertEqual(self.delisted(), {"198.51.7.0/24"})
+
+    def test_only_covering_ranges_read(self):
+        self.load("enwiki", [f"198.51.{n}.0/25" for n in range(0, 200, 2)])
+        removed = snapshot.ListNetworks([(1, ipaddress.ip_network("198.51.10.0/25"))])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(snapshot.mark_delisted(removed), 1)
+        reads = [
+            query["sql"]
+            for query in queries.captured_queries
+            if query["sql"].startswith("SELECT")
+        ]
+        self.assertEqual(len(reads), 1)
+        self.assertIn('"hammer_iprange"."id" IN (', reads[0])
+        self.assertEqual(self.delisted(), {"198.51.10.0/25"})
+
+    def test_networks_file(self):
+        v4, v4_half, v6 = (
+            (key, ipaddress.ip_network(address))
+            for key, address in enumerate(
+                ["198.51.7.0/24", "198.51.7.128/25", "2a00:1450::/32"], 1
+            )
+        )
+        snapshot.ListNetworks([v6, v4_half, v4]).save(self.downloads / "test.nets")
+        loaded = snapshot.ListNetworks.load(self.downloads / "test.nets")
+        self.assertEqual(list(loaded.entries()), [v4, v4_half, v6])
+        self.assertEqual(list(loaded.select({2, 3}).entries()), [v4_half, v6])
+        within = lambda address: loaded.within(
+            *network_bounds(ipaddress.ip_network(address))
+        )
+        self.assertTrue(within("198.51.7.128/25"))
+        self.assertFalse(within("198.51.7.128/26"))
+        self.assertTrue(within("2a00::/16"))
+        self.assertFalse(within("198.51.6.0/24"))
+
+
+class ConsolidateTests(ListTestCase):
+    """Merged ranges keep the history of the rows they replace."""
+
+    def add(self, address, days_ago, delisted=False, extra_asns=()):
+        add_range(address, f"reason {address}")
+        iprange = IPRange.objects.get(address=address)
+        IPRange.objects.filter(id=iprange.id).update(
+            date_added=timezone.now() - timedelta(days=days_ago),
+            delisted=timezone.now() if delisted else None,
+        )
+        iprange.extra_asns.add(
+            *(ASN.objects.get_or_create(asn=number)[0] for number in extra_asns)
+        )
+        return iprange.id
+
+    def test_merge_keeps_history(self):
+        self.add("198.51.8.128/25", 1, delisted=True, extra_asns=[64502])
+        oldest = self.add("198.51.8.0/25", 5, delisted=True, extra_asns=[64503])
+        self.add("198.51.10.0/25", 2, delisted=True)
+        self.add("198.51.10.128/25", 3)
+        stats = consolidate_ranges()
+        self.assertEqual((stats["before"], stats["after"]), (4, 2))
+        merged = IPRange.objects.get(address="198.51.8.0/24")
+        self.assertEqual(merged.id, oldest)
+        self.assertEqual(merged.range_start, int(ipaddress.ip_address("198.51.8.0")))
+        self.assertLess(merged.date_added, timezone.now() - timedelta(days=4))
+        self.assertIsNotNone(merged.delisted)
+        self.assertEqual(
+            set(merged.extra_asns.values_list("asn", flat=True)), {64502, 64503}
+        )
+        self.assertIn("reason 198.51.8.128/25", merged.check_reason)
+        self.assertIsNone(IPRange.objects.get(address="198.51.10.0/24").delisted)
+        self.assertEqual(IPRange.objects.containing("198.51.8.200").get().id, oldest)
+
+    def test_bulk_delete(self):
+        ids = [self.add(f"198.51.12.{n}/26", 4 - n // 64) for n in range(0, 256, 64)]
+        audit = BanAudit.objects.create(
+            action=BanAudit.Action.BAN_RANGE, iprange_id=ids[1]
+        )
+        range_index.rebuild()
+        deleted = []
+
+        def receiver(sender, instance, **kwargs):
+            deleted.append(instance.id)
+
+        post_delete.connect(receiver, sender=IPRange)
+        try:
+            consolidate_ranges()
+        finally:
+            post_delete.disconnect(receiver, sender=IPRange)
+        self.assertEqual(deleted, [])
+        self.assertEqual(range_index.containing("198.51.12.100"), [ids[0]])
+        self.assertFalse(
+            IPRange.extra_asns.through.objects.filter(iprange_id__in=ids[1:]).exists()
+        )
+        audit.refresh_from_db()
+        self.assertIsNone(audit.iprange_id)
+        self.assertEqual(counters.totals(), {"new": 1, "pending": 0, "blocked": 0})
+
+    def test_add_range_skips_covered(self):
+        self.assertEqual(add_range("198.51.8.0/24", "test"), 1)
+        self.assertEqual(add_range("198.51.8.64/26", "test"), 0)
+        self.assertEqual(IPRange.objects.count(), 1)
+
+
+class ParallelParseTests(TestCase):
+    """Sharded parsing finds the same rows as reading the list in one pass."""
+
+    def setUp(self):
+        scratch = tempfile.TemporaryDirectory()
+        self.addCleanup(scratch.cleanup)
+        self.path = Path(scratch.name) / "global_list.csv"
+        self.fingerprint = Path(scratch.name) / "global_list.fp"
+        rows = [
+            [f"185.10.{n}.0/24" if n % 3 else f"185.10.{n}.1", f"proxy, {n}"]
+            for n in range(120)
+        ]
+        rows += [["2a00:1450::/32", "v6"], ["10.0.0.0/8", "private"], ["bad", "x"]]
+        with open(self.path, "w", newline="") as out:
+            writer = csv.writer(out)
+            writer.writerow(["address", "reason"])
+            writer.writerows(rows)
+            out.write("short row\n")
+        delta = snapshot.ListDelta()
+        list(delta.filter(rows[::2]))
+        delta.current().save(self.fingerprint)
+
+    def serial(self, previous):
+        delta = snapshot.ListDelta(previous)
+        with open(self.path, newline="") as in_file:
+            reader = csv.reader(in_file)
+            next(reader)
+            pairs = list(ingest.parse_rows(delta.filter(reader)))
+        return pairs, list(delta.keys), delta.added
+
+    def parallel(self, previous, workers):
+        delta = snapshot.ListDelta(previous)
+        pairs = list(
+            parallel_parse.parse_csv(
+                self.path,
+                delta,
+                None if previous is None else self.fingerprint,
+                workers,
+                shard_size=512,
+            )
+        )
+        return pairs, list(delta.keys), delta.added
+
+    def test_shard_offsets(self):
+        data = self.path.read_bytes()
+        offsets = parallel_parse.shard_offsets(self.path, 512)
+        self.assertGreater(len(offsets), 2)
+        self.assertEqual(offsets[0][0], data.index(b"\n") + 1)
+        self.assertEqual(offsets[-1][1], len(data))
+        for (_, end), (start, _) in zip(offsets, offsets[1:]):
+            self.assertEqual(end, start)
+            self.assertEqual(data[end - 1 : end], b"\n")
+
+    def test_matches_serial(self):
+        previous = snapshot.Fingerprint.load(self.fingerprint)
+        for fingerprint in (None, previous):
+            expected = self.serial(fingerprint)
+            self.assertEqual(self.parallel(fingerprint, 1), expected)
+        self.assertEqual(len(expected[0]), 60)
+        self.assertEqual(self.parallel(previous, 2), expected)
+
+    def test_daemon_parses_in_process(self):
+        daemon = mock.Mock(daemon=True)
+        with mock.patch.object(
+            parallel_parse, "current_process", return_value=daemon
+        ), mock.patch.object(parallel_parse, "ProcessPoolExecutor") as pool:
+            self.assertEqual(self.parallel(None, 4), self.serial(None))
+        pool.assert_not_called()
+
+
+class StagingTests(TestCase):
+    """COPY loads store the same rows as ordinary inserts."""
+
+    asndb = ASNLookupService(
+        database=pyasn(None, ipasn_string="185.10.0.0/16\t64500\n2a00::/16\t64502")
+    )
+    rows = [
+        ["185.10.1.0/24", "open proxy"],
+        ["185.10.1.0/24", "duplicate"],
+        ["185.10.2.7", "tab\tand back\\slash"],
+        ["45.0.0.0/24", "no ASN"],
+        ["2a00:1450::/32", "open proxy"],
+        ["23.1.2.0/24", "already stored"],
+    ]
+
+    def setUp(self):
+        IPRange.objects.create(
+            address="23.1.2.0/24",
+            **range_fields(ipaddress.ip_network("23.1.2.0/24")),
+            check_reason="stored first",
+        )
+        asn_resolver.invalidate()
+        self.addCleanup(asn_resolver.invalidate)
+
+    def load(self, copy):
+        """Load rows, returning what was stored before rolling it back."""
+        with override_settings(HAMMER_COPY_LOADS=copy), mock.patch.object(
+            staging, "copy_ranges", wraps=staging.copy_ranges
+        ) as copy_ranges, transaction.atomic():
+            added = ingest.load_rows(self.rows, self.asndb, consolidate=False)
+            stored = list(
+                IPRange.objects.order_by("address").values_list(
+                    "address", *KEY_FIELDS, "asn__asn", "check_reason"
+                )
+            )
+            totals = counters.totals()
+            transaction.set_rollback(True)
+        asn_resolver.invalidate()
+        self.assertEqual(copy_ranges.called, copy)
+        return added, stored, totals
+
+    def test_off_by_default(self):
+        with mock.patch.object(staging.connection, "vendor", "postgresql"):
+            self.assertFalse(staging.copy_supported())
+            with override_settings(HAMMER_COPY_LOADS=True):
+                self.assertTrue(staging.copy_supported())
+
+    @skipUnless(connection.vendor == "postgresql", "COPY needs PostgreSQL")
+    def test_matches_inserts(self):
+        added, stored, totals = self.load(copy=False)
+        self.assertEqual(added, 4)
+        self.assertEqual(len(stored), 5)
+        self.assertEqual(self.load(copy=True), (added, stored, totals))
+
+
+class RangeIndexTests(TestCase):
+    """Batches merged into the index give the same answers as single edits."""
+
+    @staticmethod
+    def row(range_id, address):
+        return (range_id, *range_fields(ipaddress.ip_network(address)).values())
+
+    def test_batches(self):
+        batched, single = RangeIndex(), RangeIndex()
+        for index in (batched, single):
+            index.rebuild()
+        rows = [self.row(n, f"198.51.{n}.0/24") for n in range(1, 40)]
+        rows += [self.row(100 + n, f"2001:db8:{n:x}::/48") for n in range(20)]
+        rows.append(self.row(200, "198.51.0.0/16"))
+        batched.add_many(rows)
+        for row in rows:
+            single.add_many([row])
+        # Move some ranges and leave others unchanged, then drop a few
+        moves = [self.row(n, f"203.0.{n}.0/25") for n in range(1, 20)] + rows[30:40]
+        batched.add_many(moves)
+        for row in moves:
+            single.add_many([row])
+        batched.remove_many(range(100, 112))
+        single.remove_many(range(100, 104))
+        single.remove_many(range(104, 112))
+        self.assertEqual(len(batched), len(single))
+        self.assertEqual(batched._starts, single._starts)
+        self.assertEqual(batched._ids, single._ids)
+        for starts in batched._starts.values():
+            self.assertEqual(starts, sorted(starts))
+        self.assertEqual(batched.containing("198.51.25.1"), [25, 200])
+        self.assertEqual(batched.containing("198.51.5.1"), [200])
+        self.assertEqual(
+            sorted(batched.overlapping("203.0.0.0/16")), list(range(1, 20))
+        )
+        self.assertEqual(batched.containing("2001:db8:b::1"), [])
+        self.assertEqual(batched.containing("2001:db8:13::1"), [119])
+
+    def test_changes_from_other_processes(self):
+        def create(address):
+            return IPRange.objects.create(
+                address=address,
+                **range_fields(ipaddress.ip_network(address)),
+                check_reason="test",
+            )
+
+        keeper, merged = create("185.10.0.0/24"), create("185.10.1.0/24")
+        index = RangeIndex()
+        index.rebuild()
+        # Another process merges the two rows and adds one; its writes send
+        # no signals to this index
+        IPRange.objects.filter(id=keeper.id).update(
+            address="185.10.0.0/23",
+            **range_fields(ipaddress.ip_network("185.10.0.0/23")),
+        )
+        IPRange.objects.filter(id=merged.id)._raw_delete(IPRange.objects.db)
+        counters.adjust({(None, counters.State.NEW): -1})
+        new = create("45.0.0.0/24")
+        index.refresh()
+        self.assertEqual(index.containing("185.10.1.1"), [merged.id])
+        index.refresh(force=True)
+        self.assertEqual(index.containing("185.10.1.1"), [keeper.id])
+        self.assertEqual(index.containing("45.0.0.1"), [new.id])
+        self.assertEqual(len(index), 2)
+
+        # New rows alone are added without a rebuild
+        other = create("45.0.1.0/24")
+        with mock.patch.object(index, "rebuild") as rebuild:
+            index.refresh(force=True)
+        rebuild.assert_not_called()
+        self.assertEqual(index.containing("45.0.1.1"), [other.id])
+
+
+class DatabaseProfileTests(TestCase):
+    """New SQLite connections get the tuned PRAGMAs, minus overridden ones."""
+
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f"PRAGMA {name}")
+            return cursor.fetchone()[0]
+
+    def test_sqlite_pragmas(self):
+        if connection.vendor != "sqlite":
+            self.skipTest("SQLite only")
+        self.assertEqual(self.pragma("synchronous"), 1)  # NORMAL
+        self.assertEqual(self.pragma("busy_timeout"), 5000)
+        with self.settings(HAMMER_SQLITE_PRAGMAS={"mmap_size": None}):
+            self.assertNotIn("mmap_size", db_profile.sqlite_pragmas())
+            self.assertEqual(db_profile.sqlite_pragmas()["journal_mode"], "WAL")
+
+
+class SchedulerTests(TransactionTestCase):
+    """Runs start in dependency, group and priority order, within the limits."""
+
+    def setUp(self):
+        self.events = []
+        self.scheduler = None
+
+    def tearDown(self):
+        if self.scheduler is not None:
+            self.scheduler.stop()
+
+    def step(self, name, gate=None, fail=False):
+        """Return a target recording when it starts and ends."""
+
+        def target():
+            self.events.append(("start", name))
+            if gate is not None:
+                gate()
+            self.events.append(("end", name))
+            if fail:
+                raise RuntimeError(f"{name} failed")
+
+        return target
+
+    def make_scheduler(self, tools, **limits):
+        self.scheduler = Scheduler(JobManager(), tools, limits)
+        return self.scheduler
+
+    def assertFinished(self, runs):
+        self.assertTrue(self.scheduler.wait(runs, timeout=10))
+
+    def test_types_have_own_locks(self):
+        manager = JobManager()
+        started = threading.Barrier(2, timeout=5)
+        jobs = [
+            manager.make_and_register(name, started.wait) for name in ("one", "two")
+        ]
+        for job in jobs:
+            job.join()
+        self.assertFalse(any(job.failed for job in jobs))
+        self.assertIsNot(manager.locks["one"], manager.locks["two"])
+
+    def test_downloads_overlap_and_loads_serialise(self):
+        downloading = threading.Barrier(2, timeout=5)
+        tools = {
+            "down1": Tool(self.step("down1", downloading.wait), "io"),
+            "down2": Tool(self.step("down2", downloading.wait), "io"),
+            "load1": Tool(
+                self.step("load1", lambda: time.sleep(0.05)),
+                depends=("down1",),
+                group="load",
+            ),
+            "load2": Tool(
+                self.step("load2", lambda: time.sleep(0.05)),
+                depends=("down2",),
+                group="load",
+            ),
+        }
+        scheduler = self.make_scheduler(tools, cpu=2)
+        runs = [
+            scheduler.submit(name, with_dependencies=True)
+            for name in ("load1", "load2")
+        ]
+        self.assertFinished(runs)
+        self.assertEqual([run.state for run in runs], [Run.DONE, Run.DONE])
+        order = self.events.index
+        for n in (1, 2):
+            self.assertLess(order(("end", f"down{n}")), order(("start", f"load{n}")))
+        loads = [event for event in self.events if event[1].startswith("load")]
+        self.assertEqual([kind for kind, _ in loads], ["start", "end"] * 2)
+
+    def test_priorities(self):
+        release = threading.Event()
+        tools = {
+            "busy": Tool(self.step("busy", release.wait)),
+            "low": Tool(self.step("low"), priority=-1),
+            "high": Tool(self.step("high"), priority=1),
+        }
+        scheduler = self.make_scheduler(tools, cpu=1)
+        busy = scheduler.submit("busy")
+        while ("start", "busy") not in self.events:
+            time.sleep(0.01)
+        runs = [busy] + [scheduler.submit(name) for name in ("low", "high")]
+        self.assertEqual(
+            [run.name for run in scheduler.queued()], ["busy", "high", "low"]
+        )
+        with self.assertRaises(ValueError):
+            scheduler.submit("busy")
+        self.assertIs(scheduler.submit("busy", strict=False), busy)
+        release.set()
+        self.assertFinished(runs)
+        self.assertEqual(
+            [name for kind, name in self.events if kind == "start"],
+            ["busy", "high", "low"],
+        )
+
+    def test_runs_fit_worker_pool(self):
+        release = threading.Event()
+        tools = {
+            "down1": Tool(self.step("down1", release.wait), "io"),
+            "down2": Tool(self.step("down2"), "io"),
+            "load": Tool(self.step("load")),
+        }
+        scheduler = self.make_scheduler(tools)
+        with mock.patch.object(scheduler.manager, "capacity", return_value=1):
+            runs = [scheduler.submit(name) for name in tools]
+            time.sleep(0.2)
+            self.assertEqual(self.events, [("start", "down1")])
+            release.set()
+            self.assertFinished(runs)
+        self.assertEqual(
+            self.events,
+            [(kind, name) for name in tools for kind in ("start", "end")],
+        )
+
+    def test_conflicts(self):
+        release = threading.Event()
+        tools = {
+            "down": Tool(self.step("down", release.wait), "io"),
+            "refresh": Tool(self.step("refresh"), conflicts=("down",)),
+            "other": Tool(self.step("other"), "io"),
+        }
+        scheduler = self.make_scheduler(tools)
+        runs = [scheduler.submit(name) for name in tools]
+        self.assertTrue(scheduler.wait(runs[2:], timeout=10))
+        self.assertNotIn(("start", "refresh"), self.events)
+        release.set()
+        self.assertFinished(runs)
+        order = self.events.index
+        self.assertLess(order(("end", "down")), order(("start", "refresh")))
+
+    @override_settings(HAMMER_JOB_LIMITS={"io": 3})
+    def test_pool_size(self):
+        self.assertIsNone(JobManager().capacity())
+        self.assertEqual(JobManager(executor="process").capacity(), 4)
+        with override_settings(HAMMER_JOB_PROCESSES=2):
+            self.assertEqual(JobManager(executor="process").capacity(), 2)
+
+    def test_failed_dependency_skips(self):
+        tools = {
+            "down": Tool(self.step("down", fail=True), "io"),
+            "load": Tool(self.step("load"), depends=("down",)),
+            "later": Tool(self.step("later"), depends=("load",)),
+        }
+        scheduler = self.make_scheduler(tools)
+        with mock.patch("threading.excepthook"):
+            run = scheduler.submit("later", with_dependencies=True)
+            self.assertFinished([run])
+        self.assertEqual(run.state, Run.SKIPPED)
+        self.assertNotIn(("start", "load"), self.events)
+        self.assertEqual(
+            list(JobRecord.objects.order_by("id").values_list("job_type", "status")),
+            [
+                ("down", JobRecord.Status.FAILED),
+                ("load", JobRecord.Status.FAILED),
+                ("later", JobRecord.Status.FAILED),
+            ],
+        )
+
+    def test_schedule(self):
+        scheduler = self.make_scheduler({"tick": Tool(self.step("tick"))})
+        scheduler.set_schedule({"tick": 0.05})
+        scheduler.start()
+        deadline = time.monotonic() + 10
+        while self.events.count(("end", "tick")) < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertGreaterEqual(self.events.count(("end", "tick")), 2)
+        with self.assertRaises(ValueError):
+            scheduler.set_schedule({"unknown": 1})
+
+
+def count_rows(rows):
+    """Job target reporting rows as processed."""
+    report_progress(rows=rows, stage="counted")
+
+
+def fail_job(message):
+    """Job target raising ValueError(message)."""
+    raise ValueError(message)
+
+
+class PicklingPool(ThreadPoolExecutor):
+    """Runs submitted calls on a thread after a pickling round trip.
+
+    Stands in for the worker processes, which take seconds to spawn, while
+    still catching targets a real pool could not send.
+    """
+
+    def submit(self, func, *args):
+        return super().submit(*pickle.loads(pickle.dumps((func, *args))))
+
+
+class JobRecorderTests(QueryBudgetTestCase):
+    """Job progress is saved to JobRecords and reported by the status view."""
+
+    def saved(self, recorder):
+        return JobRecord.objects.get(id=recorder.record.id)
+
+    def test_recorder(self):
+        recorder = JobRecorder("load", save_interval=60)
+        self.assertEqual(self.saved(recorder).status, JobRecord.Status.QUEUED)
+        recorder.start()
+        record = self.saved(recorder)
+        self.assertEqual(record.status, JobRecord.Status.RUNNING)
+        self.assertIsNotNone(record.started)
+        self.assertGreater(record.peak_memory, 0)
+        recorder.progress({"rows": 10, "stage": "parse"})
+        record = self.saved(recorder)
+        self.assertEqual((record.rows_processed, record.progress), (0, {}))
+        recorder.save_interval = 0
+        recorder.progress({"rows": 20})
+        record = self.saved(recorder)
+        self.assertEqual(
+            (record.rows_processed, record.progress), (20, {"stage": "parse"})
+        )
+        continued = JobRecorder(record_id=record.id)
+        continued.finish(RuntimeError("load failed"))
+        record = self.saved(continued)
+        self.assertEqual(record.status, JobRecord.Status.FAILED)
+        self.assertIn("RuntimeError: load failed", record.error)
+        done = JobRecorder("recount")
+        done.finish()
+        self.assertEqual(self.saved(done).status, JobRecord.Status.DONE)
+
+    def test_status_view(self):
+        recorder = JobRecorder("load", save_interval=0)
+        recorder.start()
+        recorder.progress({"rows": 5, "stage": "parse"})
+        JobRecorder("recount")
+        with self.assertNumQueries(3):
+            jobs = self.client.get("/jobs/status").json()["jobs"]
+        self.assertEqual([job["type"] for job in jobs], ["recount", "load"])
+        self.assertEqual(jobs[0]["status"], "Queued")
+        self.assertIsNone(jobs[0]["duration"])
+        self.assertEqual(
+            {key: jobs[1][key] for key in ("id", "status", "rows", "progress")},
+            {
+                "id": recorder.record.id,
+                "status": "Running",
+                "rows": 5,
+                "progress": {"stage": "parse"},
+            },
+        )
+        self.client.logout()
+        self.assertEqual(self.client.get("/jobs/status").status_code, 403)
+
+
+class ProcessJobTests(TransactionTestCase):
+    """ProcessJobs record their outcome from the worker."""
+
+    def run_job(self, target, *args, pool=None):
+        manager = JobManager(executor="process")
+        with mock.patch(
+            "hammer.utils.jobs.jobs.process_pool",
+            return_value=pool or PicklingPool(1),
+        ):
+            job = manager.make_and_register("job", target, args)
+            job.join(timeout=10)
+        self.assertFalse(job.is_alive())
+        return job, JobRecord.objects.get(id=job.recorder.record.id)
+
+    def test_done(self):
+        job, record = self.run_job(count_rows, 12)
+        self.assertFalse(job.failed)
+        self.assertEqual(record.status, JobRecord.Status.DONE)
+        self.assertEqual(record.rows_processed, 12)
+        self.assertEqual(record.progress, {"stage": "counted"})
+        self.assertIsNotNone(record.finished)
+        self.assertEqual(record.error, "")
+
+    def test_failed(self):
+        with mock.patch("threading.excepthook"):
+            job, record = self.run_job(fail_job, "bad row")
+        self.assertTrue(job.failed)
+        self.assertEqual(record.status, JobRecord.Status.FAILED)
+        self.assertIn("ValueError: bad row", record.error)
+
+    def test_worker_process(self):
+        # Workers started under tests write to the test database
+        try:
+            job, record = self.run_job(count_rows, 3, pool=process_pool())
+        finally:
+            shutdown_pool()
+        self.assertEqual(record.status, JobRecord.Status.DONE)
+        self.assertEqual(record.rows_processed, 3)
+
+    def test_worker_died(self):
+        pool = mock.Mock()
+        pool.submit.return_value.result.side_effect = BrokenProcessPool("worker died")
+        with mock.patch("threading.excepthook"):
+            job, record = self.run_job(count_rows, 1, pool=pool)
+        self.assertTrue(job.failed)
+        self.assertEqual(record.status, JobRecord.Status.FAILED)
+        self.assertIn("BrokenProcessPool: worker died", record.error)
@@ -0,0 +1,106 @@
+"""In-memory cache mapping AS numbers to ASN row ids."""
+
+from collections import OrderedDict
+from threading import Lock
+from django.db.models.signals import post_delete, post_save
+from hammer.models import ASN
+
+
+class ASNResolver:
+    """Resolves AS numbers to ASN ids with a bounded LRU cache."""
+
+    def __init__(self, max_size=100000):
+        """Create an empty resolver holding at most max_size AS numbers."""
+        self.max_size = max_size
+        self._ids = OrderedDict()
+        # ASN id -> AS number, so an id can be invalidated without a scan
+        self._numbers = {}
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._ids)
+
+    def _store(self, mapping):
+        for number, asn_id in mapping.items():
+            self._forget(asn_id=asn_id)
+            self._forget(number=number)
+            self._ids[number] = asn_id
+            self._numbers[asn_id] = number
+        while len(self._ids) > self.max_size:
+            number, asn_id = self._ids.popitem(last=False)
+            del self._numbers[asn_id]
+
+    def _forget(self, number=None, asn_id=None):
+        if number is None:
+            number = self._numbers.get(asn_id)
+        asn_id = self._ids.pop(number, None)
+        if asn_id is not None:
+            del self._numbers[asn_id]
+
+    def preload(self, numbers):
+        """Cache the ids of the known AS numbers among numbers, in one query.
+
+        Loading a batch's numbers before its write transaction keeps the
+        query out of it; unknown numbers are left to resolve_many to create.
+        """
+        self.resolve_many(numbers, create=False)
+
+    def resolve_many(self, numbers, create=True):
+        """Map each AS number to an ASN id.
+
+        Missing ASNs are fetched with one query and, if create is True,
+        created in bulk. Numbers that remain unknown are left out of the result.
+        """
+        numbers = {int(number) for number in numbers}
+        result = {}
+        with self._lock:
+            for number in numbers:
+                if number in self._ids:
+                    self._ids.move_to_end(number)
+                    result[number] = self._ids[number]
+        missing = numbers - result.keys()
+        if missing:
+            found = dict(ASN.objects.filter(asn__in=missing).values_list("asn", "id"))
+            missing -= found.keys()
+            if missing and create:
+                ASN.objects.bulk_create(
+                    (ASN(asn=number) for number in missing), ignore_conflicts=True
+                )
+                found.update(
+                    ASN.objects.filter(asn__in=missing).values_list("asn", "id")
+                )
+            with self._lock:
+                self._store(found)
+            result.update(found)
+        return result
+
+    def resolve(self, number, create=True):
+        """Return the ASN id for number, or None if unknown and create is False."""
+        return self.resolve_many([number], create).get(int(number))
+
+    def invalidate(self, number=None, asn_id=None):
+        """Forget an AS number and/or ASN id, or the whole cache if neither is given."""
+        with self._lock:
+            if number is None and asn_id is None:
+                self._ids.clear()
+                self._numbers.clear()
+                return
+            if number is not None:
+                self._forget(number=int(number))
+            if asn_id is not None:
+                self._forget(asn_id=asn_id)
+
+
+asn_resolver = ASNResolver()
+
+
+def _invalidate_asn(instance, created=False, **_kwargs):
+    if created:
+        asn_resolver.invalidate(instance.asn)
+    else:
+        # The AS number itself may have been edited, so drop the old mapping too
+        asn_resolver.invalidate(instance.asn, instance.pk)
+
+
+post_save.connect(_invalidate_asn, sender=ASN, dispatch_uid="asn_resolver_save")
+post_delete.connect(_invalidate_asn, sender=ASN, dispatch_uid="asn_resolver_delete")
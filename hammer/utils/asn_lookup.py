@@ -0,0 +1,148 @@
+"""Process-wide handle on the pyasn database."""
+
+import ipaddress
+from array import array
+from bisect import bisect_left, bisect_right
+from pathlib import Path
+from threading import Lock
+from pyasn import pyasn
+
+DOWNLOADS_DIR = Path(__file__).resolve().parent / "downloads"
+
+
+class PrefixTable:
+    """Announced prefixes as sorted integer arrays, one set per IP version.
+
+    IPv4 bounds are kept in array("Q") columns; IPv6 bounds exceed 64 bits
+    and are kept in lists. Both support bisection in C.
+    """
+
+    def __init__(self, database):
+        rows = {4: [], 6: []}
+        for node in database:
+            net = ipaddress.ip_network(node.prefix)
+            rows[net.version].append(
+                (int(net.network_address), int(net.broadcast_address), node.asn)
+            )
+        self._radix = database.radix
+        self._columns = {}
+        for version, items in rows.items():
+            items.sort()
+            bounds = (lambda values: array("Q", values)) if version == 4 else list
+            self._columns[version] = (
+                bounds(start for start, _, _ in items),
+                bounds(end for _, end, _ in items),
+                array("L", (asn for _, _, asn in items)),
+            )
+
+    def __len__(self):
+        return sum(len(starts) for starts, _, _ in self._columns.values())
+
+    def covered_asns(self, networks):
+        """Return the set of origin ASNs announcing any part of each network.
+
+        This is the ASN of the longest prefix holding the whole network, plus
+        the ASN of every more specific prefix inside it. Networks are swept
+        in sorted order so each bisection starts where the previous one ended.
+        """
+        networks = list(networks)
+        result = [set() for _ in networks]
+        for version, bounds in self._sorted_bounds(networks).items():
+            starts, ends, asns = self._columns[version]
+            low = 0
+            for start, end, pos in bounds:
+                net = networks[pos]
+                node = self._radix.search_best(str(net.network_address), net.prefixlen)
+                if node is not None:
+                    result[pos].add(node.asn)
+                low = bisect_left(starts, start, low)
+                high = bisect_right(starts, end, low)
+                result[pos].update(asns[i] for i in range(low, high) if ends[i] <= end)
+        return result
+
+    @staticmethod
+    def _sorted_bounds(networks):
+        """Group the bounds and positions of networks by IP version, in order."""
+        groups = {4: [], 6: []}
+        for pos, net in enumerate(networks):
+            start = int(net.network_address)
+            groups[net.version].append((start, start + net.num_addresses - 1, pos))
+        for bounds in groups.values():
+            bounds.sort()
+        return groups
+
+
+class ASNLookupService:
+    """Loads asn.dat once per process and reloads it when the file changes."""
+
+    def __init__(self, asn_file=DOWNLOADS_DIR / "asn.dat", database=None):
+        """Serve lookups from asn_file, or from an already loaded pyasn database."""
+        self.asn_file = None if database is not None else Path(asn_file)
+        self._db = database
+        self._table = None
+        self._stamp = None if database is None else "fixed"
+        self._lock = Lock()
+
+    def _file_stamp(self):
+        if self.asn_file is None:
+            return self._stamp
+        try:
+            stat = self.asn_file.stat()
+        except FileNotFoundError:
+            return None
+        return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+    @property
+    def available(self):
+        """True if an ASN database exists on disk."""
+        return self._file_stamp() is not None
+
+    def database(self):
+        """Return the current pyasn database, loading it if the file changed.
+
+        A replacement is parsed before it is swapped in, so concurrent lookups
+        keep using the previous database until the new one is ready.
+        """
+        stamp = self._file_stamp()
+        if stamp is None:
+            raise FileNotFoundError(f"{self.asn_file} has not been generated yet")
+        # Only the very first load makes other threads wait
+        # pylint: disable-next=consider-using-with
+        if stamp != self._stamp and self._lock.acquire(blocking=self._db is None):
+            try:
+                if stamp != self._stamp:
+                    self._db = pyasn(str(self.asn_file))
+                    self._table = None
+                    self._stamp = stamp
+            finally:
+                self._lock.release()
+        return self._db
+
+    def reload(self):
+        """Force the database to be read again on next use."""
+        if self.asn_file is not None:
+            self._stamp = None
+
+    def lookup(self, ip):
+        """Return the origin AS number announcing ip, or None."""
+        return self.database().lookup(str(ip))[0]
+
+    def lookup_many(self, ips):
+        """Return the origin AS number of each ip, in order."""
+        lookup = self.database().lookup
+        return [lookup(str(ip))[0] for ip in ips]
+
+    def prefix_table(self):
+        """Return the PrefixTable of the current database, building it once."""
+        database = self.database()
+        table = self._table
+        if table is None or table[0] is not database:
+            table = self._table = (database, PrefixTable(database))
+        return table[1]
+
+    def covered_asns_many(self, networks):
+        """Return the set of origin ASNs announcing any part of each network."""
+        return self.prefix_table().covered_asns(networks)
+
+
+asn_service = ASNLookupService()
@@ -0,0 +1,79 @@
+"""Scheduling ranges and whole ASNs to be blocked, with an audit trail."""
+
+from django.db import transaction
+from django.utils import timezone
+from hammer.models import ASN, BanAudit, IPRange
+from hammer.utils import counters
+from hammer.utils.jobs import current_record, report_progress
+
+# Small enough that each transaction holds the SQLite write lock only briefly
+BATCH_SIZE = 500
+
+
+def ban_range(range_id, user_id=None):
+    """Schedule one range to be blocked, returning False if it already was."""
+    with transaction.atomic():
+        iprange = IPRange.objects.select_for_update().get(id=range_id)
+        if iprange.scheduled or iprange.blocked:
+            return False
+        iprange.scheduled = True
+        iprange.save()
+        BanAudit.objects.create(
+            action=BanAudit.Action.BAN_RANGE,
+            user_id=user_id,
+            iprange=iprange,
+            asn_id=iprange.asn_id,
+            finished=timezone.now(),
+            ranges_scheduled=1,
+        )
+    return True
+
+
+def ban_asns(asn_ids, user_id=None, batch_size=BATCH_SIZE):
+    """Mark each ASN as banned and schedule all of its new ranges to be blocked.
+
+    Ranges are updated in batches of batch_size, each in its own
+    transaction, so other writers are never locked out for long. One
+    BanAudit row is recorded per ASN. Returns the number of scheduled ranges.
+    """
+    record = current_record()
+    total = 0
+    for done, asn_id in enumerate(asn_ids):
+        audit = BanAudit.objects.create(
+            action=BanAudit.Action.BAN_ASN,
+            user_id=user_id,
+            asn_id=asn_id,
+            job=record,
+        )
+        ASN.objects.filter(id=asn_id).update(
+            asn_status=ASN.Status.BANNED, last_updated=timezone.now()
+        )
+        last_id = 0
+        while True:
+            with transaction.atomic():
+                ids = list(
+                    IPRange.objects.filter(
+                        asn_id=asn_id, blocked=False, scheduled=False, id__gt=last_id
+                    )
+                    .order_by("id")
+                    .values_list("id", flat=True)[:batch_size]
+                )
+                if not ids:
+                    break
+                moved = IPRange.objects.filter(
+                    id__in=ids, blocked=False, scheduled=False
+                ).update(scheduled=True, last_updated=timezone.now())
+                counters.adjust(
+                    {
+                        (asn_id, counters.State.NEW): -moved,
+                        (asn_id, counters.State.PENDING): moved,
+                    }
+                )
+            last_id = ids[-1]
+            audit.ranges_scheduled += moved
+            total += moved
+            report_progress(rows=total, asns=done, asns_total=len(asn_ids))
+        audit.finished = timezone.now()
+        audit.save(update_fields=["ranges_scheduled", "finished"])
+    report_progress(rows=total, asns=len(asn_ids), asns_total=len(asn_ids))
+    return total
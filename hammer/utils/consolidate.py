@@ -0,0 +1,190 @@
+"""Merging of nested and adjacent IP ranges."""
+
+import ipaddress
+import time
+from collections import Counter, defaultdict
+from django.db import transaction
+from hammer.models import BanAudit, IPRange, range_fields
+from hammer.utils import counters
+from hammer.utils.lookup_index import lookup_index
+from hammer.utils.range_index import BITS, range_index
+
+BATCH_SIZE = 500
+
+
+def merge_reasons(reasons):
+    """Join distinct check reasons, keeping their original order."""
+    seen = {}
+    for reason in reasons:
+        for line in reason.splitlines():
+            if line:
+                seen.setdefault(line, None)
+    return "\n".join(seen)
+
+
+def collapse_sorted(items, bits):
+    """Collapse (start, prefixlen, payload) networks of one IP version.
+
+    Items must be sorted by (start, prefixlen). Yields (start, prefixlen,
+    payloads) for each collapsed network, in order, as soon as no later item
+    can merge into it, so arbitrarily long inputs use bounded memory.
+    """
+    stack = []
+    for start, prefixlen, payload in items:
+        if stack:
+            top_start, top_len, payloads = stack[-1]
+            top_end = top_start + (1 << (bits - top_len)) - 1
+            if start <= top_end:
+                payloads.append(payload)  # nested in the previous network
+                continue
+            if start != top_end + 1:
+                yield from map(tuple, stack)
+                stack.clear()
+        stack.append([start, prefixlen, [payload]])
+        # Merge sibling networks into their supernet while possible
+        while len(stack) > 1:
+            low, high = stack[-2], stack[-1]
+            size = 1 << (bits - low[1])
+            if low[1] != high[1] or low[1] == 0 or low[0] % (size << 1):
+                break
+            low[1] -= 1
+            low[2].extend(high[2])
+            stack.pop()
+    yield from map(tuple, stack)
+
+
+def collapse_entries(entries):
+    """Collapse (network, payload) pairs like ipaddress.collapse_addresses.
+
+    Returns a list of (network, payloads) pairs where payloads lists the
+    payload of every input network merged into that network.
+    """
+    by_version = defaultdict(list)
+    for net, payload in entries:
+        by_version[net.version].append(
+            (int(net.network_address), net.prefixlen, payload)
+        )
+    result = []
+    for version, items in by_version.items():
+        items.sort(key=lambda item: item[:2])
+        network = ipaddress.IPv4Network if version == 4 else ipaddress.IPv6Network
+        result.extend(
+            (network((start, prefixlen)), payloads)
+            for start, prefixlen, payloads in collapse_sorted(items, BITS[version])
+        )
+    return result
+
+
+def collapse_rows(rows):
+    """Collapse (network, check_reason, asn) rows that share an ASN."""
+    by_asn = defaultdict(list)
+    for net, reason, asn in rows:
+        by_asn[asn].append((net, reason))
+    return [
+        (net, merge_reasons(reasons), asn)
+        for asn, pairs in by_asn.items()
+        for net, reasons in collapse_entries(pairs)
+    ]
+
+
+def _merge_group(supernet, members):
+    """Widen one member row to supernet, leaving the others to be deleted.
+
+    The row already at the merged address, or else the oldest member, is
+    widened and kept, so it keeps its id and the earliest date_added. It
+    gains the check reasons and extra ASNs of every member, and stays
+    delisted only if all of them were. Returns the other members, or an
+    empty list if another row already occupies the merged address.
+    """
+    address = supernet.compressed
+    keeper = next((row for row in members if row.address == address), None)
+    if keeper is None:
+        if IPRange.objects.filter(address=address).exists():
+            return []
+        keeper = min(members, key=lambda row: (row.date_added, row.id))
+    others = [row for row in members if row is not keeper]
+    through = IPRange.extra_asns.through
+    extra_asn_ids = set(
+        through.objects.filter(iprange_id__in=[row.id for row in others]).values_list(
+            "asn_id", flat=True
+        )
+    ) - {keeper.asn_id}
+    delisted = [row.delisted for row in members]
+    keeper.address = address
+    for field, value in range_fields(supernet).items():
+        setattr(keeper, field, value)
+    keeper.check_reason = merge_reasons(row.check_reason for row in members)
+    keeper.date_added = min(row.date_added for row in members)
+    keeper.delisted = None if None in delisted else max(delisted)
+    keeper.save()
+    through.objects.bulk_create(
+        [through(iprange_id=keeper.id, asn_id=asn_id) for asn_id in extra_asn_ids],
+        ignore_conflicts=True,
+    )
+    return others
+
+
+def _raw_delete(queryset):
+    # One DELETE, without collecting related rows or sending signals
+    queryset._raw_delete(queryset.db)  # pylint: disable=protected-access
+
+
+def _delete_merged(rows):
+    """Delete merged rows in bulk, without a delete signal per row.
+
+    Their extra ASN links go with them and ban audits keep no reference,
+    as the cascades would do; the counters and indexes are updated once.
+    """
+    range_ids = [row.id for row in rows]
+    _raw_delete(IPRange.extra_asns.through.objects.filter(iprange_id__in=range_ids))
+    BanAudit.objects.filter(iprange_id__in=range_ids).update(iprange=None)
+    _raw_delete(IPRange.objects.filter(id__in=range_ids))
+    deltas = Counter()
+    for row in rows:
+        deltas[row.asn_id, counters.range_state(row.scheduled, row.blocked)] -= 1
+    counters.adjust(deltas)
+    range_index.remove_many(range_ids)
+    lookup_index.remove(range_ids=range_ids)
+
+
+def consolidate_ranges():
+    """Merge stored ranges that share an ASN and status.
+
+    Returns a dict with the row counts before and after and the time taken.
+    """
+    started = time.perf_counter()
+    groups = defaultdict(list)
+    rows = IPRange.objects.only(
+        "address",
+        "asn_id",
+        "scheduled",
+        "blocked",
+        "check_reason",
+        "date_added",
+        "delisted",
+        "last_updated",
+    )
+    for row in rows.iterator(chunk_size=5000):
+        net = ipaddress.ip_network(row.address, strict=False)
+        groups[(row.asn_id, row.scheduled, row.blocked)].append((net, row))
+    before = sum(len(members) for members in groups.values())
+    merges = [
+        (supernet, members)
+        for pairs in groups.values()
+        for supernet, members in collapse_entries(pairs)
+        if len(members) > 1
+    ]
+    removed = 0
+    for pos in range(0, len(merges), BATCH_SIZE):
+        with transaction.atomic():
+            merged = []
+            for supernet, members in merges[pos : pos + BATCH_SIZE]:
+                merged += _merge_group(supernet, members)
+            if merged:
+                _delete_merged(merged)
+        removed += len(merged)
+    return {
+        "before": before,
+        "after": before - removed,
+        "seconds": time.perf_counter() - started,
+    }
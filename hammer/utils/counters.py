@@ -0,0 +1,134 @@
+"""Incrementally maintained counts of ranges per ASN and review state.
+
+Single-row saves and deletes are counted through model signals. Bulk
+writes, which send no signals, report their changes through adjust.
+"""
+
+from collections import Counter
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Q, Sum
+from django.db.models.signals import post_delete, post_save, pre_save
+from hammer.models import IPRange, RangeCount
+from hammer.utils import page_cache
+
+State = RangeCount.State
+
+
+def range_state(scheduled, blocked):
+    """Return the review state of a range, as the list filters classify it."""
+    if blocked:
+        return State.BLOCKED
+    if scheduled:
+        return State.PENDING
+    return State.NEW
+
+
+def adjust(deltas):
+    """Apply a mapping of (asn_id, state) to the change in count.
+
+    The range lists of every ASN in deltas are invalidated, even when its
+    count did not change.
+    """
+    page_cache.ranges_changed({asn_id for asn_id, _ in deltas})
+    with transaction.atomic():
+        for (asn_id, state), delta in deltas.items():
+            if not delta:
+                continue
+            counter = RangeCount.objects.filter(asn_id=asn_id, state=state)
+            # A missing counter can only be decremented if the ASN is being deleted
+            if counter.update(count=F("count") + delta) or delta < 0:
+                continue
+            try:
+                with transaction.atomic():
+                    RangeCount.objects.create(asn_id=asn_id, state=state, count=delta)
+            except IntegrityError:
+                # Another writer created the counter since the update
+                counter.update(count=F("count") + delta)
+
+
+def rebuild():
+    """Recount every counter from IPRange."""
+    rows = IPRange.objects.values("asn_id", "scheduled", "blocked").annotate(
+        total=Count("id")
+    )
+    counts = Counter()
+    for row in rows:
+        counts[row["asn_id"], range_state(row["scheduled"], row["blocked"])] += row[
+            "total"
+        ]
+    with transaction.atomic():
+        RangeCount.objects.all().delete()
+        RangeCount.objects.bulk_create(
+            RangeCount(asn_id=asn_id, state=state, count=count)
+            for (asn_id, state), count in counts.items()
+        )
+    page_cache.invalidate_all()
+
+
+def totals():
+    """Return a dict mapping state name ("new", "pending", "blocked") to count."""
+    counts = dict(RangeCount.objects.values_list("state").annotate(total=Sum("count")))
+    return {state.name.lower(): counts.get(state, 0) for state in State}
+
+
+def top_offenders(limit=50, state=None):
+    """Return the ASNs with the most ranges, optionally in a single state.
+
+    Each item is a dict with asn, description, new, pending, blocked and
+    total values.
+    """
+    per_state = {
+        state.name.lower(): Sum("count", filter=Q(state=state)) for state in State
+    }
+    rows = (
+        RangeCount.objects.filter(asn__isnull=False)
+        .values("asn__asn", "asn__description")
+        .annotate(total=Sum("count"), **per_state)
+    )
+    order = "total" if state is None else state.name.lower()
+    return [
+        {
+            "asn": row.pop("asn__asn"),
+            "description": row.pop("asn__description"),
+            **{key: value or 0 for key, value in row.items()},
+        }
+        for row in rows.filter(**{f"{order}__gt": 0}).order_by(f"-{order}")[:limit]
+    ]
+
+
+def _remember_state(instance, raw=False, **_kwargs):
+    # Ranges loaded from the database remember their state from
+    # IPRange.from_db; only ones given a pk by hand, or reloaded with
+    # refresh_from_db, are read back
+    if raw or instance.pk is None or hasattr(instance, "_counted"):
+        return
+    instance._counted = (  # pylint: disable=protected-access
+        IPRange.objects.filter(pk=instance.pk)
+        .values_list("asn_id", "scheduled", "blocked")
+        .first()
+    )
+
+
+def _count_saved(instance, created, raw=False, **_kwargs):
+    if raw:
+        return
+    state = (instance.asn_id, instance.scheduled, instance.blocked)
+    previous = getattr(instance, "_counted", None)
+    instance._counted = state  # pylint: disable=protected-access
+    deltas = Counter()
+    deltas[instance.asn_id, range_state(instance.scheduled, instance.blocked)] += 1
+    if previous is not None:
+        asn_id, scheduled, blocked = previous
+        deltas[asn_id, range_state(scheduled, blocked)] -= 1
+    elif not created:
+        return  # Saved without a pre_save, e.g. with an explicit pk
+    adjust(deltas)
+
+
+def _count_deleted(instance, **_kwargs):
+    adjust({(instance.asn_id, range_state(instance.scheduled, instance.blocked)): -1})
+
+
+pre_save.connect(_remember_state, sender=IPRange)
+post_save.connect(_count_saved, sender=IPRange)
+post_delete.connect(_count_deleted, sender=IPRange)
@@ -0,0 +1,51 @@
+"""Tuning applied to every new database connection.
+
+SQLite connections switch to write-ahead logging, so page reads are not
+blocked while a load commits, and wait for locks instead of failing at
+once. Settings in HAMMER_SQLITE_PRAGMAS override or, with None, drop the
+defaults below.
+
+Worker processes set themselves up through setup_worker, which imports
+nothing that needs Django to be set up first.
+"""
+
+import django
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    # With WAL, NORMAL only risks the last commits on power loss, not corruption
+    "synchronous": "NORMAL",
+    "mmap_size": 256 << 20,
+    "busy_timeout": 5000,
+}
+
+
+def sqlite_pragmas():
+    """Return the PRAGMAs applied to each SQLite connection."""
+    pragmas = {**SQLITE_PRAGMAS, **getattr(settings, "HAMMER_SQLITE_PRAGMAS", {})}
+    return {name: value for name, value in pragmas.items() if value is not None}
+
+
+@receiver(connection_created)
+def _tune_connection(connection, **_kwargs):
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as cursor:
+        for name, value in sqlite_pragmas().items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+
+
+def setup_worker(names):
+    """Set up Django in a spawned worker, using the database names given.
+
+    names maps each database alias to the name its parent process uses,
+    which differs from the configured one under tests and benchmarks.
+    """
+    django.setup()
+    for alias, name in names.items():
+        settings.DATABASES[alias]["NAME"] = name
+        connections[alias].settings_dict["NAME"] = name
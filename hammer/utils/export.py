@@ -0,0 +1,93 @@
+"""Streaming exports of stored ranges for block lists.
+
+Every exporter is a generator of text lines over a queryset of IPRange,
+reading the table in chunks so memory use does not grow with its size.
+"""
+
+import csv
+import io
+import json
+from hammer.models import KEY_FIELDS, join_key
+from hammer.utils.consolidate import collapse_sorted
+from hammer.utils.counters import range_state
+from hammer.utils.range_index import BITS, NETWORK_CLASSES, bounds_prefixlen
+
+CHUNK_SIZE = 2000
+FIELDS = ("address", "asn__asn", "scheduled", "blocked", "date_added", "check_reason")
+
+
+def _status(scheduled, blocked):
+    return range_state(scheduled, blocked).name.lower()
+
+
+def _rows(queryset):
+    return queryset.order_by("id").values_list(*FIELDS).iterator(chunk_size=CHUNK_SIZE)
+
+
+def export_csv(queryset):
+    """Yield the ranges of queryset as CSV lines, starting with a header."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(["address", "asn", "status", "date_added", "check_reason"])
+    for address, asn, scheduled, blocked, added, reason in _rows(queryset):
+        writer.writerow(
+            [address, asn, _status(scheduled, blocked), added.isoformat(), reason]
+        )
+        if buffer.tell() >= 1 << 16:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def export_jsonl(queryset):
+    """Yield the ranges of queryset as JSON Lines."""
+    for address, asn, scheduled, blocked, added, reason in _rows(queryset):
+        yield json.dumps(
+            {
+                "address": address,
+                "asn": asn,
+                "status": _status(scheduled, blocked),
+                "date_added": added.isoformat(),
+                "check_reason": reason,
+            }
+        ) + "\n"
+
+
+def export_cidr(queryset):
+    """Yield the address of each range of queryset, one per line."""
+    addresses = queryset.order_by("id").values_list("address", flat=True)
+    for address in addresses.iterator(chunk_size=CHUNK_SIZE):
+        yield address + "\n"
+
+
+def export_collapsed(queryset):
+    """Yield the smallest list of CIDRs covering the ranges of queryset.
+
+    Ranges are read in address order from the bounds index, one IP version
+    at a time, and merged as they stream past with collapse_sorted.
+    """
+    for version, bits in BITS.items():
+        bounds = (
+            queryset.filter(ip_version=version)
+            .order_by("start_hi", "start_lo", "-end_hi", "-end_lo")
+            .values_list(*KEY_FIELDS[1:])
+            .iterator(chunk_size=CHUNK_SIZE)
+        )
+        items = (
+            (start, bounds_prefixlen(version, start, end), None)
+            for start, end in (
+                (join_key(start_hi, start_lo), join_key(end_hi, end_lo))
+                for start_hi, start_lo, end_hi, end_lo in bounds
+            )
+        )
+        network = NETWORK_CLASSES[version]
+        for start, prefixlen, _ in collapse_sorted(items, bits):
+            yield network((start, prefixlen)).compressed + "\n"
+
+
+EXPORTERS = {
+    "csv": (export_csv, "text/csv"),
+    "jsonl": (export_jsonl, "application/x-ndjson"),
+    "cidr": (export_cidr, "text/plain"),
+}
@@ -0,0 +1,187 @@
+"""Batched ingestion of proxy range lists."""
+
+import ipaddress
+from collections import Counter
+from itertools import islice
+from django.db import transaction
+from hammer.models import IPRange, range_fields
+from hammer.utils import counters, page_cache, staging
+from hammer.utils.asn_cache import asn_resolver
+from hammer.utils.asn_lookup import asn_service
+from hammer.utils.consolidate import collapse_rows
+from hammer.utils.jobs import report_progress
+from hammer.utils.range_index import range_index
+
+# Kept below SQLite's default limit of 999 host parameters so that the
+# set-based "__in" lookups for a chunk fit into a single query.
+CHUNK_SIZE = 900
+
+
+def parse_network(value):
+    """Parse and validate an IP range, returning None if it is rejected.
+
+    Accepts the same values as validate_ip_range, but parses each value once.
+    """
+    try:
+        net = ipaddress.ip_network(value.strip(), strict=False)
+    except ValueError:
+        return None
+    if not net.is_global:
+        return None
+    return net
+
+
+def parse_rows(rows):
+    """Yield (network, check_reason) pairs for each valid CSV row."""
+    for row in rows:
+        if len(row) != 2:
+            continue
+        net = parse_network(row[0])
+        if net is not None:
+            yield net, row[1]
+
+
+def chunked(iterable, size=CHUNK_SIZE):
+    """Yield lists of at most size items from iterable."""
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def link_extra_asns(ranges, asndb=asn_service, replace=False):
+    """Record every other ASN announcing part of each range.
+
+    ranges holds (range_id, network, primary AS number) triples. With replace
+    set, ranges whose recorded extra ASNs differ have them rewritten.
+    """
+    through = IPRange.extra_asns.through
+    covered = asndb.covered_asns_many(net for _, net, _ in ranges)
+    extras = {
+        range_id: numbers - {primary}
+        for (range_id, _, primary), numbers in zip(ranges, covered)
+    }
+    if replace:
+        current = {range_id: set() for range_id in extras}
+        for range_id, number in through.objects.filter(
+            iprange_id__in=extras
+        ).values_list("iprange_id", "asn__asn"):
+            current[range_id].add(number)
+        extras = {
+            range_id: numbers
+            for range_id, numbers in extras.items()
+            if numbers != current[range_id]
+        }
+        through.objects.filter(iprange_id__in=extras).delete()
+    asn_ids = asn_resolver.resolve_many(set().union(*extras.values()))
+    page_cache.ranges_changed(asn_ids.values())
+    through.objects.bulk_create(
+        [
+            through(iprange_id=range_id, asn_id=asn_ids[number])
+            for range_id, numbers in extras.items()
+            for number in numbers
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def write_chunk(pairs, asndb=asn_service, consolidate=True):
+    """Write one chunk of (network, check_reason) pairs in a single transaction.
+
+    With consolidate set, nested and adjacent networks of the chunk that share
+    an ASN are merged, and networks already covered by a stored range are
+    dropped. On PostgreSQL the rows are loaded with COPY, see staging.
+    Returns the number of new IPRange rows.
+    """
+    networks = {}
+    for net, reason in pairs:
+        networks.setdefault(net.compressed, (net, reason))
+    pairs = list(networks.values())
+    numbers = asndb.lookup_many(net.network_address for net, _ in pairs)
+    rows = [(net, reason, number) for (net, reason), number in zip(pairs, numbers)]
+    if consolidate:
+        rows = [row for row in collapse_rows(rows) if not range_index.covering(row[0])]
+    rows = {net.compressed: (net, reason, number) for net, reason, number in rows}
+    # Built on first use, which takes seconds; not while holding the write lock
+    asndb.prefix_table()
+    asn_resolver.preload(number for _, _, number in rows.values() if number is not None)
+    with transaction.atomic():
+        if staging.copy_supported():
+            asn_ids = asn_resolver.resolve_many(
+                number for _, _, number in rows.values() if number is not None
+            )
+            stored = staging.copy_ranges(
+                (net, asn_ids.get(number), reason)
+                for net, reason, number in rows.values()
+            )
+            new = {address: rows[address] for _, address in stored}
+        else:
+            existing = set(
+                IPRange.objects.filter(address__in=rows).values_list(
+                    "address", flat=True
+                )
+            )
+            new = {
+                address: row for address, row in rows.items() if address not in existing
+            }
+            asn_ids = asn_resolver.resolve_many(
+                number for _, _, number in new.values() if number is not None
+            )
+            IPRange.objects.bulk_create(
+                [
+                    IPRange(
+                        address=address,
+                        **range_fields(net),
+                        asn_id=asn_ids.get(number),
+                        check_reason=reason,
+                    )
+                    for address, (net, reason, number) in new.items()
+                ],
+                ignore_conflicts=True,
+            )
+            stored = list(
+                IPRange.objects.filter(address__in=new).values_list("id", "address")
+            )
+        link_extra_asns(
+            [
+                (range_id, new[address][0], new[address][2])
+                for range_id, address in stored
+            ],
+            asndb,
+        )
+        counters.adjust(
+            Counter(
+                (asn_ids.get(new[address][2]), counters.State.NEW)
+                for _, address in stored
+            )
+        )
+    range_index.add_many(
+        (range_id, *range_fields(new[address][0]).values())
+        for range_id, address in stored
+    )
+    return len(new)
+
+
+def load_rows(rows, asndb=asn_service, chunk_size=CHUNK_SIZE, consolidate=True):
+    """Ingest CSV rows in chunks, returning the number of new IPRange rows."""
+    return load_pairs(parse_rows(rows), asndb, chunk_size, consolidate)
+
+
+def load_pairs(pairs, asndb=asn_service, chunk_size=CHUNK_SIZE, consolidate=True):
+    """Ingest parsed (network, check_reason) pairs in chunks.
+
+    Returns the number of new IPRange rows.
+    """
+    if consolidate:
+        range_index.rebuild()
+    added = processed = 0
+    try:
+        for chunk in chunked(pairs, chunk_size):
+            added += write_chunk(chunk, asndb, consolidate)
+            processed += len(chunk)
+            report_progress(rows=processed, added=added)
+    except:
+        # Rows created by a rolled back chunk must not stay cached
+        asn_resolver.invalidate()
+        range_index.invalidate()
+        raise
+    return added
@@ -1,3 +1,6 @@
-from .jobs import Job, JobManager
+from django.conf import settings
+from .jobs import Job, JobManager, ProcessJob, current_record, report_progress
 
-global_manager = JobManager()
+global_manager = JobManager(
+    executor=getattr(settings, "HAMMER_JOB_EXECUTOR", "process")
+)
@@ -1,4 +1,119 @@
-from threading import Thread, Lock
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+from threading import Thread, Lock, current_thread, local
+from django.conf import settings
+from django.db import connections
+from hammer.utils import db_profile, page_cache
+from .registry import JobRecorder
+from .scheduler import job_limits
+
+_local = local()
+
+
+def report_progress(**progress):
+    """Record progress values on the job running in the current thread, if any.
+
+    A "rows" value is stored as the number of rows processed.
+    """
+    job = current_thread()
+    if isinstance(job, Job):
+        job.progress.update(progress)
+    recorder = getattr(_local, "recorder", None)
+    if recorder is not None:
+        recorder.progress(progress)
+
+
+def current_record():
+    """Return the JobRecord of the job running in the current thread, if any."""
+    recorder = getattr(_local, "recorder", None)
+    return None if recorder is None else recorder.record
+
+
+def run_recorded(recorder, target, args, kwargs):
+    """Run target, recording its start, progress and outcome with recorder."""
+    _local.recorder = recorder
+    recorder.start()
+    try:
+        target(*args, **kwargs)
+    except BaseException as err:
+        recorder.finish(err)
+        raise
+    else:
+        recorder.finish()
+    finally:
+        _local.recorder = None
+
+
+def pool_size():
+    """Return the number of worker processes, from HAMMER_JOB_PROCESSES.
+
+    Defaults to the sum of the scheduler's limits, so every run the
+    scheduler starts gets a worker at once.
+    """
+    return getattr(settings, "HAMMER_JOB_PROCESSES", None) or sum(job_limits().values())
+
+
+class WorkerPool:
+    """Holds the pool of worker processes shared by every ProcessJob."""
+
+    def __init__(self):
+        self._executor = None
+        self._lock = Lock()
+
+    def get(self):
+        """Return the pool, starting it if needed."""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(
+                    max_workers=pool_size(),
+                    mp_context=get_context("spawn"),
+                    initializer=db_profile.setup_worker,
+                    initargs=(
+                        {alias: db["NAME"] for alias, db in settings.DATABASES.items()},
+                    ),
+                )
+            return self._executor
+
+    def discard(self, executor):
+        """Forget executor if it is still the pool, so the next get starts one."""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+
+    def shutdown(self):
+        """Stop the worker processes, if started."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+
+_pool = WorkerPool()
+
+
+def process_pool():
+    """Return the shared pool of worker processes, starting it if needed.
+
+    Workers are spawned rather than forked so they do not inherit the web
+    process's threads or database connections, and set up Django on start.
+    They use the databases this process uses when the pool starts, which
+    differ from the configured ones under tests and benchmarks.
+    """
+    return _pool.get()
+
+
+def shutdown_pool():
+    """Stop the worker processes, if started; the next ProcessJob starts more."""
+    _pool.shutdown()
+
+
+def _run_in_worker(record_id, target, args, kwargs):
+    """Entry point of a ProcessJob inside a worker process."""
+    try:
+        run_recorded(JobRecorder(record_id=record_id), target, args, kwargs)
+    finally:
+        connections.close_all()
 
 
 class Job(Thread):
@@ -6,6 +121,9 @@ class Job(Thread):
 
     type = None
     lock = None
+    progress = None
+    recorder = None
+    failed = False
 
     def __init__(self, job_type, lock, target, args=(), kwargs=None):
         """
@@ -32,23 +150,78 @@ class Job(Thread):
         super().__init__(target=target, args=args, kwargs=kwargs)
         self.type = job_type
         self.lock = lock
+        self.progress = {}
 
     def run(self):
-        """Gain lock and run."""
-        with self.lock:
-            super().run()
+        """Record the job, gain lock and run."""
+        try:
+            self.recorder = JobRecorder(self.type)
+            with self.lock:
+                self.execute()
+        except BaseException:
+            self.failed = True
+            raise
+        finally:
+            connections.close_all()
+
+    def execute(self):
+        """Run the target while holding the lock."""
+        run_recorded(self.recorder, self._target, self._args, self._kwargs)
+
+
+class ProcessJob(Job):
+    """A Job whose target runs in a worker process instead of this one.
+
+    The lock is still taken by a thread of this process, so queuing works
+    exactly as for Job. The target and its arguments must be picklable; the
+    worker reports progress straight to the job's JobRecord.
+    """
+
+    def execute(self):
+        """Hand the target to a worker process and wait for it to finish."""
+        pool = process_pool()
+        try:
+            future = pool.submit(
+                _run_in_worker,
+                self.recorder.record.id,
+                self._target,
+                self._args,
+                self._kwargs,
+            )
+            future.result()
+        except BrokenProcessPool as err:
+            # The worker died without recording its end, so record it here
+            _pool.discard(pool)
+            self.recorder.record.refresh_from_db()
+            self.recorder.finish(err)
+            raise
+        finally:
+            # The worker could not invalidate pages cached by this process
+            if page_cache.process_local():
+                page_cache.invalidate_all()
 
 
 class JobManager:
     """Manages the Locks that control Jobs."""
 
     locks = {}
+    executors = {"thread": Job, "process": ProcessJob}
+
+    def __init__(self, locks=None, executor="thread"):
+        """
+        Create object with optional default dictionary mapping names to Locks.
 
-    def __init__(self, locks=None):
-        """Create object with optional default dictionary mapping names to Locks."""
+        executor selects how jobs made by make_and_register run: "thread"
+        runs them on a thread of this process, "process" in a worker process.
+        """
         if locks is None:
             locks = {}
         self.locks = locks
+        self.job_class = self.executors[executor]
+
+    def capacity(self):
+        """Return how many jobs can run at once, or None if there is no limit."""
+        return pool_size() if self.job_class is ProcessJob else None
 
     def make_and_register(
         self,
@@ -68,7 +241,7 @@ class JobManager:
 
         Parameters
         ----------
-        type : str
+        job_type : str
             Type of job to be added as a string.
         target : func
             Callable function for the new job.
@@ -84,25 +257,31 @@ class JobManager:
         strict : bool
             Determines if the behavior from allow_queue and populate_new_type will
             additionally raise a ValueError instead of failing silently.
+
+        Returns
+        -------
+        Job
+            The new Job, or None if it failed silently.
         """
         if kwargs is None:
             kwargs = {}
-        if type not in self.locks:
+        if job_type not in self.locks:
             if not populate_new_type:
                 if strict:
                     raise ValueError(
-                        f"Attempted to add new {type} Job when not permitted"
+                        f"Attempted to add new {job_type} Job when not permitted"
                     )
-                return  # Silent failure
-            self.locks[type] = Lock()
-        if self.locks[type].locked() and not allow_queue:
+                return None  # Silent failure
+            self.locks[job_type] = Lock()
+        if self.locks[job_type].locked() and not allow_queue:
             if strict:
                 raise ValueError(
-                    f"Attempted to queue a new {type} Job when not permitted"
+                    f"Attempted to queue a new {job_type} Job when not permitted"
                 )
-            return  # Silent failure
-        job = Job(job_type, self.locks[type], target, args, kwargs)
+            return None  # Silent failure
+        job = self.job_class(job_type, self.locks[job_type], target, args, kwargs)
         job.start()
+        return job
 
     def register(self, job, merge=False, allow_queue=True, strict=True):
         """
@@ -134,16 +313,16 @@ class JobManager:
                         f"Registering more {job.type} Jobs is not permitted"
                     )
                 return  # Silent failure
-            if self.locks[type].locked() and not allow_queue:
+            if self.locks[job.type].locked() and not allow_queue:
                 if strict:
                     raise ValueError(
-                        f"Attempted to queue a new {type} Job when not permitted"
+                        f"Attempted to queue a new {job.type} Job when not permitted"
                     )
                 return  # Silent failure
-            job.lock = self.locks[type]
+            job.lock = self.locks[job.type]
             job.start()
             return
         if job.lock is None:
             job.lock = Lock()
-        self.locks[type] = job.lock
+        self.locks[job.type] = job.lock
         job.start()
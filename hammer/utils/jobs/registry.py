@@ -0,0 +1,78 @@
+import resource
+import time
+import traceback
+from django.utils import timezone
+from hammer.models import JobRecord
+
+
+def current_memory():
+    """Return the resident set size of this process in bytes."""
+    try:
+        with open("/proc/self/statm", encoding="ascii") as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        # ru_maxrss is the lifetime peak, in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class JobRecorder:
+    """Persists the progress of one Job to a JobRecord."""
+
+    def __init__(self, job_type=None, save_interval=1.0, record_id=None):
+        """
+        Create the JobRecord for a newly queued job.
+
+        Parameters
+        ----------
+        job_type : str
+            Type of the Job as a string.
+        save_interval : float
+            Minimum number of seconds between progress writes.
+        record_id : int
+            Continue recording to an existing JobRecord instead, such as one
+            created by another process.
+        """
+        if record_id is None:
+            self.record = JobRecord.objects.create(job_type=job_type)
+        else:
+            self.record = JobRecord.objects.get(id=record_id)
+        self.save_interval = save_interval
+        self._saved = 0.0
+
+    def _sample_memory(self):
+        memory = current_memory()
+        if self.record.peak_memory is None or memory > self.record.peak_memory:
+            self.record.peak_memory = memory
+
+    def start(self):
+        """Mark the job as running."""
+        self.record.status = JobRecord.Status.RUNNING
+        self.record.started = timezone.now()
+        self._sample_memory()
+        self.record.save(update_fields=["status", "started", "peak_memory"])
+        self._saved = time.monotonic()
+
+    def progress(self, values):
+        """Merge reported values into the record, saving at most every save_interval."""
+        if "rows" in values:
+            self.record.rows_processed = values["rows"]
+        self.record.progress.update(
+            (key, value) for key, value in values.items() if key != "rows"
+        )
+        self._sample_memory()
+        if time.monotonic() - self._saved >= self.save_interval:
+            self.record.save(
+                update_fields=["rows_processed", "progress", "peak_memory"]
+            )
+            self._saved = time.monotonic()
+
+    def finish(self, error=None):
+        """Mark the job as done, or as failed with the given exception."""
+        self.record.finished = timezone.now()
+        self._sample_memory()
+        if error is None:
+            self.record.status = JobRecord.Status.DONE
+        else:
+            self.record.status = JobRecord.Status.FAILED
+            self.record.error = "".join(traceback.format_exception(error))
+        self.record.save()
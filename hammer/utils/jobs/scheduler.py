@@ -0,0 +1,348 @@
+"""Queued, dependency-aware running of tools on top of a JobManager.
+
+Each tool is run as a Job of its own type, so runs of different tools only
+wait for each other when the scheduler says so:
+
+* a run waits for the queued or running runs of the tools it depends on,
+  and is skipped if one of them fails;
+* at most limits[kind] runs of each kind ("io" or "cpu") run at once, and
+  never more than the manager has worker processes for;
+* runs sharing a group, such as the tools writing ranges, run one at a time,
+  and a run never overlaps a run of a tool either of them conflicts with;
+* among the runs allowed to start, higher priorities start first.
+
+Tools given a schedule are also submitted, with their dependencies, every
+so many seconds while the scheduler thread runs.
+"""
+
+import heapq
+import time
+from itertools import count
+from threading import Condition, Thread, current_thread
+from django.conf import settings
+from django.db import connections
+from django.db.models import Max
+from django.utils import timezone
+from hammer.models import JobRecord
+
+DEFAULT_LIMITS = {"io": 4, "cpu": 1}
+# Longest time the scheduler thread sleeps before checking the schedule again
+POLL_INTERVAL = 60.0
+
+
+def job_limits():
+    """Return the concurrency limit of each kind, from HAMMER_JOB_LIMITS."""
+    return {**DEFAULT_LIMITS, **getattr(settings, "HAMMER_JOB_LIMITS", {})}
+
+
+class Tool:  # pylint: disable=too-few-public-methods
+    """How the scheduler runs one type of job."""
+
+    def __init__(
+        self,
+        target,
+        kind="cpu",
+        *,
+        priority=0,
+        depends=(),
+        group=None,
+        conflicts=(),
+        unique=True,
+    ):
+        """
+        Parameters
+        ----------
+        target : func
+            Callable run by the job.
+        kind : str
+            "io" or "cpu", selecting the concurrency limit the run counts against.
+        priority : int
+            Runs with higher priorities start first.
+        depends : tuple of str
+            Names of the tools whose runs must finish first.
+        group : str
+            Runs of tools in the same group never overlap.
+        conflicts : tuple of str
+            Names of other tools whose runs never overlap runs of this one.
+        unique : bool
+            If True, the tool cannot be submitted while a run of it is
+            queued or running.
+        """
+        self.target = target
+        self.kind = kind
+        self.priority = priority
+        self.depends = tuple(depends)
+        self.group = group
+        self.conflicts = tuple(conflicts)
+        self.unique = unique
+
+
+class Run:  # pylint: disable=too-many-instance-attributes
+    """One submitted run of a tool."""
+
+    QUEUED, RUNNING, DONE, FAILED, SKIPPED = range(5)
+
+    def __init__(self, name, tool, priority, after, *, args=(), kwargs=None):
+        self.name = name
+        self.tool = tool
+        self.priority = priority
+        self.after = after
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.state = self.QUEUED
+        self.job = None
+
+    @property
+    def finished(self):
+        """True once the run is done, failed or skipped."""
+        return self.state >= self.DONE
+
+    def __repr__(self):
+        return f"<Run {self.name} state={self.state}>"
+
+
+class Scheduler:  # pylint: disable=too-many-instance-attributes
+    """Starts submitted tool runs once their dependencies and limits allow."""
+
+    def __init__(self, manager, tools, limits=None, schedule=None):
+        """
+        Parameters
+        ----------
+        manager : JobManager
+            Manager that makes the job of each run.
+        tools : dict
+            Maps tool names to Tools.
+        limits : dict
+            Maximum number of concurrent runs of each kind; defaults to the
+            HAMMER_JOB_LIMITS setting. The runs of all kinds together are
+            also kept within the manager's capacity.
+        schedule : dict
+            Maps tool names to the number of seconds between periodic runs.
+        """
+        self.manager = manager
+        self.tools = tools
+        self.limits = job_limits() if limits is None else {**DEFAULT_LIMITS, **limits}
+        self.schedule = {}
+        self._cond = Condition()
+        self._queue = []
+        self._active = []
+        self._order = count()
+        self._due = {}
+        self._thread = None
+        if schedule:
+            self.set_schedule(schedule)
+
+    def set_schedule(self, schedule):
+        """Replace the periodic runs with schedule.
+
+        Each tool is first due once its interval has passed since its last
+        recorded run, so restarting does not repeat recent runs.
+        """
+        unknown = set(schedule) - self.tools.keys()
+        if unknown:
+            raise ValueError(f"Cannot schedule unknown tools {sorted(unknown)}")
+        with self._cond:
+            self.schedule = dict(schedule)
+            self._due = self._first_due()
+            self._cond.notify_all()
+
+    def submit(
+        self,
+        name,
+        args=(),
+        kwargs=None,
+        *,
+        priority=None,
+        with_dependencies=False,
+        strict=True,
+    ):
+        """Queue a run of the named tool and return it.
+
+        With with_dependencies, a run of each tool it depends on, directly
+        or not, is queued first unless one is already queued or running.
+        If the tool is unique and already queued or running, raises
+        ValueError if strict, otherwise returns the existing run.
+        """
+        if name not in self.tools:
+            raise ValueError(f"Unknown tool {name}")
+        with self._cond:
+            self.start()
+            run = self._enqueue(
+                name,
+                args,
+                kwargs,
+                priority,
+                dependencies=with_dependencies,
+                strict=strict,
+            )
+            self._cond.notify_all()
+            return run
+
+    def start(self):
+        """Start the scheduler thread if it is not running."""
+        with self._cond:
+            if self._thread is None:
+                self._thread = Thread(target=self._loop, name="scheduler", daemon=True)
+                self._thread.start()
+            return self._thread
+
+    def stop(self):
+        """Stop the scheduler thread; runs it already started carry on."""
+        with self._cond:
+            thread, self._thread = self._thread, None
+            self._cond.notify_all()
+        if thread is not None:
+            thread.join()
+
+    def wait(self, runs, timeout=None):
+        """Wait until every run in runs has finished; return True if they have."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while not all(run.finished for run in runs):
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+            return True
+
+    def queued(self):
+        """Return the queued and running runs, in the order they would start."""
+        with self._cond:
+            running = [run for run in self._active if run.state == Run.RUNNING]
+            return running + [entry[-1] for entry in sorted(self._queue)]
+
+    def _find(self, name):
+        for run in self._active:
+            if run.name == name and not run.finished:
+                return run
+        return None
+
+    def _enqueue(self, name, args, kwargs, priority, *, dependencies, strict):
+        tool = self.tools[name]
+        existing = self._find(name) if tool.unique else None
+        if existing is not None:
+            if strict:
+                raise ValueError(f"Tool {name} is already queued or running")
+            return existing
+        if priority is None:
+            priority = tool.priority
+        after = []
+        for dependency in tool.depends:
+            run = self._find(dependency)
+            if run is None and dependencies:
+                run = self._enqueue(
+                    dependency, (), None, None, dependencies=True, strict=False
+                )
+            if run is not None:
+                after.append(run)
+        run = Run(name, tool, priority, after, args=args, kwargs=kwargs)
+        self._active.append(run)
+        heapq.heappush(self._queue, (-priority, next(self._order), run))
+        return run
+
+    def _first_due(self):
+        if not self.schedule:
+            return {}
+        now = time.monotonic()
+        last_runs = dict(
+            JobRecord.objects.filter(job_type__in=list(self.schedule))
+            .values("job_type")
+            .annotate(last=Max("queued"))
+            .values_list("job_type", "last")
+        )
+        due = {}
+        for name, interval in self.schedule.items():
+            last = last_runs.get(name)
+            since = (timezone.now() - last).total_seconds() if last else interval
+            due[name] = now + max(0.0, interval - since)
+        return due
+
+    def _submit_due(self):
+        now = time.monotonic()
+        for name, due in self._due.items():
+            if due <= now:
+                self._enqueue(name, (), None, None, dependencies=True, strict=False)
+                self._due[name] = now + self.schedule[name]
+
+    def _startable(self, run, running):
+        if any(not dependency.finished for dependency in run.after):
+            return False
+        capacity = self.manager.capacity()
+        if capacity is not None and len(running) >= capacity:
+            return False
+        kind = run.tool.kind
+        if sum(other.tool.kind == kind for other in running) >= self.limits[kind]:
+            return False
+        if any(self._conflict(run, other) for other in running):
+            return False
+        group = run.tool.group
+        return group is None or all(other.tool.group != group for other in running)
+
+    @staticmethod
+    def _conflict(run, other):
+        return other.name in run.tool.conflicts or run.name in other.tool.conflicts
+
+    def _dispatch(self):
+        """Start or skip what can be; return True if a run was skipped."""
+        skipped = False
+        running = [run for run in self._active if run.state == Run.RUNNING]
+        waiting = []
+        while self._queue:
+            entry = heapq.heappop(self._queue)
+            run = entry[-1]
+            failed = [
+                dependency.name
+                for dependency in run.after
+                if dependency.state in (Run.FAILED, Run.SKIPPED)
+            ]
+            if failed:
+                self._skip(run, failed)
+                skipped = True
+            elif self._startable(run, running):
+                self._launch(run)
+                running.append(run)
+            else:
+                waiting.append(entry)
+        for entry in waiting:
+            heapq.heappush(self._queue, entry)
+        self._active = [run for run in self._active if not run.finished]
+        return skipped
+
+    def _skip(self, run, failed):
+        run.state = Run.SKIPPED
+        JobRecord.objects.create(
+            job_type=run.name,
+            status=JobRecord.Status.FAILED,
+            finished=timezone.now(),
+            error=f"Skipped because {', '.join(failed)} failed",
+        )
+
+    def _launch(self, run):
+        run.state = Run.RUNNING
+        run.job = self.manager.make_and_register(
+            run.name, run.tool.target, run.args, run.kwargs
+        )
+        Thread(target=self._watch, args=(run,), daemon=True).start()
+
+    def _watch(self, run):
+        run.job.join()
+        with self._cond:
+            run.state = Run.FAILED if run.job.failed else Run.DONE
+            self._cond.notify_all()
+
+    def _timeout(self):
+        if not self._due:
+            return None
+        return min(POLL_INTERVAL, max(0.0, min(self._due.values()) - time.monotonic()))
+
+    def _loop(self):
+        thread = current_thread()
+        try:
+            with self._cond:
+                while self._thread is thread:
+                    self._submit_due()
+                    while self._dispatch():
+                        pass  # runs waiting on a skipped run are skipped too
+                    self._cond.wait(self._timeout())
+        finally:
+            connections.close_all()
@@ -1,17 +1,33 @@
 import csv
 import ipaddress
+import json
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from ftplib import FTP
 from pathlib import Path
-from pyasn import mrtx, pyasn
+from tempfile import NamedTemporaryFile
+from pyasn import mrtx
 import requests
-from hammer.models import ASN, IPRange, validate_ip_range
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from hammer.models import IPRange, validate_ip_range
+from hammer.utils import counters, ingest, parallel_parse, reconcile, snapshot
+from hammer.utils.asn_cache import asn_resolver
+from hammer.utils.asn_lookup import DOWNLOADS_DIR, asn_service
+from hammer.utils.jobs import report_progress
+from hammer.utils.range_index import range_index
 
+# Shared so downloads reuse pooled connections
+SESSION = requests.Session()
 
-DOWNLOADS_DIR = Path(__file__).resolve().parent / "downloads"
+LIST_SOURCES = ("enwiki", "global")
+# Name of the RIB dump downloaded from routeviews, deleted once parsed
+RIB_FILE = "bgp.dat"
 
 
-def update_asn_db():
-    """Based on pyasn_util_download and pyasn_util_convert by hadiasghari for pyasn"""
+def download_rib():
+    """Based on pyasn_util_download by hadiasghari for pyasn"""
     ftp = FTP("archive.routeviews.org")
     ftp.login()
     months = sorted(ftp.nlst("route-views4/bgpdata"), reverse=True)
@@ -25,92 +41,331 @@ def update_asn_db():
         if not file_list:
             raise LookupError("Cannot find file to download, searched two directories")
     filename = max(file_list)
-    localfile = DOWNLOADS_DIR / "bgp.dat"
+    localfile = DOWNLOADS_DIR / RIB_FILE
     with localfile.open("wb") as lfile:
         ftp.retrbinary(f"RETR {filename}", lfile.write)
     ftp.close()
+    return localfile
+
+
+def find_mrt_file(source):
+    """Resolve a local MRT file, or the newest file in a directory of dumps."""
+    path = Path(source)
+    if path.is_dir():
+        files = [child for child in path.iterdir() if child.is_file()]
+        if not files:
+            raise LookupError(f"No MRT files found in {path}")
+        return max(files, key=lambda child: child.stat().st_mtime)
+    if not path.is_file():
+        raise LookupError(f"MRT file {path} does not exist")
+    return path
+
+
+def read_asn_dat(asn_file):
+    """Read a pyasn IPASN file into a dict mapping prefix to AS number."""
+    prefixes = {}
+    with open(asn_file, encoding="ASCII") as in_file:
+        for line in in_file:
+            if line.startswith(";") or not line.strip():
+                continue
+            prefix, number = line.split("\t")
+            prefixes[prefix] = int(number)
+    return prefixes
+
+
+def changed_prefixes(old, new):
+    """Return the prefixes that were added, removed or changed ASN."""
+    return {
+        prefix
+        for prefix in old.keys() | new.keys()
+        if old.get(prefix) != new.get(prefix)
+    }
+
+
+def refresh_range_asns(prefixes, asndb=asn_service, batch_size=ingest.CHUNK_SIZE):
+    """Re-resolve the ASN of stored ranges under the given prefixes.
+
+    Only rows whose ASN actually changed are written, grouped into one
+    UPDATE per new ASN and batch. Returns the number of updated rows.
+    """
+    candidates = set()
+    for prefix in prefixes:
+        candidates.update(range_index.overlapping(prefix))
+    candidates = sorted(candidates)
+    if candidates:
+        # Built on first use, which takes seconds; not inside the transactions
+        asndb.prefix_table()
+    updated = 0
+    for pos in range(0, len(candidates), batch_size):
+        updated += _refresh_asn_batch(candidates[pos : pos + batch_size], asndb)
+    return updated
+
+
+def _refresh_asn_batch(range_ids, asndb):
+    """Move one batch of ranges to the ASNs now announcing them."""
+    rows = list(
+        IPRange.objects.filter(id__in=range_ids).values_list(
+            "id", "address", "asn__asn", "asn_id", "scheduled", "blocked", named=True
+        )
+    )
+    networks = [ipaddress.ip_network(row.address) for row in rows]
+    numbers = asndb.lookup_many(net.network_address for net in networks)
+    moved = [
+        (row, number) for row, number in zip(rows, numbers) if number != row.asn__asn
+    ]
+    asn_ids = asn_resolver.resolve_many(
+        {number for _, number in moved if number is not None}
+    )
+    moves = {}
+    deltas = Counter()
+    for row, number in moved:
+        state = counters.range_state(row.scheduled, row.blocked)
+        deltas[row.asn_id, state] -= 1
+        deltas[asn_ids.get(number), state] += 1
+        moves.setdefault(number, []).append(row.id)
+    updated = 0
+    with transaction.atomic():
+        for number, ids in moves.items():
+            updated += IPRange.objects.filter(id__in=ids).update(
+                asn_id=asn_ids.get(number), last_updated=timezone.now()
+            )
+        counters.adjust(deltas)
+        ingest.link_extra_asns(
+            [
+                (row.id, net, number)
+                for row, net, number in zip(rows, networks, numbers)
+            ],
+            asndb,
+            replace=True,
+        )
+    return updated
+
+
+def fetch_rib(source=None):
+    """Return the MRT dump to build asn.dat from, fetching it if needed.
+
+    source is as for update_asn_db. A URL is downloaded
+    conditionally, and None is returned if the dump is unchanged since the
+    last download and asn.dat already exists.
+    """
+    if source is None:
+        source = getattr(settings, "HAMMER_MRT_SOURCE", None)
+    if source is None:
+        return download_rib()
+    if str(source).startswith(("http://", "https://")):
+        changed = download_csv(source, "rib.mrt", force=True)
+        if not changed and (DOWNLOADS_DIR / "asn.dat").is_file():
+            return None
+        return DOWNLOADS_DIR / "rib.mrt"
+    return find_mrt_file(source)
+
+
+def rebuild_asn_db(mrt_file):
+    """Rebuild asn.dat from an MRT dump and update ranges whose ASN changed."""
     asn_file = DOWNLOADS_DIR / "asn.dat"
-    prefixes = mrtx.parse_mrt_file(str(localfile))
-    mrtx.dump_prefixes_to_file(prefixes, str(asn_file), str(localfile))
-    localfile.unlink()
+    previous = read_asn_dat(asn_file) if asn_file.is_file() else None
+    # parse_mrt_file reads the dump record by record; only the table is kept
+    prefixes = {
+        prefix: min(origin) if isinstance(origin, set) else origin
+        for prefix, origin in mrtx.parse_mrt_file(str(mrt_file)).items()
+    }
+    temp_file = asn_file.with_suffix(".tmp")
+    mrtx.dump_prefixes_to_file(prefixes, str(temp_file), str(mrt_file.name))
+    temp_file.replace(asn_file)
+    asn_service.reload()
+    if previous is not None:
+        changed = changed_prefixes(previous, prefixes)
+        if changed:
+            refresh_range_asns(changed)
+
 
+def update_asn_db(source=None):
+    """Rebuild asn.dat from a RIB dump and update ranges whose ASN changed.
 
-def download_csv(url, file_name, force=False):
-    req = requests.get(url)
-    req.raise_for_status()
+    Based on pyasn_util_convert by hadiasghari for pyasn.
+
+    Parameters
+    ----------
+    source : str or Path (optional)
+        Local MRT file, directory whose newest file is used, or http(s) URL
+        of a dump, instead of downloading the latest RIB from routeviews.
+        Defaults to settings.HAMMER_MRT_SOURCE.
+    """
+    mrt_file = fetch_rib(source)
+    if mrt_file is None:
+        return
+    try:
+        rebuild_asn_db(mrt_file)
+    finally:
+        if mrt_file == DOWNLOADS_DIR / RIB_FILE:
+            mrt_file.unlink()
+
+
+def download_csv(url, file_name, force=False, session=None, chunk_size=1 << 16):
+    """Stream a CSV list into the downloads directory.
+
+    An existing file is kept unless force is set. When forced, the request is
+    made conditional on the ETag/Last-Modified of the previous download so
+    an unchanged list is not transferred again. The body is written in
+    chunks to a temporary file that replaces the old one once complete.
+    Returns True if a new file was written.
+    """
     file_path = DOWNLOADS_DIR / file_name
     if file_path.is_file() and not force:
-        return  # TODO: throw error?
-    with open(file_path, "w") as out:
-        out.write(req.text)
+        return False
+    meta_path = file_path.with_suffix(".meta.json")
+    headers = {}
+    if file_path.is_file() and meta_path.is_file():
+        meta = json.loads(meta_path.read_text())
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+    DOWNLOADS_DIR.mkdir(exist_ok=True)
+    session = session or SESSION
+    with session.get(url, headers=headers, stream=True, timeout=(10, 60)) as req:
+        if req.status_code == 304:
+            return False
+        req.raise_for_status()
+        total = int(req.headers.get("Content-Length", 0)) or None
+        done = 0
+        with NamedTemporaryFile(
+            "wb", dir=DOWNLOADS_DIR, prefix=file_name, suffix=".part", delete=False
+        ) as out:
+            try:
+                for chunk in req.iter_content(chunk_size):
+                    out.write(chunk)
+                    done += len(chunk)
+                    report_progress(bytes=done, total_bytes=total)
+            except:
+                out.close()
+                Path(out.name).unlink()
+                raise
+        Path(out.name).replace(file_path)
+        meta_path.write_text(
+            json.dumps(
+                {
+                    "etag": req.headers.get("ETag"),
+                    "last_modified": req.headers.get("Last-Modified"),
+                }
+            )
+        )
+    return True
 
 
-def download_global(force=False):
-    download_csv(
-        "https://quarry.wmcloud.org/query/65222/result/latest/0/csv",
+def download_global(force=True):
+    return download_csv(
+        getattr(
+            settings,
+            "HAMMER_GLOBAL_LIST_URL",
+            "https://quarry.wmcloud.org/query/65222/result/latest/0/csv",
+        ),
         "global_list.csv",
         force,
     )
 
 
-def download_enwiki(force=False):
-    download_csv(
-        "https://quarry.wmcloud.org/query/65223/result/latest/0/csv",
+def download_enwiki(force=True):
+    return download_csv(
+        getattr(
+            settings,
+            "HAMMER_ENWIKI_LIST_URL",
+            "https://quarry.wmcloud.org/query/65223/result/latest/0/csv",
+        ),
         "enwiki_list.csv",
         force,
     )
 
 
-def upsert_asn(number, desc):
-    try:
-        asn = ASN.objects.get(asn=number)
-    except ASN.DoesNotExist:
-        asn = ASN(asn=number, description=desc)
-        asn.save()
-    return asn
+def reconcile_block_list(source=None):
+    """Mark stored ranges covered by the global block list as blocked.
+
+    Parameters
+    ----------
+    source : str or Path (optional)
+        Local dump of blocked ranges, or an http(s) URL to download it from,
+        one address or CIDR in the first column of each line. Defaults to
+        settings.HAMMER_BLOCK_LIST_SOURCE.
+    """
+    if source is None:
+        source = getattr(settings, "HAMMER_BLOCK_LIST_SOURCE", None)
+    if source is None:
+        raise ValueError("HAMMER_BLOCK_LIST_SOURCE is not configured")
+    if str(source).startswith(("http://", "https://")):
+        download_csv(source, "block_list.csv", force=True)
+        source = DOWNLOADS_DIR / "block_list.csv"
+    with open(source, newline="", encoding="utf-8") as in_file:
+        return reconcile.reconcile_blocks(in_file)
+
 
+def add_range(address, check_reason, asndb=asn_service):
+    """Validate and store a single range, unless it is stored already.
 
-# TODO: range consolidation on insert
-def add_range(address, check_reason, asndb):
+    The range goes through ingest.write_chunk like a batch of one, so every
+    other ASN announcing part of it is recorded too, and it is dropped if a
+    stored range already covers it. Returns the number of new IPRange rows.
+    """
     validate_ip_range(address)
     net = ipaddress.ip_network(address, strict=False)
-    # TODO: range may exceede allocation
-    as_number = str(asndb.lookup(net.network_address.compressed)[0])
-    if as_number == "None":
-        asn_model = None
-    else:
-        asn_model = upsert_asn(as_number, None)
-    try:
-        IPRange.objects.get(
-            range_start=net.network_address.packed,
-            range_end=net.broadcast_address.packed,
-        )
-        return  # Exists in database, move on to next
-    except:
-        range_model = IPRange(
-            address=net.compressed,
-            range_start=net.network_address.packed,
-            range_end=net.broadcast_address.packed,
-            asn=asn_model,
-            check_reason=check_reason,
-        )
-        range_model.save()
+    return ingest.write_chunk([(net, check_reason)], asndb)
 
 
-def load_csv(source):
-    if source == "enwiki":
-        csvfile = DOWNLOADS_DIR / "enwiki_list.csv"
-    elif source == "global":
-        csvfile = DOWNLOADS_DIR / "global_list.csv"
-    else:
+def load_csv(source, batched=True, full=False, workers=None):
+    """Load a downloaded list into the database.
+
+    Only rows added since the previous load are ingested, and ranges holding
+    rows that disappeared from the list are flagged as delisted. With full
+    set, or on the first load, every row is ingested; removed rows are still
+    delisted. With batched set to False, each row is added through add_range
+    instead of the chunked ingestion engine.
+
+    Batched loads parse the list in worker processes; workers defaults to
+    settings.HAMMER_PARSE_PROCESSES, or the number of CPUs.
+    """
+    if source not in LIST_SOURCES:
         raise ValueError("Can't load a csv from a source that is not enwiki or global")
-    asndb = pyasn(str(DOWNLOADS_DIR / "asn.dat"))
-    with csvfile.open() as in_file:
-        reader = csv.reader(in_file)
-        next(reader)  # Discard headers
-        for row in reader:
-            if len(row) == 2:
-                add_range(row[0], row[1], asndb)
+    csvfile = DOWNLOADS_DIR / f"{source}_list.csv"
+    fingerprint_file = DOWNLOADS_DIR / f"{source}_list.fp"
+    networks_file = DOWNLOADS_DIR / f"{source}_list.nets"
+    previous_networks = snapshot.ListNetworks.load(networks_file)
+    # Lists fingerprinted before networks were recorded are read in full once
+    delta = snapshot.ListDelta(
+        snapshot.Fingerprint.load(fingerprint_file),
+        full or previous_networks is None,
+    )
+    if batched:
+        if workers is None:
+            workers = getattr(settings, "HAMMER_PARSE_PROCESSES", None)
+        ingest.load_pairs(
+            parallel_parse.parse_csv(
+                csvfile,
+                delta,
+                None if delta.full else fingerprint_file,
+                workers,
+            )
+        )
+    else:
+        with csvfile.open(encoding="utf-8") as in_file:
+            reader = csv.reader(in_file)
+            next(reader)  # Discard headers
+            for row in delta.filter(reader):
+                add_range(row[0], row[1])
+    networks = delta.networks(previous_networks)
+    if previous_networks is not None:
+        # A list last loaded before networks were recorded protects none of
+        # its ranges here; its next load is full and lists them again
+        others = [
+            snapshot.ListNetworks.load(DOWNLOADS_DIR / f"{other}_list.nets")
+            for other in LIST_SOURCES
+            if other != source
+        ]
+        snapshot.mark_delisted(
+            previous_networks.select(delta.removed()),
+            [networks, *(other for other in others if other is not None)],
+        )
+    snapshot.clear_delisted(snapshot.ListNetworks(delta.added))
+    delta.current().save(fingerprint_file)
+    networks.save(networks_file)
 
 
 def load_enwiki():
@@ -121,6 +376,33 @@ def load_global():
     load_csv("global")
 
 
+def refresh_all(source=None):
+    """Fetch the RIB and both lists at once, then update the ASNs and load.
+
+    The downloads run on a thread pool. The RIB is parsed as soon as it
+    arrives, while the lists are still downloading, and the lists are then
+    loaded straight away. A list is only reloaded if it changed or was
+    never loaded. source is as for update_asn_db.
+    """
+    downloaders = {"enwiki": download_enwiki, "global": download_global}
+    with ThreadPoolExecutor(max_workers=1 + len(LIST_SOURCES)) as pool:
+        rib = pool.submit(fetch_rib, source)
+        lists = {name: pool.submit(downloaders[name]) for name in LIST_SOURCES}
+        mrt_file = rib.result()
+        if mrt_file is not None:
+            report_progress(stage="asn database")
+            try:
+                rebuild_asn_db(mrt_file)
+            finally:
+                if mrt_file == DOWNLOADS_DIR / RIB_FILE:
+                    mrt_file.unlink()
+        for name, download in lists.items():
+            changed = download.result()
+            if changed or not (DOWNLOADS_DIR / f"{name}_list.fp").is_file():
+                report_progress(stage=f"{name} list")
+                load_csv(name)
+
+
 def get_status():
     asnfile = DOWNLOADS_DIR / "asn.dat"
     enwiki_file = DOWNLOADS_DIR / "enwiki_list.csv"
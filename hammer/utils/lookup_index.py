@@ -0,0 +1,307 @@
+"""In-memory answers to the JSON lookup API.
+
+Which ranges contain an address comes from range_index; this module keeps,
+next to it, the address and review state of every range and the number and
+status of every ASN, so a lookup never touches the database.
+
+Writes made through the ORM in this process are applied as they are saved.
+Bulk updates and writes from other processes all set last_updated, so every
+refresh_interval seconds the rows updated since the previous refresh are
+read back. Deletes are noticed through the range counters: once the index
+holds a different number of ranges than are counted, beyond the difference
+when it was built, it is reloaded. A full reload every rebuild_interval
+seconds catches anything else.
+
+Refreshes and reloads run on a background thread, which builds the new
+data and swaps it in, ranges and rows together. Lookups keep answering
+from the current data meanwhile; only lookups before the first load wait
+for it.
+"""
+
+import ipaddress
+import time
+from datetime import timedelta
+from threading import Lock, RLock, Thread
+from django.db import connection
+from django.db.models.signals import post_delete, post_save
+from django.utils import timezone
+from hammer.models import ASN, KEY_FIELDS, IPRange
+from hammer.utils.range_index import counted_ranges, range_index
+
+# Rows are re-read from this long before the previous refresh, so writes
+# committed after it by transactions that started earlier are not missed
+REFRESH_OVERLAP = timedelta(seconds=30)
+RANGE_FIELDS = ("id", "address", "asn_id", "scheduled", "blocked")
+STATUS_NAMES = {status.value: status.name.lower() for status in ASN.Status}
+
+
+class LookupIndex:  # pylint: disable=too-many-instance-attributes
+    """Address, state and ASN of each stored range, by range id."""
+
+    def __init__(
+        self,
+        ranges=range_index,
+        refresh_interval=5.0,
+        rebuild_interval=900.0,
+        background=True,
+    ):
+        """
+        Parameters
+        ----------
+        ranges : RangeIndex
+            Index answering which ranges contain an address.
+        refresh_interval : float
+            Seconds between reads of the rows updated since the last one.
+        rebuild_interval : float
+            Seconds between full reloads from the database.
+        background : bool
+            Whether lookups refresh the index on a background thread, or
+            on their own thread as tests need to see their transaction.
+        """
+        self.ranges = ranges
+        self.refresh_interval = refresh_interval
+        self.rebuild_interval = rebuild_interval
+        self.background = background
+        self._lock = RLock()
+        # Held while refreshing or reloading, so only one thread does it
+        self._refresh_lock = Lock()
+        # Guards starting the background thread
+        self._worker_lock = Lock()
+        self._worker = None
+        self._clear()
+
+    def _clear(self):
+        self._loaded = False
+        # range id -> (address, asn id, scheduled, blocked)
+        self._rows = {}
+        # asn id -> (AS number, status name)
+        self._asns = {}
+        self._since = None
+        self._checked = self._built = 0.0
+        # Indexed ranges minus counted ranges when the index was built
+        self._surplus = 0
+
+    def __len__(self):
+        return len(self._rows)
+
+    @property
+    def loaded(self):
+        """True once the rows and the range index are both loaded."""
+        return self._loaded and self.ranges.loaded
+
+    def rebuild(self):
+        """Reload every range and ASN from the database."""
+        with self._refresh_lock:
+            self._rebuild()
+
+    def _rebuild(self):
+        since = timezone.now() - REFRESH_OVERLAP
+        ranges = self.ranges.load()
+        rows = {
+            range_id: tuple(state)
+            for range_id, *state in IPRange.objects.values_list(*RANGE_FIELDS).iterator(
+                chunk_size=5000
+            )
+        }
+        asns = self._asn_states(ASN.objects.all())
+        total = counted_ranges()
+        with self._lock:
+            self.ranges.install(ranges)
+            self._rows = rows
+            self._asns = asns
+            self._since = since
+            self._surplus = len(rows) - total
+            self._checked = self._built = time.monotonic()
+            self._loaded = True
+
+    @staticmethod
+    def _asn_states(queryset):
+        return {
+            asn_id: (number, STATUS_NAMES[status])
+            for asn_id, number, status in queryset.values_list(
+                "id", "asn", "asn_status"
+            ).iterator(chunk_size=5000)
+        }
+
+    def invalidate(self):
+        """Drop the index so the next lookup reloads it from the database."""
+        with self._lock:
+            self._clear()
+
+    def _due(self):
+        now = time.monotonic()
+        return (
+            now - self._checked >= self.refresh_interval
+            or now - self._built >= self.rebuild_interval
+        )
+
+    def refresh(self, force=False):
+        """Load the index, or read back the rows changed since the last refresh.
+
+        Runs on the calling thread. Only the first load makes other threads
+        wait; while a refresh or reload runs, other threads return at once.
+        """
+        if self.loaded and not force and not self._due():
+            return
+        # pylint: disable-next=consider-using-with
+        if not self._refresh_lock.acquire(blocking=not self.loaded):
+            return
+        try:
+            if (
+                not self.loaded
+                or time.monotonic() - self._built >= self.rebuild_interval
+            ):
+                self._rebuild()
+            elif force or self._due():
+                self._read_changes()
+        finally:
+            self._refresh_lock.release()
+
+    def _read_changes(self):
+        since = timezone.now() - REFRESH_OVERLAP
+        # Ranges committed while the rows are read are counted in after but
+        # maybe not in before, so only a count outside both is a delete
+        before = counted_ranges()
+        rows = IPRange.objects.filter(last_updated__gte=self._since).values_list(
+            *RANGE_FIELDS, *KEY_FIELDS
+        )
+        updated = {}
+        keys = []
+        for range_id, address, asn_id, scheduled, blocked, *fields in rows.iterator(
+            chunk_size=5000
+        ):
+            updated[range_id] = (address, asn_id, scheduled, blocked)
+            keys.append((range_id, *fields))
+        asns = self._asn_states(ASN.objects.filter(last_updated__gte=self._since))
+        after = counted_ranges()
+        with self._lock:
+            # Only new rows and rows whose bounds changed are inserted
+            self.ranges.add_many(keys)
+            self._rows.update(updated)
+            self._asns.update(asns)
+            self._since = since
+        self._checked = time.monotonic()
+        if not before <= len(self._rows) - self._surplus <= after:
+            # Ranges were deleted elsewhere
+            self._rebuild()
+
+    def _start_refresh(self):
+        """Start a refresh on a background thread unless one is running.
+
+        Returns the thread.
+        """
+        with self._worker_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = Thread(
+                    target=self._refresh_in_background,
+                    name="lookup-index-refresh",
+                    daemon=True,
+                )
+                self._worker.start()
+            return self._worker
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        finally:
+            connection.close()
+
+    def _update(self):
+        """Load the index, or have it refreshed if it is due."""
+        if self.loaded and not self._due():
+            return
+        if not self.background:
+            self.refresh()
+        elif self.loaded:
+            self._start_refresh()
+        else:
+            self._start_refresh().join()
+            if not self.loaded:
+                raise RuntimeError("The lookup index could not be loaded")
+
+    def update_range(self, instance):
+        """Store the state of a saved IPRange if the index is loaded."""
+        if self._loaded:
+            with self._lock:
+                self._rows[instance.id] = tuple(
+                    getattr(instance, field) for field in RANGE_FIELDS[1:]
+                )
+
+    def update_asn(self, instance):
+        """Store the number and status of a saved ASN if the index is loaded."""
+        if self._loaded:
+            with self._lock:
+                self._asns[instance.id] = (
+                    instance.asn,
+                    STATUS_NAMES[instance.asn_status],
+                )
+
+    def remove(self, range_ids=(), asn_ids=()):
+        """Forget deleted ranges and ASNs."""
+        with self._lock:
+            for range_id in range_ids:
+                self._rows.pop(range_id, None)
+            for asn_id in asn_ids:
+                self._asns.pop(asn_id, None)
+
+    def lookup(self, address):
+        """Describe the stored ranges containing address, most specific first.
+
+        address is an ipaddress address or a string, which raises
+        ValueError if it is not a valid IP address.
+        """
+        if isinstance(address, str):
+            address = ipaddress.ip_address(address)
+        self._update()
+        found = []
+        with self._lock:
+            for range_id in self.ranges.containing(address, refresh=False):
+                row = self._rows.get(range_id)
+                if row is None:
+                    continue
+                network, asn_id, scheduled, blocked = row
+                number, status = self._asns.get(asn_id, (None, None))
+                found.append(
+                    {
+                        "id": range_id,
+                        "address": network,
+                        "asn": number,
+                        "asn_status": status,
+                        "scheduled": scheduled,
+                        "blocked": blocked,
+                    }
+                )
+        return {
+            "ip": str(address),
+            "listed": bool(found),
+            "blocked": any(row["blocked"] for row in found),
+            "asn_banned": any(row["asn_status"] == "banned" for row in found),
+            "ranges": found,
+        }
+
+
+lookup_index = LookupIndex()
+
+
+def _range_saved(instance, **_kwargs):
+    lookup_index.update_range(instance)
+
+
+def _range_deleted(instance, **_kwargs):
+    lookup_index.remove(range_ids=[instance.id])
+
+
+def _asn_saved(instance, **_kwargs):
+    lookup_index.update_asn(instance)
+
+
+def _asn_deleted(instance, **_kwargs):
+    lookup_index.remove(asn_ids=[instance.id])
+
+
+post_save.connect(_range_saved, sender=IPRange, dispatch_uid="lookup_index_range_save")
+post_delete.connect(
+    _range_deleted, sender=IPRange, dispatch_uid="lookup_index_range_delete"
+)
+post_save.connect(_asn_saved, sender=ASN, dispatch_uid="lookup_index_asn_save")
+post_delete.connect(_asn_deleted, sender=ASN, dispatch_uid="lookup_index_asn_delete")
@@ -0,0 +1,186 @@
+"""Response caching keyed on version stamps.
+
+A stamp is a counter in the cache that writers bump when the data behind
+a group of pages changes: "ranges" for the range lists and f"asn:{asn_id}"
+for the ranges of one ASN. Cached pages include the current stamps in
+their key, so a bump makes every page built from the old data unreachable
+without having to find and delete it. Detail pages use the last_updated
+columns of the rows they show as their stamps instead.
+
+Every page also depends on the "all" stamp. With a process-local cache,
+writes made by job worker processes cannot bump the stamps seen by web
+processes, which would keep serving pages built before a load for as long
+as it runs. Pages are therefore only cached by default if the cache is
+shared or jobs run on threads; HAMMER_PAGE_CACHE turns caching on or off
+regardless. If it is forced on, the "all" stamp is bumped when a worker
+process job finishes.
+
+Hits and misses are counted in the cache so every process sharing it
+reports into the same totals. Only a sample of requests is counted, set by
+HAMMER_PAGE_METRICS_RATE, so most pages are served without a cache write.
+"""
+
+import hashlib
+import random
+from functools import wraps
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+PAGE_TIMEOUT = 300
+ALL = "all"
+RANGES = "ranges"
+METRICS = ("hit", "miss")
+
+
+def asn_stamp(asn_id):
+    """Return the name of the stamp of the ranges of one ASN."""
+    return f"asn:{asn_id}"
+
+
+def stamps(*names):
+    """Return the current value of each named stamp."""
+    keys = [f"hammer:stamp:{name}" for name in names]
+    values = cache.get_many(keys)
+    missing = {key: 1 for key in keys if key not in values}
+    if missing:
+        cache.set_many(missing, None)
+        values.update(missing)
+    return tuple(values[key] for key in keys)
+
+
+def bump(*names):
+    """Invalidate every page cached under the named stamps.
+
+    Inside a transaction the stamps are bumped once it commits, so no page
+    can be cached from data that is about to change.
+    """
+    names = set(names)
+    if names:
+        transaction.on_commit(lambda: _bump(names))
+
+
+def _bump(names):
+    for name in names:
+        key = f"hammer:stamp:{name}"
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
+
+
+def ranges_changed(asn_ids=()):
+    """Invalidate the range lists, and the lists of ranges of each ASN."""
+    bump(RANGES, *(asn_stamp(asn_id) for asn_id in asn_ids))
+
+
+def process_local():
+    """True if the cache is not shared with other processes."""
+    return isinstance(caches["default"], LocMemCache)
+
+
+def enabled():
+    """True if pages are cached, from HAMMER_PAGE_CACHE.
+
+    Defaults to false when the cache is process-local and jobs run in
+    worker processes, whose writes would leave cached pages stale.
+    """
+    setting = getattr(settings, "HAMMER_PAGE_CACHE", None)
+    if setting is not None:
+        return setting
+    executor = getattr(settings, "HAMMER_JOB_EXECUTOR", "process")
+    return not (process_local() and executor == "process")
+
+
+def invalidate_all():
+    """Invalidate every cached page."""
+    bump(ALL)
+
+
+def metrics_rate():
+    """Return the fraction of requests counted, from HAMMER_PAGE_METRICS_RATE."""
+    return getattr(settings, "HAMMER_PAGE_METRICS_RATE", 0.01)
+
+
+def _count(metric):
+    if random.random() >= metrics_rate():
+        return
+    key = f"hammer:metrics:{metric}"
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, None)
+
+
+def metrics():
+    """Return the page cache hits, misses and hit rate since the last reset.
+
+    Hits and misses are estimated from the sample of requests counted.
+    """
+    values = cache.get_many([f"hammer:metrics:{metric}" for metric in METRICS])
+    hit, miss = (values.get(f"hammer:metrics:{metric}", 0) for metric in METRICS)
+    rate = metrics_rate()
+    return {
+        "hit": round(hit / rate) if rate else 0,
+        "miss": round(miss / rate) if rate else 0,
+        "hit_rate": hit / (hit + miss) if hit + miss else None,
+    }
+
+
+def reset_metrics():
+    """Set the page cache hit and miss counts back to zero."""
+    cache.delete_many([f"hammer:metrics:{metric}" for metric in METRICS])
+
+
+def cached_page(get_stamps, timeout=PAGE_TIMEOUT):
+    """Cache the GET responses of a view for each session and set of stamps.
+
+    get_stamps is called with the view's arguments and returns the stamp
+    values the page depends on, or None if it should not be cached.
+    Responses are cached per session because pages embed the user's name
+    and CSRF token.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if (
+                request.method != "GET"
+                or not request.session.session_key
+                or not enabled()
+            ):
+                return view(request, *args, **kwargs)
+            values = get_stamps(request, *args, **kwargs)
+            if values is None:
+                return view(request, *args, **kwargs)
+            key = (
+                "hammer:page:"
+                + hashlib.md5(
+                    repr(
+                        (
+                            request.session.session_key,
+                            request.get_full_path(),
+                            stamps(ALL) + tuple(values),
+                        )
+                    ).encode()
+                ).hexdigest()
+            )
+            response = cache.get(key)
+            if response is not None:
+                _count("hit")
+                return response
+            _count("miss")
+            response = view(request, *args, **kwargs)
+            if response.status_code == 200 and not response.streaming:
+                if hasattr(response, "render") and callable(response.render):
+                    response.add_post_render_callback(
+                        lambda rendered: cache.set(key, rendered, timeout)
+                    )
+                else:
+                    cache.set(key, response, timeout)
+            return response
+
+        return wrapper
+
+    return decorator
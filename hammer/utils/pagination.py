@@ -0,0 +1,109 @@
+"""Keyset pagination of range lists.
+
+Pages are addressed by the id of the row they start after (or end before)
+rather than by number, so every page is a single indexed range scan and
+no page needs a COUNT(*) or an OFFSET.
+"""
+
+from django.core.cache import cache
+
+COUNT_TIMEOUT = 60
+
+
+def cached_count(queryset, key, timeout=COUNT_TIMEOUT):
+    """Return the number of rows of queryset, counted at most every timeout seconds."""
+    key = f"hammer:count:{key}"
+    count = cache.get(key)
+    if count is None:
+        count = queryset.count()
+        cache.set(key, count, timeout)
+    return count
+
+
+class KeysetPage:
+    """One page of a KeysetPaginator, iterable like a Django Page."""
+
+    def __init__(self, object_list, has_previous, has_next, count=None):
+        self.object_list = object_list
+        self.has_previous = has_previous
+        self.has_next = has_next
+        self.count = count
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    @property
+    def previous_cursor(self):
+        """Cursor of the page before this one."""
+        return self.object_list[0].id if self.object_list else None
+
+    @property
+    def next_cursor(self):
+        """Cursor of the page after this one."""
+        return self.object_list[-1].id if self.object_list else None
+
+
+class KeysetPaginator:
+    """Pages through a queryset in id order."""
+
+    def __init__(self, queryset, per_page=50, count_key=None):
+        """
+        Parameters
+        ----------
+        queryset : QuerySet
+            Rows to page through; any ordering is replaced by id.
+        per_page : int
+            Number of rows on each page.
+        count_key : str
+            If given, pages carry an approximate row count cached under
+            this key.
+        """
+        self.queryset = queryset
+        self.per_page = per_page
+        self.count_key = count_key
+
+    def get_page(self, after=None, before=None, last=False):
+        """Return the page after or before a cursor, or the first or last page.
+
+        Cursors that are not integers are ignored.
+        """
+        after, before = _cursor(after), _cursor(before)
+        limit = self.per_page + 1
+        if before is not None or last:
+            queryset = self.queryset
+            if before is not None:
+                queryset = queryset.filter(id__lt=before)
+            rows = list(queryset.order_by("-id")[:limit])
+            has_previous = len(rows) > self.per_page
+            rows = rows[: self.per_page][::-1]
+            has_next = not last
+        else:
+            queryset = self.queryset
+            if after is not None:
+                queryset = queryset.filter(id__gt=after)
+            rows = list(queryset.order_by("id")[:limit])
+            has_next = len(rows) > self.per_page
+            rows = rows[: self.per_page]
+            has_previous = after is not None
+        count = None
+        if self.count_key is not None:
+            count = cached_count(self.queryset, self.count_key)
+        return KeysetPage(rows, has_previous, has_next, count)
+
+    def page_from_request(self, request):
+        """Return the page selected by the after, before or last GET parameters."""
+        return self.get_page(
+            request.GET.get("after"),
+            request.GET.get("before"),
+            "last" in request.GET,
+        )
+
+
+def _cursor(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
@@ -0,0 +1,114 @@
+"""Parse large range lists in worker processes.
+
+The CSV is split into shards at line boundaries by byte offset. Each worker
+fingerprints, filters and validates the rows of one shard and sends back
+only compact integers: the row keys, and (key, version, start, prefixlen,
+check_reason) for each valid range that is new since the previous load.
+Shards are consumed in file order by a single writer.
+
+Rows must not contain line breaks inside quoted fields.
+"""
+
+import csv
+import io
+import os
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from multiprocessing import current_process, get_context
+import django
+from hammer.utils.ingest import parse_network
+from hammer.utils.range_index import NETWORK_CLASSES
+from hammer.utils.snapshot import Fingerprint, row_key
+
+# Large enough that per-shard overhead is negligible, small enough that the
+# writer can start while workers are still busy
+SHARD_SIZE = 1 << 20
+
+
+def shard_offsets(path, shard_size=SHARD_SIZE):
+    """Return (start, end) byte offsets covering every line after the header."""
+    offsets = []
+    with open(path, "rb") as in_file:
+        in_file.readline()  # Discard headers
+        start = in_file.tell()
+        size = os.fstat(in_file.fileno()).st_size
+        while start < size:
+            in_file.seek(min(start + shard_size, size))
+            in_file.readline()
+            end = in_file.tell()
+            offsets.append((start, end))
+            start = end
+    return offsets
+
+
+# The modification time only keys the cache, so a rewritten file is read again
+@lru_cache(maxsize=4)
+def _load_fingerprint(path, _mtime):
+    return Fingerprint.load(path)
+
+
+def parse_shard(path, start, end, fingerprint_path=None):
+    """Parse the rows between two byte offsets of a CSV list.
+
+    Rows whose key is in the fingerprint at fingerprint_path are skipped.
+    Returns (keys, ranges) where keys holds the key of every row and ranges
+    (key, version, start, prefixlen, check_reason) for each new row that is
+    a valid range.
+    """
+    previous = None
+    if fingerprint_path is not None:
+        previous = _load_fingerprint(
+            fingerprint_path, os.stat(fingerprint_path).st_mtime_ns
+        )
+    with open(path, "rb") as in_file:
+        in_file.seek(start)
+        text = in_file.read(end - start).decode("utf-8")
+    keys = array("Q")
+    ranges = []
+    for row in csv.reader(io.StringIO(text, newline="")):
+        if len(row) != 2:
+            continue
+        key = row_key(row[0])
+        keys.append(key)
+        if previous is not None and key in previous:
+            continue
+        net = parse_network(row[0])
+        if net is not None:
+            ranges.append(
+                (key, net.version, int(net.network_address), net.prefixlen, row[1])
+            )
+    return keys, ranges
+
+
+def parse_csv(path, delta, fingerprint_path=None, workers=None, shard_size=SHARD_SIZE):
+    """Yield (network, check_reason) pairs for the new rows of a CSV list.
+
+    Shards are parsed by a pool of worker processes, skipping rows in the
+    fingerprint saved at fingerprint_path. Row keys and new networks are
+    recorded on delta exactly as ListDelta.filter would. A daemonic process,
+    which may not start children, parses the shards itself.
+    """
+    offsets = shard_offsets(path, shard_size)
+    if not offsets:
+        return
+    workers = min(workers or os.cpu_count(), len(offsets))
+    tasks = zip(*((path, start, end, fingerprint_path) for start, end in offsets))
+    if workers <= 1 or current_process().daemon:
+        yield from _collect(delta, map(parse_shard, *tasks))
+        return
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=get_context("spawn"),
+        initializer=django.setup,
+    ) as pool:
+        yield from _collect(delta, pool.map(parse_shard, *tasks))
+
+
+def _collect(delta, results):
+    for keys, ranges in results:
+        delta.keys.extend(keys)
+        for key, version, start, prefixlen, reason in ranges:
+            net = NETWORK_CLASSES[version]((start, prefixlen))
+            delta.added.append((key, net))
+            yield net, reason
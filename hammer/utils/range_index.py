@@ -0,0 +1,388 @@
+"""In-process index answering IP containment and overlap queries.
+
+Addresses are normalised to fixed-width integer keys: IPv4 addresses keep
+their 32-bit value and IPv6 addresses are offset by 2**128, so every IPv4 key
+sorts before every IPv6 key and the two families never compare equal.
+Stored ranges are always CIDR networks, so the index keeps one sorted array of
+network start keys per (version, prefix length) and answers queries by
+bisecting each array.
+
+Writes made through the ORM in this process are applied as they are saved.
+Rows added by other processes are read back by id every refresh_interval
+seconds. Deletes, and the bounds rewritten when ranges are consolidated
+(which always deletes the merged rows), are noticed through the range
+counters: once the index holds a different number of ranges than are
+counted, beyond the difference when it was built, it is rebuilt.
+"""
+
+import ipaddress
+import time
+from bisect import bisect_left, bisect_right
+from threading import RLock
+from django.db.models.signals import post_delete, post_save
+from hammer.models import KEY_FIELDS, IPRange, join_key
+from hammer.utils import counters
+
+V6_OFFSET = 1 << 128
+# Larger batches are merged into the arrays in one pass instead of per row
+MERGE_THRESHOLD = 8
+BITS = {4: 32, 6: 128}
+NETWORK_CLASSES = {4: ipaddress.IPv4Network, 6: ipaddress.IPv6Network}
+
+
+def address_key(address):
+    """Return the fixed-width key of an ipaddress address object."""
+    if address.version == 6:
+        return int(address) + V6_OFFSET
+    return int(address)
+
+
+def row_bounds(version, start_hi, start_lo, end_hi, end_lo):
+    """Return the (start, end) keys of a range from its KEY_FIELDS values."""
+    offset = V6_OFFSET if version == 6 else 0
+    return join_key(start_hi, start_lo) + offset, join_key(end_hi, end_lo) + offset
+
+
+def key_version(key):
+    """Return the IP version a key belongs to."""
+    return 6 if key >= V6_OFFSET else 4
+
+
+def bounds_prefixlen(version, start, end):
+    """Return the prefix length of the CIDR network spanning start..end."""
+    return BITS[version] - (end - start + 1).bit_length() + 1
+
+
+def network_bounds(network):
+    """Return the (start, end) keys of an ipaddress network object."""
+    return address_key(network.network_address), address_key(network.broadcast_address)
+
+
+def counted_ranges():
+    """Return the number of ranges the range counters hold."""
+    return sum(counters.totals().values())
+
+
+def merge_sorted(starts, ids, pairs):
+    """Merge sorted (start, id) pairs into parallel sorted lists.
+
+    Returns new lists, built by copying slices of the old ones, so the cost
+    is one pass over them rather than one list.insert per pair.
+    """
+    merged_starts, merged_ids = [], []
+    prev = 0
+    for start, range_id in pairs:
+        pos = bisect_right(starts, start, prev)
+        merged_starts += starts[prev:pos]
+        merged_ids += ids[prev:pos]
+        merged_starts.append(start)
+        merged_ids.append(range_id)
+        prev = pos
+    merged_starts += starts[prev:]
+    merged_ids += ids[prev:]
+    return merged_starts, merged_ids
+
+
+def drop_positions(starts, ids, positions):
+    """Return copies of parallel lists without the given sorted positions."""
+    kept_starts, kept_ids = [], []
+    prev = 0
+    for pos in positions:
+        kept_starts += starts[prev:pos]
+        kept_ids += ids[prev:pos]
+        prev = pos + 1
+    kept_starts += starts[prev:]
+    kept_ids += ids[prev:]
+    return kept_starts, kept_ids
+
+
+class RangeIndex:  # pylint: disable=too-many-instance-attributes
+    """Sorted-array index of stored IPRange networks."""
+
+    def __init__(self, refresh_interval=5.0):
+        """Create an empty index.
+
+        Changes made by other processes are picked up at most every
+        refresh_interval seconds.
+        """
+        self.refresh_interval = refresh_interval
+        self.loaded = False
+        self._lock = RLock()
+        # (version, prefixlen) -> parallel sorted lists of start keys and ids
+        self._starts = {}
+        self._ids = {}
+        # id -> ((version, prefixlen), start)
+        self._entries = {}
+        self._max_id = 0
+        self._checked = 0.0
+        # Indexed ranges minus counted ranges when the index was built
+        self._surplus = 0
+
+    def _set(self, contents):
+        self._starts, self._ids, self._entries, self._surplus = contents
+        self._max_id = max(self._entries, default=0)
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _entry(fields):
+        start, end = row_bounds(*fields)
+        version = key_version(start)
+        return (version, bounds_prefixlen(version, start, end)), start
+
+    def _insert(self, range_id, *fields):
+        group, start = self._entry(fields)
+        if self._entries.get(range_id) == (group, start):
+            return
+        self._discard(range_id)
+        starts = self._starts.setdefault(group, [])
+        ids = self._ids.setdefault(group, [])
+        pos = bisect_right(starts, start)
+        starts.insert(pos, start)
+        ids.insert(pos, range_id)
+        self._entries[range_id] = (group, start)
+        self._max_id = max(self._max_id, range_id)
+
+    def _position(self, range_id):
+        group, start = self._entries[range_id]
+        starts, ids = self._starts[group], self._ids[group]
+        pos = bisect_left(starts, start)
+        while ids[pos] != range_id:
+            pos += 1
+        return group, pos
+
+    def _discard(self, range_id):
+        if range_id not in self._entries:
+            return
+        group, pos = self._position(range_id)
+        del self._starts[group][pos], self._ids[group][pos]
+        del self._entries[range_id]
+
+    def _discard_many(self, range_ids):
+        positions = {}
+        for range_id in range_ids:
+            if range_id in self._entries:
+                group, pos = self._position(range_id)
+                positions.setdefault(group, []).append(pos)
+        for group, found in positions.items():
+            self._starts[group], self._ids[group] = drop_positions(
+                self._starts[group], self._ids[group], sorted(found)
+            )
+        for range_id in range_ids:
+            self._entries.pop(range_id, None)
+
+    def _merge(self, entries):
+        changed = {
+            range_id: entry
+            for range_id, entry in entries
+            if self._entries.get(range_id) != entry
+        }
+        if not changed:
+            return
+        self._discard_many(
+            [range_id for range_id in changed if range_id in self._entries]
+        )
+        added = {}
+        for range_id, (group, start) in changed.items():
+            added.setdefault(group, []).append((start, range_id))
+        for group, pairs in added.items():
+            pairs.sort()
+            self._starts[group], self._ids[group] = merge_sorted(
+                self._starts.get(group, []), self._ids.get(group, []), pairs
+            )
+        self._entries.update(changed)
+        self._max_id = max(self._max_id, *changed)
+
+    def load(self):
+        """Read the whole index from the database, leaving this one unchanged.
+
+        Returns the contents for install.
+        """
+        rows = IPRange.objects.values_list("id", *KEY_FIELDS)
+        grouped = {}
+        entries = {}
+        for range_id, *fields in rows.iterator(chunk_size=5000):
+            group, start = self._entry(fields)
+            grouped.setdefault(group, []).append((start, range_id))
+            entries[range_id] = (group, start)
+        starts, ids = {}, {}
+        for group, pairs in grouped.items():
+            pairs.sort()
+            starts[group] = [start for start, _ in pairs]
+            ids[group] = [range_id for _, range_id in pairs]
+        return starts, ids, entries, len(entries) - counted_ranges()
+
+    def install(self, contents):
+        """Replace the whole index with contents returned by load."""
+        with self._lock:
+            self._set(contents)
+            self._checked = time.monotonic()
+            self.loaded = True
+
+    def rebuild(self):
+        """Reload the whole index from the database."""
+        self.install(self.load())
+
+    def invalidate(self):
+        """Drop the index so the next query reloads it from the database."""
+        with self._lock:
+            self._set(({}, {}, {}, 0))
+            self._checked = 0.0
+            self.loaded = False
+
+    def refresh(self, force=False):
+        """Load the index, or pick up changes made since the last refresh.
+
+        New rows are added; if ranges were deleted the index is rebuilt.
+        """
+        if not self.loaded:
+            self.rebuild()
+            return
+        if not force and time.monotonic() - self._checked < self.refresh_interval:
+            return
+        # Ranges committed while the new rows are read are counted in after
+        # but maybe not in before, so only a count outside both is a delete
+        before = counted_ranges()
+        rows = IPRange.objects.filter(id__gt=self._max_id).values_list(
+            "id", *KEY_FIELDS
+        )
+        self.add_many(rows)
+        after = counted_ranges()
+        self._checked = time.monotonic()
+        if not before <= len(self) - self._surplus <= after:
+            self.rebuild()
+
+    def add_many(self, rows):
+        """Insert or move rows of id and KEY_FIELDS if the index is loaded.
+
+        Rows whose bounds did not change are skipped.
+        """
+        if not self.loaded:
+            return
+        rows = list(rows)
+        if len(rows) > MERGE_THRESHOLD:
+            # Unchanged rows are filtered out before taking the lock lookups
+            # need; _merge checks the rest again under it
+            entries = [(row[0], self._entry(row[1:])) for row in rows]
+            entries = [
+                (range_id, entry)
+                for range_id, entry in entries
+                if self._entries.get(range_id) != entry
+            ]
+            if entries:
+                with self._lock:
+                    self._merge(entries)
+        else:
+            with self._lock:
+                for row in rows:
+                    self._insert(*row)
+
+    def remove_many(self, range_ids):
+        """Drop ranges from the index."""
+        range_ids = list(range_ids)
+        with self._lock:
+            if len(range_ids) > MERGE_THRESHOLD:
+                self._discard_many(range_ids)
+            else:
+                for range_id in range_ids:
+                    self._discard(range_id)
+
+    def containing(self, address, refresh=True):
+        """Return ids of stored ranges containing address, most specific first.
+
+        With refresh false the index is used as it is, without loading or
+        refreshing it first.
+        """
+        if isinstance(address, str):
+            address = ipaddress.ip_address(address)
+        key = address_key(address)
+        bits = BITS[address.version]
+        if refresh:
+            self.refresh()
+        found = []
+        with self._lock:
+            for (version, prefixlen), starts in self._starts.items():
+                if version != address.version:
+                    continue
+                host_bits = bits - prefixlen
+                start = key >> host_bits << host_bits
+                pos = bisect_left(starts, start)
+                if pos < len(starts) and starts[pos] == start:
+                    found.append((prefixlen, self._ids[(version, prefixlen)][pos]))
+        found.sort(reverse=True)
+        return [range_id for _, range_id in found]
+
+    def covering(self, network):
+        """Return ids of stored ranges that contain all of network."""
+        if isinstance(network, str):
+            network = ipaddress.ip_network(network, strict=False)
+        found = []
+        for range_id in self.containing(network.network_address):
+            entry = self._entries.get(range_id)
+            if entry is not None and entry[0][1] <= network.prefixlen:
+                found.append(range_id)
+        return found
+
+    def overlapping(self, network):
+        """Return ids of stored ranges that overlap network."""
+        if isinstance(network, str):
+            network = ipaddress.ip_network(network, strict=False)
+        start, end = network_bounds(network)
+        bits = BITS[network.version]
+        self.refresh()
+        found = []
+        with self._lock:
+            for (version, prefixlen), starts in self._starts.items():
+                if version != network.version:
+                    continue
+                ids = self._ids[(version, prefixlen)]
+                if prefixlen <= network.prefixlen:
+                    # Only the one supernet at this length can overlap
+                    host_bits = bits - prefixlen
+                    supernet = start >> host_bits << host_bits
+                    pos = bisect_left(starts, supernet)
+                    if pos < len(starts) and starts[pos] == supernet:
+                        found.append(ids[pos])
+                else:
+                    low = bisect_left(starts, start)
+                    high = bisect_right(starts, end)
+                    found.extend(ids[low:high])
+        return found
+
+
+range_index = RangeIndex()
+
+
+def ranges_containing(address):
+    """Return a queryset of IPRanges containing address, most specific first.
+
+    The ranges are found in range_index; the queryset only fetches them by id.
+    """
+    return IPRange.objects.filter(id__in=range_index.containing(address)).order_by(
+        "-start_hi", "-start_lo", "end_hi", "end_lo"
+    )
+
+
+def ranges_overlapping(network):
+    """Return a queryset of IPRanges overlapping network, in address order.
+
+    The ranges are found in range_index; the queryset only fetches them by id.
+    """
+    return IPRange.objects.filter(id__in=range_index.overlapping(network)).order_by(
+        "start_hi", "start_lo", "-end_hi", "-end_lo"
+    )
+
+
+def _index_range(instance, **_kwargs):
+    range_index.add_many(
+        [(instance.id, *(getattr(instance, field) for field in KEY_FIELDS))]
+    )
+
+
+def _unindex_range(instance, **_kwargs):
+    range_index.remove_many([instance.id])
+
+
+post_save.connect(_index_range, sender=IPRange, dispatch_uid="range_index_save")
+post_delete.connect(_unindex_range, sender=IPRange, dispatch_uid="range_index_delete")
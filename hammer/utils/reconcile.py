@@ -0,0 +1,127 @@
+"""Marking stored ranges as blocked from a dump of the global block list.
+
+The dump is reduced to sorted, disjoint intervals per IP version. Stored
+ranges are then streamed in address order and merge-joined against them,
+so every range and every interval is visited once.
+"""
+
+import csv
+import ipaddress
+import time
+from array import array
+from collections import Counter
+from django.db import transaction
+from django.utils import timezone
+from hammer.models import KEY_FIELDS, IPRange, join_key
+from hammer.utils import counters
+from hammer.utils.jobs import report_progress
+from hammer.utils.range_index import BITS
+
+BATCH_SIZE = 900
+CHUNK_SIZE = 5000
+
+
+def read_blocks(lines):
+    """Return sorted, disjoint (starts, ends) intervals per IP version.
+
+    lines are CSV rows whose first column is a blocked address or CIDR;
+    anything else, such as headers and comments, is skipped. Overlapping
+    and adjacent blocks are merged, so a range covered by several blocks
+    together falls inside a single interval.
+    """
+    blocks = {4: [], 6: []}
+    for row in csv.reader(lines):
+        if not row:
+            continue
+        try:
+            net = ipaddress.ip_network(row[0].strip(), strict=False)
+        except ValueError:
+            continue
+        start = int(net.network_address)
+        blocks[net.version].append((start, start + net.num_addresses - 1))
+    intervals = {}
+    for version, items in blocks.items():
+        items.sort()
+        column = (lambda: array("Q")) if version == 4 else list
+        starts, ends = column(), column()
+        for start, end in items:
+            if ends and start <= ends[-1] + 1:
+                if end > ends[-1]:
+                    ends[-1] = end
+            else:
+                starts.append(start)
+                ends.append(end)
+        intervals[version] = (starts, ends)
+    return intervals
+
+
+def contained(ranges, starts, ends):
+    """Yield the items of ranges lying entirely inside one interval.
+
+    ranges yields (start, end, item) sorted by start; starts and ends are
+    sorted, disjoint intervals as returned by read_blocks.
+    """
+    pos, count = 0, len(starts)
+    for start, end, item in ranges:
+        while pos < count and ends[pos] < start:
+            pos += 1
+        if pos == count:
+            return
+        if starts[pos] <= start and end <= ends[pos]:
+            yield item
+
+
+def _stored_ranges(version):
+    rows = (
+        IPRange.objects.filter(blocked=False, ip_version=version)
+        .order_by("start_hi", "start_lo")
+        .values_list(*KEY_FIELDS[1:], "id", "asn_id", "scheduled")
+        .iterator(chunk_size=CHUNK_SIZE)
+    )
+    for start_hi, start_lo, end_hi, end_lo, range_id, asn_id, scheduled in rows:
+        yield (
+            join_key(start_hi, start_lo),
+            join_key(end_hi, end_lo),
+            (range_id, asn_id, scheduled),
+        )
+
+
+def _mark_blocked(batch):
+    deltas = Counter()
+    for _, asn_id, scheduled in batch:
+        deltas[asn_id, counters.range_state(scheduled, False)] -= 1
+        deltas[asn_id, counters.State.BLOCKED] += 1
+    with transaction.atomic():
+        IPRange.objects.filter(id__in=[range_id for range_id, _, _ in batch]).update(
+            blocked=True, scheduled=False, last_updated=timezone.now()
+        )
+        counters.adjust(deltas)
+
+
+def reconcile_blocks(lines):
+    """Mark every stored range covered by the block list in lines as blocked.
+
+    Returns a dict with the number of block list intervals, newly blocked
+    ranges and the time taken.
+    """
+    started = time.perf_counter()
+    intervals = read_blocks(lines)
+    count = sum(len(starts) for starts, _ in intervals.values())
+    report_progress(intervals=count)
+    # Collect matches before writing, so no update races the open cursor
+    matches = [
+        item
+        for version in BITS
+        for item in contained(_stored_ranges(version), *intervals[version])
+    ]
+    blocked = 0
+    for pos in range(0, len(matches), BATCH_SIZE):
+        batch = matches[pos : pos + BATCH_SIZE]
+        _mark_blocked(batch)
+        blocked += len(batch)
+        report_progress(rows=blocked)
+    return {
+        "intervals": count,
+        "blocked": blocked,
+        "seconds": time.perf_counter() - started,
+    }
@@ -0,0 +1,296 @@
+"""Fingerprints of downloaded lists, used to ingest only rows that changed.
+
+A fingerprint is the sorted set of 64-bit hashes of every row key (the
+address column in canonical CIDR form, see canonical_address), stored as a
+flat binary array. Next to it, ListNetworks keeps the network of every
+valid row, so that ranges whose rows were removed can be found through the
+range index, however far consolidation widened them.
+"""
+
+import hashlib
+import ipaddress
+import struct
+from array import array
+from bisect import bisect_left
+from django.db import transaction
+from django.utils import timezone
+from hammer.models import KEY_FIELDS, IPRange
+from hammer.utils import page_cache
+from hammer.utils.ingest import parse_network
+from hammer.utils.range_index import (
+    BITS,
+    NETWORK_CLASSES,
+    V6_OFFSET,
+    address_key,
+    key_version,
+    range_index,
+    row_bounds,
+)
+
+
+def canonical_address(address):
+    """Return address as stored in IPRange.address, e.g. "1.2.3.4" as "1.2.3.4/32".
+
+    Values that are not IP networks are returned stripped.
+    """
+    address = address.strip()
+    try:
+        return ipaddress.ip_network(address, strict=False).compressed
+    except ValueError:
+        return address
+
+
+def _hash(text):
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), "big")
+
+
+def row_key(address):
+    """Return the 64-bit hash identifying a list row."""
+    return _hash(canonical_address(address))
+
+
+class Fingerprint:
+    """Sorted row-key hashes of one version of a list."""
+
+    def __init__(self, hashes=()):
+        self.hashes = array("Q", sorted(set(hashes)))
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def __contains__(self, key):
+        pos = bisect_left(self.hashes, key)
+        return pos < len(self.hashes) and self.hashes[pos] == key
+
+    @classmethod
+    def load(cls, path):
+        """Read a fingerprint file, returning None if there is none."""
+        if not path.is_file():
+            return None
+        fingerprint = cls()
+        fingerprint.hashes.frombytes(path.read_bytes())
+        return fingerprint
+
+    def save(self, path):
+        """Atomically replace the fingerprint file at path."""
+        temp_path = path.with_suffix(".tmp")
+        temp_path.write_bytes(self.hashes.tobytes())
+        temp_path.replace(path)
+
+    def difference(self, other):
+        """Return the hashes in this fingerprint but not in other."""
+        missing = set()
+        pos, theirs = 0, other.hashes
+        for key in self.hashes:
+            pos = bisect_left(theirs, key, pos)
+            if pos == len(theirs) or theirs[pos] != key:
+                missing.add(key)
+        return missing
+
+
+class ListNetworks:
+    """Networks of the valid rows of one version of a list, in address order.
+
+    Each network is kept with its row key, so the networks of removed rows
+    can be found from a fingerprint difference, and by its range_index key,
+    so the rows inside a stored range can be found by bisection.
+    """
+
+    # Row key, high and low 64 bits of the network address, version, prefixlen
+    RECORD = struct.Struct("<QQQBB")
+
+    def __init__(self, entries=()):
+        """entries yields (row key, ipaddress network) pairs."""
+        self._set(
+            sorted(
+                {
+                    (address_key(net.network_address), net.prefixlen, key)
+                    for key, net in entries
+                }
+            )
+        )
+
+    def _set(self, rows):
+        self.starts = [start for start, _, _ in rows]
+        self.prefixlens = array("B", (prefixlen for _, prefixlen, _ in rows))
+        self.keys = array("Q", (key for _, _, key in rows))
+
+    @classmethod
+    def _from_rows(cls, rows):
+        networks = cls()
+        networks._set(rows)
+        return networks
+
+    def rows(self):
+        """Yield the (range_index key, prefixlen, row key) of every row."""
+        return zip(self.starts, self.prefixlens, self.keys)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def entries(self):
+        """Yield the (row key, ipaddress network) of every row."""
+        for start, prefixlen, key in self.rows():
+            version = key_version(start)
+            address = start - V6_OFFSET if version == 6 else start
+            yield key, NETWORK_CLASSES[version]((address, prefixlen))
+
+    def select(self, keys):
+        """Return the rows whose key is in keys, a set or Fingerprint."""
+        return self._from_rows([row for row in self.rows() if row[2] in keys])
+
+    def union(self, other):
+        """Return the rows of this and another ListNetworks."""
+        return self._from_rows(sorted({*self.rows(), *other.rows()}))
+
+    def within(self, start, end):
+        """True if a row lies inside the range_index keys start..end."""
+        pos = bisect_left(self.starts, start)
+        while pos < len(self.starts) and self.starts[pos] <= end:
+            row_start = self.starts[pos]
+            host_bits = BITS[key_version(row_start)] - self.prefixlens[pos]
+            if row_start + (1 << host_bits) - 1 <= end:
+                return True
+            pos += 1
+        return False
+
+    @classmethod
+    def load(cls, path):
+        """Read a networks file, returning None if there is none."""
+        if not path.is_file():
+            return None
+        return cls._from_rows(
+            sorted(
+                (
+                    (hi << 64 | lo) + (V6_OFFSET if version == 6 else 0),
+                    prefixlen,
+                    key,
+                )
+                for key, hi, lo, version, prefixlen in cls.RECORD.iter_unpack(
+                    path.read_bytes()
+                )
+            )
+        )
+
+    def save(self, path):
+        """Atomically replace the networks file at path."""
+        mask = (1 << 64) - 1
+        records = bytearray()
+        for start, prefixlen, key in self.rows():
+            version = key_version(start)
+            address = start - V6_OFFSET if version == 6 else start
+            records += self.RECORD.pack(
+                key, address >> 64, address & mask, version, prefixlen
+            )
+        temp_path = path.with_suffix(".tmp")
+        temp_path.write_bytes(records)
+        temp_path.replace(path)
+
+
+class ListDelta:
+    """Filters list rows down to those missing from the previous fingerprint."""
+
+    def __init__(self, previous=None, full=False):
+        """With no previous fingerprint, or full set, every row counts as added.
+
+        The previous fingerprint is still used to find removed rows when full
+        is set.
+        """
+        self.previous = previous
+        self.full = full or previous is None
+        self.keys = array("Q")
+        # (row key, network) of each added row that is a valid range
+        self.added = []
+
+    def filter(self, rows):
+        """Yield rows that were not in the previous version of the list."""
+        for row in rows:
+            if len(row) != 2:
+                continue
+            key = row_key(row[0])
+            self.keys.append(key)
+            if self.full or key not in self.previous:
+                net = parse_network(row[0])
+                if net is not None:
+                    self.added.append((key, net))
+                yield row
+
+    def current(self):
+        """Return the fingerprint of every row seen by filter."""
+        return Fingerprint(self.keys)
+
+    def removed(self):
+        """Return the keys of rows that disappeared since the previous version."""
+        if self.previous is None:
+            return set()
+        return self.previous.difference(self.current())
+
+    def networks(self, previous_networks):
+        """Return the ListNetworks of the current version of the list.
+
+        previous_networks holds the networks of the previous version, which
+        are kept for the rows that did not change.
+        """
+        added = ListNetworks(self.added)
+        if self.full or previous_networks is None:
+            return added
+        return previous_networks.select(self.current()).union(added)
+
+
+def mark_delisted(removed, keep=(), batch_size=900):
+    """Flag the stored ranges holding rows that were removed from a list.
+
+    removed is the ListNetworks of the removed rows. Each is matched to the
+    stored ranges covering it, whether stored at the same address or merged
+    into a larger range by consolidation. A range is left alone while a row
+    of any of the keep ListNetworks still lies inside it. Returns the number
+    of newly flagged ranges.
+    """
+    candidates = set()
+    for _, net in removed.entries():
+        candidates.update(range_index.covering(net))
+    candidates = sorted(candidates)
+    ids = []
+    for pos in range(0, len(candidates), batch_size):
+        rows = IPRange.objects.filter(
+            id__in=candidates[pos : pos + batch_size], delisted__isnull=True
+        ).values_list("id", *KEY_FIELDS)
+        for range_id, *fields in rows:
+            start, end = row_bounds(*fields)
+            if not any(other.within(start, end) for other in keep):
+                ids.append(range_id)
+    if not ids:
+        return 0
+    now = timezone.now()
+    flagged = 0
+    page_cache.ranges_changed()
+    with transaction.atomic():
+        for pos in range(0, len(ids), batch_size):
+            flagged += IPRange.objects.filter(
+                id__in=ids[pos : pos + batch_size]
+            ).update(delisted=now, last_updated=now)
+    return flagged
+
+
+def clear_delisted(added, batch_size=900):
+    """Unflag stored ranges that a list lists again.
+
+    added is the ListNetworks of the added rows; a flagged range is
+    unflagged once one of them lies inside it.
+    """
+    if not added:
+        return
+    ids = []
+    rows = IPRange.objects.filter(delisted__isnull=False).values_list("id", *KEY_FIELDS)
+    for range_id, *fields in rows.iterator(chunk_size=5000):
+        if added.within(*row_bounds(*fields)):
+            ids.append(range_id)
+    if not ids:
+        return
+    now = timezone.now()
+    page_cache.ranges_changed()
+    with transaction.atomic():
+        for pos in range(0, len(ids), batch_size):
+            IPRange.objects.filter(id__in=ids[pos : pos + batch_size]).update(
+                delisted=None, last_updated=now
+            )
@@ -0,0 +1,71 @@
+"""Loading new ranges through a COPY staging table on PostgreSQL.
+
+A chunk of ranges is streamed with COPY into a temporary table, then merged
+into IPRange with a single INSERT ... SELECT that skips addresses already
+stored. This replaces the existence query and the multi-row INSERT used on
+other backends, and lets PostgreSQL do the duplicate check in the merge.
+"""
+
+import io
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from hammer.models import KEY_FIELDS, IPRange, range_fields
+
+STAGE_TABLE = "hammer_iprange_stage"
+COLUMNS = ", ".join(("address", *KEY_FIELDS, "asn_id", "check_reason"))
+
+
+def copy_supported():
+    """True if new ranges are loaded through COPY.
+
+    Requires PostgreSQL and HAMMER_COPY_LOADS set to True.
+    """
+    return connection.vendor == "postgresql" and getattr(
+        settings, "HAMMER_COPY_LOADS", False
+    )
+
+
+def _text(value):
+    """Escape a value for COPY's text format."""
+    return (
+        value.replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def copy_ranges(ranges):
+    """Insert the ranges whose address is not stored yet.
+
+    ranges yields (network, asn_id, check_reason) tuples. Must run inside
+    a transaction. Returns the (id, address) of each inserted row.
+    """
+    buffer = io.StringIO()
+    for network, asn_id, reason in ranges:
+        values = [network.compressed]
+        values.extend(str(value) for value in range_fields(network).values())
+        values.append("\\N" if asn_id is None else str(asn_id))
+        values.append(_text(reason))
+        buffer.write("\t".join(values) + "\n")
+    buffer.seek(0)
+    now = timezone.now()
+    table = IPRange._meta.db_table  # pylint: disable=protected-access
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"CREATE TEMPORARY TABLE IF NOT EXISTS {STAGE_TABLE} ("
+            "address text, ip_version smallint, start_hi bigint, start_lo bigint, "
+            "end_hi bigint, end_lo bigint, asn_id bigint, check_reason text)"
+        )
+        cursor.copy_expert(f"COPY {STAGE_TABLE} ({COLUMNS}) FROM STDIN", buffer)
+        cursor.execute(
+            f"INSERT INTO {table} "
+            f"({COLUMNS}, scheduled, blocked, date_added, last_updated) "
+            f"SELECT {COLUMNS}, false, false, %s, %s FROM {STAGE_TABLE} "
+            "ON CONFLICT (address) DO NOTHING RETURNING id, address",
+            [now, now],
+        )
+        stored = cursor.fetchall()
+        cursor.execute(f"TRUNCATE {STAGE_TABLE}")
+    return stored
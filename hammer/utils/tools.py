@@ -0,0 +1,43 @@
+"""The tools that can be run from the tools page, and their scheduler.
+
+Downloads only wait on the network, so several run at once. Everything
+writing ranges is in the "ranges" group and runs one at a time; loads also
+wait for the download of their list and for the ASN database update. The
+refresh downloads the lists itself, so it never overlaps their downloads.
+"""
+
+from hammer.utils import bans, consolidate, counters, load_data
+from hammer.utils.jobs import global_manager
+from hammer.utils.jobs.scheduler import Scheduler, Tool
+
+TOOLS = {
+    # Downloads a RIB dump, but also moves ranges whose ASN changed
+    "asnupdate": Tool(load_data.update_asn_db, priority=10, group="ranges"),
+    "enwikidown": Tool(load_data.download_enwiki, "io", priority=10),
+    "globaldown": Tool(load_data.download_global, "io", priority=10),
+    "enwikiload": Tool(
+        load_data.load_enwiki,
+        depends=("enwikidown", "asnupdate"),
+        group="ranges",
+    ),
+    "globalload": Tool(
+        load_data.load_global,
+        depends=("globaldown", "asnupdate"),
+        group="ranges",
+    ),
+    # Downloads everything at once itself, writing the same files as the
+    # list downloads
+    "refresh": Tool(
+        load_data.refresh_all,
+        group="ranges",
+        conflicts=("enwikidown", "globaldown"),
+    ),
+    "consolidate": Tool(consolidate.consolidate_ranges, priority=-10, group="ranges"),
+    "recount": Tool(counters.rebuild, priority=-10, group="ranges"),
+    "reconcile": Tool(load_data.reconcile_block_list, "io", group="ranges"),
+    # Bans are queued by staff, so they start before any queued load, but
+    # they write ranges too and wait for the run in progress to finish
+    "banasn": Tool(bans.ban_asns, priority=20, group="ranges", unique=False),
+}
+
+scheduler = Scheduler(global_manager, TOOLS)
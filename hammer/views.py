@@ -1,14 +1,56 @@
+import hmac
+import ipaddress
+import json
 from datetime import datetime
+from functools import wraps
+from django.conf import settings
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.core.exceptions import PermissionDenied
-from django.core.paginator import Paginator
-from django.http import HttpResponseRedirect
+from django.db.models import Q
+from django.http import (
+    Http404,
+    HttpResponseBadRequest,
+    HttpResponseRedirect,
+    JsonResponse,
+    StreamingHttpResponse,
+)
 from django.shortcuts import render, redirect, reverse
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET, require_POST
 from django.views.generic import TemplateView
 from django.views.generic.detail import DetailView
-from hammer.models import IPRange, ASN
-from hammer.utils import load_data
-from hammer.utils.jobs import global_manager
+from hammer.models import IPRange, ASN, JobRecord
+from hammer.utils import bans, counters, export, load_data, page_cache
+from hammer.utils.asn_cache import asn_resolver
+from hammer.utils.asn_lookup import asn_service
+from hammer.utils.jobs.scheduler import Run
+from hammer.utils.lookup_index import lookup_index
+from hammer.utils.pagination import KeysetPaginator
+from hammer.utils.range_index import ranges_containing, ranges_overlapping
+from hammer.utils.tools import TOOLS, scheduler
+
+JOB_STATUS_LIMIT = 10
+# Most addresses one batch lookup may ask about
+API_BATCH_LIMIT = 1000
+TOP_OFFENDERS_LIMIT = 50
+# Conditions of the list filters, also accepted by export as "status"
+RANGE_FILTERS = {
+    "new": Q(blocked=False, scheduled=False),
+    "pending": Q(scheduled=True),
+    "blocked": Q(blocked=True),
+    "delisted": Q(delisted__isnull=False),
+}
+# Columns rendered by pager.html, fetched with the ASN in a single query
+PAGER_FIELDS = (
+    "id",
+    "address",
+    "check_reason",
+    "scheduled",
+    "blocked",
+    "asn__asn",
+    "asn__description",
+)
 
 
 class SimplePage(TemplateView):
@@ -22,6 +64,42 @@ class SimplePage(TemplateView):
         return context
 
 
+def _static_stamps(_request, *_args, **_kwargs):
+    return ()
+
+
+def _ranges_stamps(_request, *_args, **_kwargs):
+    return page_cache.stamps(page_cache.RANGES)
+
+
+def _asn_ranges_stamps(_request, asn):
+    return page_cache.stamps(
+        page_cache.asn_stamp(asn_resolver.resolve(asn, create=False))
+    )
+
+
+def _address_stamps(_request, pk):
+    return (
+        IPRange.objects.filter(pk=pk)
+        .values_list("last_updated", "asn__last_updated")
+        .first()
+    )
+
+
+def _asn_stamps(_request, asn):
+    return ASN.objects.filter(asn=asn).values_list("last_updated").first()
+
+
+@method_decorator(page_cache.cached_page(_static_stamps), name="get")
+class StaticPage(SimplePage):
+    """A SimplePage whose content only depends on the user, cached per session."""
+
+
+def _waiting():
+    """Names of the tools queued by the scheduler but not started yet."""
+    return [run.name for run in scheduler.queued() if run.state == Run.QUEUED]
+
+
 class ToolsPage(LoginRequiredMixin, SimplePage):
     """Renders a tools page for authenticated users only."""
 
@@ -30,10 +108,14 @@ class ToolsPage(LoginRequiredMixin, SimplePage):
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context["title"] = "Tools"
+        context["jobs"] = JobRecord.objects.order_by("-id")[:JOB_STATUS_LIMIT]
+        context["counts"] = counters.totals()
+        context["waiting"] = _waiting()
         context.update(load_data.get_status())
         return context
 
 
+@method_decorator(page_cache.cached_page(_asn_stamps), name="get")
 class ASNDetail(LoginRequiredMixin, DetailView):
     """Supplies a detailed view of the ASN."""
 
@@ -50,17 +132,20 @@ class ASNDetail(LoginRequiredMixin, DetailView):
         return context
 
 
+@method_decorator(page_cache.cached_page(_address_stamps), name="get")
 class AddressDetail(LoginRequiredMixin, DetailView):
     """Supplies a detailed view of the IP Range."""
 
     template_name = "hammer/detail.html"
-    model = IPRange
+    queryset = IPRange.objects.select_related("asn")
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context["year"] = datetime.now().year
         context["type"] = "Address"
         context["title"] = str(self.object)
+        if asn_service.available:
+            context["announced_asn"] = asn_service.lookup(self.object.range_start_str)
         return context
 
 
@@ -68,23 +153,19 @@ def execute(request, tool):
     """Executes specified tool (if possible)."""
     if not request.user.is_authenticated:
         raise PermissionDenied
-    tool_dict = {
-        "asnupdate": load_data.update_asn_db,
-        "enwikidown": load_data.download_enwiki,
-        "enwikiload": load_data.load_enwiki,
-        "globaldown": load_data.download_global,
-        "globalload": load_data.load_global,
-    }
-    assert tool in tool_dict
+    # Bans need the ASNs and the user, so they are only queued by banasn
+    if tool not in TOOLS or tool == "banasn":
+        raise Http404(f"No tool called {tool}")
     try:
-        global_manager.make_and_register(
-            tool, tool_dict[tool], allow_queue=False, strict=True
-        )
-    except:
+        scheduler.submit(tool)
+    except ValueError:
         opts = {
             "title": "Tools",
             "year": datetime.now().year,
-            "error_msg": f"Tool {tool} is already running",
+            "error_msg": f"Tool {tool} is already queued or running",
+            "jobs": JobRecord.objects.order_by("-id")[:JOB_STATUS_LIMIT],
+            "counts": counters.totals(),
+            "waiting": _waiting(),
         }
         opts.update(load_data.get_status())
         return render(request, "hammer/tools.html", opts)
@@ -96,36 +177,58 @@ def banip(request, ip_id):
     """Updates the status of the specified IP (by id) to pending."""
     if not request.user.is_authenticated:
         raise PermissionDenied
-    address = IPRange.objects.get(id=ip_id)
-    address.scheduled = True
-    address.save()
+    try:
+        bans.ban_range(ip_id, request.user.id)
+    except IPRange.DoesNotExist as err:
+        raise Http404(f"Range {ip_id} is not in the database") from err
     return HttpResponseRedirect(reverse("listf", args=["pending"]))
 
 
+def _queue_asn_bans(request, numbers):
+    """Starts a job banning the given AS numbers and shows its progress."""
+    asn_ids = asn_resolver.resolve_many(numbers, create=False)
+    missing = set(numbers) - asn_ids.keys()
+    if missing:
+        raise Http404(
+            "Not in the database: " + ", ".join(f"AS{asn}" for asn in sorted(missing))
+        )
+    scheduler.submit("banasn", args=(list(asn_ids.values()), request.user.id))
+    return HttpResponseRedirect(reverse("tools"))
+
+
 def banasn(request, asn):
-    """Updates the status of the ASN to banned, sets each IP with this ASN as pending."""
+    """Updates the status of the ASN to banned, sets each IP with this ASN as pending.
+
+    Ranges are updated in batches by a job, whose progress is shown on the
+    tools page.
+    """
     if not request.user.is_authenticated:
         raise PermissionDenied
-    asn_obj = ASN.objects.get(asn=asn)
-    asn_obj.asn_status = ASN.Status.BANNED
-    asn_obj.save()
-    IPRange.objects.filter(asn=asn_obj, blocked=False).update(
-        scheduled=True, last_updated=datetime.now()
-    )
-    return HttpResponseRedirect(reverse("listf", args=["pending"]))
+    return _queue_asn_bans(request, [asn])
+
+
+@require_POST
+def banasns(request):
+    """Bans every ASN selected in the posted "asn" values, like banasn."""
+    if not request.user.is_authenticated:
+        raise PermissionDenied
+    try:
+        numbers = sorted({int(asn) for asn in request.POST.getlist("asn")})
+    except ValueError:
+        numbers = []
+    if not numbers:
+        return HttpResponseRedirect(reverse("top"))
+    return _queue_asn_bans(request, numbers)
 
 
+@page_cache.cached_page(_ranges_stamps)
 def pager(request, filter_by=None):
     """Pages through IP list with optional filter."""
     err_msg = None
     if not request.user.is_authenticated:
         return redirect("home")
-    if filter_by == "new":
-        ip_list = IPRange.objects.filter(blocked=False, scheduled=False)
-    elif filter_by == "pending":
-        ip_list = IPRange.objects.filter(scheduled=True)
-    elif filter_by == "blocked":
-        ip_list = IPRange.objects.filter(blocked=True)
+    if filter_by in RANGE_FILTERS:
+        ip_list = IPRange.objects.filter(RANGE_FILTERS[filter_by])
     else:
         ip_list = IPRange.objects.all()
         if filter_by is not None:
@@ -133,14 +236,15 @@ def pager(request, filter_by=None):
                 "Unrecognized filter, please use the navbar, or report on GitHub"
                 + " if this issue is persistent"
             )
-    paginator = Paginator(ip_list, 50)
-    page_number = request.GET.get("page")
-    page_obj = paginator.get_page(page_number)
+    ip_list = ip_list.select_related("asn").only(*PAGER_FIELDS)
+    paginator = KeysetPaginator(ip_list, 50, count_key=f"list:{filter_by}")
+    page_obj = paginator.page_from_request(request)
     return render(
         request,
         "hammer/pager.html",
         {
             "page_obj": page_obj,
+            "export_query": f"status={filter_by}" if filter_by in RANGE_FILTERS else "",
             "title": "List",
             "year": datetime.now().year,
             "err_msg": err_msg,
@@ -148,28 +252,216 @@ def pager(request, filter_by=None):
     )
 
 
+@page_cache.cached_page(_asn_ranges_stamps)
 def list_asn(request, asn):
     """Lists all IPs attached to a specified ASN."""
     err_msg = None
     if not request.user.is_authenticated:
         return redirect("home")
-    try:
-        asn_obj = ASN.objects.get(asn=asn)
-        ip_list = IPRange.objects.filter(asn=asn_obj)
-    except ASN.DoesNotExist:
+    asn_id = asn_resolver.resolve(asn, create=False)
+    if asn_id is not None:
+        ip_list = IPRange.objects.filter(
+            Q(asn_id=asn_id) | Q(extra_asns=asn_id)
+        ).distinct()
+    else:
         err_msg = f'An ASN with number "{asn}" does not exist in the database!'
         # deliberately fetch an empty set
         ip_list = IPRange.objects.filter(address="empty")
-    paginator = Paginator(ip_list, 50)
-    page_number = request.GET.get("page")
-    page_obj = paginator.get_page(page_number)
+    ip_list = ip_list.select_related("asn").only(*PAGER_FIELDS)
+    paginator = KeysetPaginator(ip_list, 50, count_key=f"asn:{asn}")
+    page_obj = paginator.page_from_request(request)
     return render(
         request,
         "hammer/pager.html",
         {
             "page_obj": page_obj,
+            "export_query": f"asn={asn}",
             "title": "Listing by ASN",
             "year": datetime.now().year,
             "err_msg": err_msg,
         },
     )
+
+
+@page_cache.cached_page(_ranges_stamps)
+def top_asns(request, state=None):
+    """Lists the ASNs with the most ranges, overall or in one review state."""
+    err_msg = None
+    if not request.user.is_authenticated:
+        return redirect("home")
+    states = {state.name.lower(): state for state in counters.State}
+    if state is not None and state not in states:
+        err_msg = f'Unrecognized state "{state}", showing all ranges'
+        state = None
+    return render(
+        request,
+        "hammer/top.html",
+        {
+            "asns": counters.top_offenders(TOP_OFFENDERS_LIMIT, states.get(state)),
+            "state": state,
+            "title": "Top ASNs",
+            "year": datetime.now().year,
+            "err_msg": err_msg,
+        },
+    )
+
+
+def export_ranges(request, fmt):
+    """Streams ranges as csv, jsonl or cidr, optionally by status and ASN.
+
+    With collapse set, the cidr format lists the smallest set of networks
+    covering the selected ranges.
+    """
+    if not request.user.is_authenticated:
+        raise PermissionDenied
+    if fmt not in export.EXPORTERS:
+        raise Http404(f"Unknown export format {fmt}")
+    exporter, content_type = export.EXPORTERS[fmt]
+    ranges = IPRange.objects.all()
+    status = request.GET.get("status")
+    if status:
+        if status not in RANGE_FILTERS:
+            return HttpResponseBadRequest(f"Unknown status {status}")
+        ranges = ranges.filter(RANGE_FILTERS[status])
+    if request.GET.get("asn"):
+        try:
+            asn = int(request.GET["asn"])
+        except ValueError:
+            return HttpResponseBadRequest("asn must be an AS number")
+        asn_id = asn_resolver.resolve(asn, create=False)
+        if asn_id is None:
+            ranges = ranges.none()
+        else:
+            ranges = ranges.filter(Q(asn_id=asn_id) | Q(extra_asns=asn_id)).distinct()
+    if request.GET.get("collapse"):
+        if fmt != "cidr":
+            return HttpResponseBadRequest("Only the cidr format can be collapsed")
+        exporter = export.export_collapsed
+    response = StreamingHttpResponse(exporter(ranges), content_type=content_type)
+    name = "_".join(filter(None, ["ranges", status, request.GET.get("asn")]))
+    response["Content-Disposition"] = f'attachment; filename="{name}.{fmt}"'
+    return response
+
+
+def lookup(request, ip):
+    """Lists stored ranges containing an IP, or overlapping a CIDR, as JSON."""
+    if not request.user.is_authenticated:
+        raise PermissionDenied
+    try:
+        if "/" in ip:
+            network = ipaddress.ip_network(ip, strict=False)
+            ranges = ranges_overlapping(network)
+            announced = network.network_address
+        else:
+            announced = ipaddress.ip_address(ip)
+            ranges = ranges_containing(announced)
+    except ValueError:
+        return JsonResponse(
+            {"error": f"{ip} is not a valid IP address or network"}, status=400
+        )
+    return JsonResponse(
+        {
+            "query": ip,
+            "announced_asn": (
+                asn_service.lookup(announced) if asn_service.available else None
+            ),
+            "ranges": [
+                {
+                    "id": range_id,
+                    "address": address,
+                    "asn": asn,
+                    "scheduled": scheduled,
+                    "blocked": blocked,
+                }
+                for range_id, address, asn, scheduled, blocked in ranges.values_list(
+                    "id", "address", "asn__asn", "scheduled", "blocked"
+                )
+            ],
+        }
+    )
+
+
+def api_token_required(view):
+    """Answer 401 unless the request carries a token from HAMMER_API_TOKENS.
+
+    Tokens are sent as "Authorization: Bearer <token>". The session and
+    user are never loaded, so an authorised request makes no queries.
+    """
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+        if scheme.lower() != "bearer" or not any(
+            hmac.compare_digest(token.encode(), allowed.encode())
+            for allowed in getattr(settings, "HAMMER_API_TOKENS", ())
+        ):
+            return JsonResponse({"error": "A valid API token is required"}, status=401)
+        return view(request, *args, **kwargs)
+
+    return csrf_exempt(wrapper)
+
+
+@api_token_required
+@require_GET
+def api_lookup(_request, ip):
+    """Reports whether an IP is in a stored range, its ASN and whether it is banned."""
+    try:
+        return JsonResponse(lookup_index.lookup(ip))
+    except ValueError:
+        return JsonResponse({"error": f"{ip} is not a valid IP address"}, status=400)
+
+
+@api_token_required
+@require_POST
+def api_lookup_batch(request):
+    """Looks up each IP in a posted {"ips": [...]} like api_lookup.
+
+    Results keep the order of the request; invalid addresses get an error
+    entry instead of failing the whole batch.
+    """
+    try:
+        ips = json.loads(request.body)["ips"]
+        assert isinstance(ips, list)
+    except (ValueError, KeyError, TypeError, AssertionError):
+        return JsonResponse(
+            {"error": 'Expected a JSON body {"ips": [...]}'}, status=400
+        )
+    if len(ips) > API_BATCH_LIMIT:
+        return JsonResponse(
+            {"error": f"At most {API_BATCH_LIMIT} addresses per request"}, status=400
+        )
+    results = []
+    for ip in ips:
+        try:
+            results.append(lookup_index.lookup(str(ip)))
+        except ValueError:
+            results.append({"ip": ip, "error": "Not a valid IP address"})
+    return JsonResponse({"results": results})
+
+
+def job_status(request):
+    """Reports the most recent tool runs as JSON."""
+    if not request.user.is_authenticated:
+        raise PermissionDenied
+    jobs = JobRecord.objects.order_by("-id")[:JOB_STATUS_LIMIT]
+    return JsonResponse(
+        {
+            "jobs": [
+                {
+                    "id": job.id,
+                    "type": job.job_type,
+                    "status": job.status_str,
+                    "queued": job.queued,
+                    "started": job.started,
+                    "finished": job.finished,
+                    "duration": job.duration,
+                    "rows": job.rows_processed,
+                    "throughput": job.throughput,
+                    "peak_memory": job.peak_memory,
+                    "progress": job.progress,
+                    "error": job.error,
+                }
+                for job in jobs
+            ]
+        }
+    )